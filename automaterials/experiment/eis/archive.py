@@ -0,0 +1,293 @@
+# coding: utf-8
+
+"""
+This module provides columnar binary archives of impedance spectra (NPZ,
+Arrow IPC and Parquet), with the metadata of each spectrum stored next to
+the data, and readers that memory-map the files so that spectra come back
+as views without parsing or copying. NPZ needs only NumPy; Arrow and
+Parquet need pyarrow.
+"""
+
+import os
+import struct
+import zipfile
+import numpy as np
+import pandas as pd
+from typing import Dict, Optional, Union
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from automaterials.experiment.eis.properties import (
+    FrequencyGrid, ZData, ZDataCollection, shared_frequency_grid)
+
+__author__ = "Rodolpho Mouta"
+__maintainer__ = "Rodolpho Mouta"
+__email__ = "mouta.rodolpho@gmail.com"
+
+"""
+Constants
+"""
+PYARROW_AVAILABLE = pyarrow is not None
+ARCHIVE_VERSION = '1'
+METADATA_PREFIX = 'metadata.'  # NPZ members holding metadata columns
+UNIFORM_KEY = b'automaterials.uniform'  # Arrow schema metadata
+VERSION_KEY = b'automaterials.version'
+ZIP_LOCAL_HEADER = struct.Struct('<4s5H3L2H')
+
+
+def _as_collection(
+    data: Union["ZData", "ZDataCollection"]
+) -> "ZDataCollection":
+    """
+    Returns data as a collection, a single spectrum without copying it.
+    """
+    if isinstance(data, ZDataCollection):
+        return data
+    return ZDataCollection.from_array(data.f, data.z, copy=False)
+
+
+def _metadata_array(column: pd.Series) -> np.ndarray:
+    """
+    Returns a metadata column as an array that can be saved without pickle:
+    numbers, booleans and dates as they are, anything else as strings.
+    """
+    if column.dtype.kind in 'biufcmM':
+        return column.to_numpy()
+    return column.astype(str).to_numpy(dtype=str)
+
+
+def _require_pyarrow(fmt: str) -> None:
+    if not PYARROW_AVAILABLE:
+        raise ImportError(f'pyarrow is required to read and write {fmt} '
+                          f'archives.')
+
+
+"""
+NPZ
+"""
+
+
+def write_npz(
+    data: Union["ZData", "ZDataCollection"],
+    filename: str,
+    compressed: bool = False
+) -> None:
+    """
+    Writes a spectrum or a collection to a NumPy .npz archive with members
+    f, z (as stored in the collection, (N, n_f) or flat and ragged),
+    offsets and one metadata.<column> per metadata column. Uncompressed
+    archives (the default) can be memory-mapped by read_npz.
+    """
+    collection = _as_collection(data)
+    arrays = {'f': collection.f.view(np.ndarray),
+              'z': collection.z,
+              'offsets': np.asarray(collection.offsets, dtype=np.int64)}
+    for column in collection.metadata.columns:
+        arrays[METADATA_PREFIX + str(column)] = \
+            _metadata_array(collection.metadata[column])
+    save = np.savez_compressed if compressed else np.savez
+    save(filename, **arrays)
+
+
+def _npz_memmaps(filename: str) -> Optional[Dict[str, np.ndarray]]:
+    """
+    Returns the members of an uncompressed .npz archive as read-only
+    memory maps, or None if any member is compressed.
+    """
+    arrays = {}
+    with zipfile.ZipFile(filename) as archive, open(filename, 'rb') as file:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                return None
+            file.seek(info.header_offset)
+            header = ZIP_LOCAL_HEADER.unpack(file.read(ZIP_LOCAL_HEADER.size))
+            # skip the local header, the file name and the extra field
+            file.seek(info.header_offset + ZIP_LOCAL_HEADER.size +
+                      header[-2] + header[-1])
+            version = np.lib.format.read_magic(file)
+            if version == (1, 0):
+                read_header = np.lib.format.read_array_header_1_0
+            else:
+                read_header = np.lib.format.read_array_header_2_0
+            shape, fortran_order, dtype = read_header(file)
+            if dtype.hasobject:
+                return None
+            name = info.filename
+            if name.endswith('.npy'):
+                name = name[:-len('.npy')]
+            if np.prod(shape) == 0:
+                arrays[name] = np.empty(shape, dtype=dtype)
+            else:
+                arrays[name] = np.asarray(np.memmap(
+                    file, dtype=dtype, mode='r', offset=file.tell(),
+                    shape=shape, order='F' if fortran_order else 'C'))
+    return arrays
+
+
+def read_npz(
+    filename: str,
+    mmap: bool = True,
+    **values
+) -> "ZDataCollection":
+    """
+    Returns the collection stored by write_npz. With mmap = True and an
+    uncompressed archive, f and z are memory maps of the file: nothing is
+    read until used, and the spectra are views of the file pages. values
+    select spectra by metadata, as in ZDataCollection.select(), so that
+    only the selected ones are ever read.
+    """
+    arrays = _npz_memmaps(filename) if mmap else None
+    if arrays is None:
+        with np.load(filename, allow_pickle=False) as archive:
+            arrays = {name: archive[name] for name in archive.files}
+    metadata = pd.DataFrame({name[len(METADATA_PREFIX):]: array
+                             for name, array in arrays.items()
+                             if name.startswith(METADATA_PREFIX)})
+    offsets = np.array(arrays['offsets'], dtype=int)
+    if len(metadata.columns) == 0:
+        metadata = None
+    return _collection(arrays['f'], arrays['z'], offsets, metadata, values)
+
+
+def _collection(
+    f: np.ndarray,
+    z: np.ndarray,
+    offsets: np.ndarray,
+    metadata: Optional[pd.DataFrame],
+    values: dict
+) -> "ZDataCollection":
+    """
+    Returns a collection of views of f and z, with the spectra selected by
+    the metadata values, if any.
+    """
+    if z.ndim == 2:
+        f = shared_frequency_grid(f)
+    else:
+        f = f.view(FrequencyGrid)
+        f.flags.writeable = False
+    collection = ZDataCollection._from_parts(f, z, offsets, metadata)
+    return collection.select(**values) if values else collection
+
+
+"""
+Arrow and Parquet
+"""
+
+
+def _table(collection: "ZDataCollection") -> "pyarrow.Table":
+    """
+    Returns an Arrow table with one row per spectrum: the metadata columns,
+    f as a list of doubles and z as a list of (Z_re, Z_im) pairs, so that
+    the values of z are one buffer of interleaved complex128 numbers.
+    """
+    table = pyarrow.Table.from_pandas(collection.metadata,
+                                      preserve_index=False)
+    offsets = pyarrow.array(np.asarray(collection.offsets, dtype=np.int64))
+    f = collection._point_frequencies().ravel()
+    z = np.ascontiguousarray(collection.z).reshape(-1).view(float)
+    pairs = pyarrow.FixedSizeListArray.from_arrays(pyarrow.array(z), 2)
+    lists = pyarrow.LargeListArray.from_arrays
+    table = table.append_column('f', lists(offsets, pyarrow.array(f)))
+    table = table.append_column('z', lists(offsets, pairs))
+    return table.replace_schema_metadata({
+        UNIFORM_KEY: b'1' if collection.is_uniform else b'0',
+        VERSION_KEY: ARCHIVE_VERSION.encode()})
+
+
+def _single_chunk(column: "pyarrow.ChunkedArray") -> "pyarrow.Array":
+    # combine_chunks() copies even a single chunk
+    if column.num_chunks == 1:
+        return column.chunk(0)
+    return column.combine_chunks()
+
+
+def _from_table(table: "pyarrow.Table", values: dict) -> "ZDataCollection":
+    """
+    Returns the collection stored in an Arrow table built by _table, with f
+    and z as views of its buffers when they are in a single chunk.
+    """
+    metadata = table.drop_columns(['f', 'z']).to_pandas()
+    f_list = _single_chunk(table.column('f'))
+    z_list = _single_chunk(table.column('z'))
+    offsets = np.asarray(z_list.offsets.to_numpy(), dtype=int)
+    start, stop = offsets[0], offsets[-1]
+    f = f_list.values.to_numpy()[start:stop]
+    z = z_list.values.values.to_numpy().view(complex)[start:stop]
+    offsets = offsets - start
+    uniform = (table.schema.metadata or {}).get(UNIFORM_KEY) == b'1'
+    if uniform and len(offsets) > 1:
+        n_f = offsets[1]
+        f, z = f[:n_f], z.reshape(-1, n_f)
+    if len(metadata.columns) == 0:
+        metadata = None
+    return _collection(f, z, offsets, metadata, values)
+
+
+def write_arrow(
+    data: Union["ZData", "ZDataCollection"],
+    filename: str
+) -> None:
+    """
+    Writes a spectrum or a collection to an Arrow IPC (Feather v2) file,
+    uncompressed and in one record batch, with one row per spectrum (see
+    read_arrow).
+    """
+    _require_pyarrow('Arrow')
+    table = _table(_as_collection(data))
+    # pyarrow files take str paths only, not os.PathLike
+    with pyarrow.OSFile(os.fspath(filename), 'wb') as sink:
+        with pyarrow.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table, max_chunksize=max(table.num_rows, 1))
+
+
+def read_arrow(filename: str, **values) -> "ZDataCollection":
+    """
+    Returns the collection stored by write_arrow. The file is memory-mapped
+    and f and z are views of it. values select spectra by metadata, as in
+    ZDataCollection.select().
+    """
+    _require_pyarrow('Arrow')
+    source = pyarrow.memory_map(os.fspath(filename), 'r')
+    return _from_table(pyarrow.ipc.open_file(source).read_all(), values)
+
+
+def write_parquet(
+    data: Union["ZData", "ZDataCollection"],
+    filename: str,
+    compression: Optional[str] = 'zstd',
+    row_group_size: Optional[int] = None,
+    **kwargs
+) -> None:
+    """
+    Writes a spectrum or a collection to a Parquet file with one row per
+    spectrum: the metadata columns, f and z (as in write_arrow). Spectra
+    are grouped into row groups of row_group_size, whose metadata statistics
+    let read_parquet skip the groups it does not need.
+    **kwargs: parameters passed through to pyarrow.parquet.write_table().
+    """
+    _require_pyarrow('Parquet')
+    pyarrow.parquet.write_table(_table(_as_collection(data)), filename,
+                                compression=compression,
+                                row_group_size=row_group_size, **kwargs)
+
+
+def read_parquet(
+    filename: str,
+    **values
+) -> "ZDataCollection":
+    """
+    Returns the collection stored by write_parquet. values select spectra
+    by metadata, as in ZDataCollection.select(), and are pushed down to the
+    reader, so that only the row groups with matching spectra are decoded.
+    """
+    _require_pyarrow('Parquet')
+    filters = [(column, '==', value)
+               for column, value in values.items()] or None
+    table = pyarrow.parquet.read_table(filename, filters=filters,
+                                       memory_map=True)
+    return _from_table(table, {})
@@ -4,23 +4,179 @@
 This module provides classes used to define electrical elements and circuits.
 """
 
+import copy
+import weakref
 import numpy as np
 import pandas as pd
 from abc import ABCMeta, abstractmethod
-from typing import Dict, List, Optional, Union
+from typing import Dict, List, Optional, Tuple, Union
 
-from automaterials.experiment.eis.properties import ZData, omega, f, F_DEFAULT
+from automaterials.experiment.eis.properties import (
+    ZData, FrequencyGrid, as_frequency_grid, f, F_DEFAULT)
+from automaterials.experiment.eis.compiled import CompiledCircuit, z_output
+from automaterials.experiment.eis import jit, sweep
+from automaterials.utils.constants import I, PI
 
 __author__ = "Rodolpho Mouta"
 __maintainer__ = "Rodolpho Mouta"
 __email__ = "mouta.rodolpho@gmail.com"
 
+"""
+Simplification rules
+"""
+# how the values of elements of the same kind combine when they are merged,
+# keyed by (association symbol, element symbol)
+MERGE_RULES = {('-', 'R'): 'sum', ('-', 'L'): 'sum',
+               ('-', 'C'): 'reciprocal_sum',
+               ('//', 'R'): 'reciprocal_sum', ('//', 'L'): 'reciprocal_sum',
+               ('//', 'C'): 'sum'}
+
+
+def _is_cacheable(f) -> bool:
+    return isinstance(f, FrequencyGrid) and not f.flags.writeable
+
+
+def _z_cached(
+    piece: Union["ElectricalElement", "Circuit"],
+    f: Union[float, int, List[Union[int, float]], np.ndarray],
+    dtype: Optional[Union[type, np.dtype]] = None
+) -> Union[complex, np.ndarray]:
+    """
+    Returns piece.z(f, dtype=dtype), reusing the impedance of the last call
+    if f is the same read-only FrequencyGrid, dtype is the same and no
+    parameter of the piece changed since. Only the last grid is kept. The
+    returned array is shared with the cache and must not be modified.
+    """
+    if not _is_cacheable(f):
+        return piece.z(f, dtype=dtype)
+    dtype = np.dtype(dtype if dtype is not None else complex)
+    pieces = getattr(piece, 'pieces', None)
+    cache = piece._z_cache
+    if (cache is not None and cache[0] is f and cache[1] is pieces
+            and cache[2] == dtype):
+        return cache[3]
+    z = piece.z(f, dtype=dtype)
+    piece._z_cache = (f, pieces, dtype, z)
+    return z
+
+
+def _add_parent(
+    piece: Union["ElectricalElement", "Circuit"],
+    parent: "Circuit"
+) -> None:
+    piece._parents = [ref for ref in piece._parents if ref() is not None]
+    piece._parents.append(weakref.ref(parent))
+
+
+def _invalidate(piece: Union["ElectricalElement", "Circuit"]) -> None:
+    """
+    Drops the cached impedance of piece and of every circuit containing it.
+    A circuit only caches its impedance after caching those of its pieces,
+    so the walk stops at pieces with nothing cached.
+    """
+    if piece._z_cache is None:
+        return
+    piece._z_cache = None
+    for ref in piece._parents:
+        parent = ref()
+        if parent is not None:
+            _invalidate(parent)
+
+
+def _invalidate_structure(circuit: "Circuit") -> None:
+    """
+    Drops everything cached from the structure of circuit (impedance,
+    compiled plan, topology and expanded form) and of every circuit
+    containing it. Unlike _invalidate, the walk goes up to the root, since
+    a circuit may hold a plan without having cached any impedance.
+    """
+    for name in ('_plan', '_topology', '_expanded'):
+        circuit.__dict__.pop(name, None)
+    circuit._z_cache = None
+    for ref in circuit._parents:
+        parent = ref()
+        if parent is not None:
+            _invalidate_structure(parent)
+
+
+def _parameter(name: str) -> property:
+    """
+    Returns a property that reads and writes the parameter name in the
+    storage of an element. It is None for elements without that parameter.
+    """
+    def getter(self) -> Optional[float]:
+        if name in self.param_names:
+            return float(self._values[self.param_names.index(name)])
+        return None
+
+    def setter(self, value: float) -> None:
+        if name not in self.param_names:
+            raise AttributeError(
+                f'{type(self).__name__} has no parameter {name}.')
+        self._values[self.param_names.index(name)] = value
+        _invalidate(self)
+
+    return property(getter, setter)
+
+
+def _admittance_derivatives(
+    derivatives: List[np.ndarray],
+    value: np.ndarray,
+    admittance: bool
+) -> List[np.ndarray]:
+    """
+    Returns derivatives of the impedance as those of the admittance value if
+    admittance = True, as d(1/Z) = -dZ*Y**2, or unchanged otherwise.
+    """
+    if not admittance:
+        return derivatives
+    factor = -value*value
+    return [derivative*factor for derivative in derivatives]
+
+
+def _jomega_tau_power(grid: FrequencyGrid, tau, p) -> np.ndarray:
+    """
+    Returns (i*omega*tau)**p, for scalars or columns of parameter values.
+    """
+    if np.ndim(p) == 0 and np.ndim(tau) == 0:
+        return grid.jomega_power(p)*tau**p
+    return np.exp(p*(grid.log_jomega + np.log(tau)))
+
+
+
 class ElectricalElement(metaclass = ABCMeta):
     """
     Generic electrical element. This serves as an abstract base class for 
-    Resistor, Capacitor, CPE, and Inductor. Not meant to be instantiated 
-    directly. 
+    Resistor, Capacitor, CPE, and Inductor, and for the distributed elements
+    (Warburg, WarburgShort, WarburgOpen, Gerischer, HavriliakNegami and
+    TransmissionLine). Not meant to be instantiated directly.
+
+    The parameter values are stored in a small float64 array, in the order
+    of param_names. Once the element is compiled into a circuit, this array
+    is a view into the parameter vector of the compiled plan, so both always
+    hold the same values.
+
+    Circuits cache the impedance of their pieces on read-only frequency
+    grids. Each element keeps weak references to the circuits that contain
+    it, which are invalidated whenever one of its parameters changes.
     """
+    __slots__ = ('_values', 'label', '_parents', '_z_cache')
+    symbol = None
+    param_names = ()
+    log_params = ()
+    jit_code = None
+    R = _parameter('R')
+    C = _parameter('C')
+    L = _parameter('L')
+    T = _parameter('T')
+    p = _parameter('p')
+    sigma = _parameter('sigma')
+    tau = _parameter('tau')
+    alpha = _parameter('alpha')
+    beta = _parameter('beta')
+    R_ion = _parameter('R_ion')
+    R_ct = _parameter('R_ct')
+
     def __init__(
         self,
         R: Optional[float] = None,
@@ -28,23 +184,57 @@ class ElectricalElement(metaclass = ABCMeta):
         L: Optional[float] = None,
         T: Optional[float] = None, 
         p: Optional[float] = None,
-        label: Optional[float] = None
+        label: Optional[float] = None,
+        sigma: Optional[float] = None,
+        tau: Optional[float] = None,
+        alpha: Optional[float] = None,
+        beta: Optional[float] = None,
+        R_ion: Optional[float] = None,
+        R_ct: Optional[float] = None
     ):
         """
         Pending
         """
-        self.R = R
-        self.C = C
-        self.L = L
-        self.T = T
-        self.p = p
-        self.parameters = {'R':self.R, 
-                           'C':self.C, 
-                           'L':self.L,
-                           'T':self.T,
-                           'p':self.p}
+        given = {'R': R, 'C': C, 'L': L, 'T': T, 'p': p, 'sigma': sigma,
+                 'tau': tau, 'alpha': alpha, 'beta': beta, 'R_ion': R_ion,
+                 'R_ct': R_ct}
+        self._values = np.array([given[name] for name in self.param_names],
+                                dtype=float)
         self.label = label
-        
+        self._parents = []
+        self._z_cache = None
+
+    def invalidate_cache(self) -> None:
+        """
+        Drops the cached impedances of the circuits containing the element.
+        Only needed after writing into its values directly.
+        """
+        _invalidate(self)
+
+    def __getstate__(self) -> dict:
+        # caches and links to parent circuits are not copied
+        state = {}
+        for cls in type(self).__mro__:
+            for name in getattr(cls, '__slots__', ()):
+                if (name not in ('_parents', '_z_cache')
+                        and hasattr(self, name)):
+                    state[name] = getattr(self, name)
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        for name, value in state.items():
+            setattr(self, name, value)
+        self._parents = []
+        self._z_cache = None
+
+    @property
+    def parameters(self) -> Dict[str, Optional[float]]:
+        return {'R': self.R,
+                'C': self.C,
+                'L': self.L,
+                'T': self.T,
+                'p': self.p,
+                **{name: getattr(self, name) for name in self.param_names}}
 
     def __sub__(self, other: Union["ElectricalElement", "Circuit"]) -> "SeriesCircuit":
         """
@@ -75,7 +265,12 @@ class ElectricalElement(metaclass = ABCMeta):
             return ParallelCircuit(self, other)
 
     def __eq__(self, other: Union["ElectricalElement", "Circuit"]) -> bool:
-        if isinstance(other, ElectricalElement):
+        """
+        Two elements are equal if they have the same symbol, and hence the
+        same hash, and equal parameter values. Labels are ignored.
+        """
+        if (isinstance(other, ElectricalElement)
+                and self.symbol == other.symbol):
             return self.parameters == other.parameters
         else:
             return False
@@ -83,12 +278,165 @@ class ElectricalElement(metaclass = ABCMeta):
     def __ne__(self, other: Union["ElectricalElement", "Circuit"]) -> bool:
         return not self.__eq__(other)
 
+    def __hash__(self) -> int:
+        # the topology never changes, unlike the parameter values
+        return hash(self.topology)
+
+    def canonical_form(self, with_values: bool = False) -> str:
+        """
+        Returns the element symbol, followed by the parameter values in
+        parentheses if with_values = True, e.g. 'Q(1e-06, 0.9)'.
+        """
+        if with_values:
+            values = ', '.join(repr(value) for value in self.values)
+            return f'{self.symbol}({values})'
+        return self.symbol
+
+    @property
+    def topology(self) -> str:
+        return self.symbol
+
+    def z(
+        self,
+        f: Union[float, int, List[Union[int, float]], np.ndarray] = F_DEFAULT,
+        out: Optional[np.ndarray] = None,
+        dtype: Optional[Union[type, np.dtype]] = None
+    ) -> Union[complex, np.ndarray]:
+        """
+        Returns the impedance, computed by the kernel of the element. It is
+        written into out, if given, with the shape of f. dtype (complex128 or
+        complex64) sets the precision of the output.
+        """
+        grid = as_frequency_grid(f)
+        z = z_output(out, grid.shape, dtype)
+        grid = grid.with_precision(z.dtype)
+        self.kernel(grid, list(self._values.astype(grid.dtype, copy=False)), z)
+        return complex(z[0]) if np.ndim(f) == 0 else z
+
+    @staticmethod
     @abstractmethod
-    def z(self, f):
+    def kernel(
+        grid: FrequencyGrid,
+        values: np.ndarray,
+        out: np.ndarray,
+        admittance: bool = False
+    ) -> np.ndarray:
         """
-        Returns the impedance.
+        Writes the impedance (or the admittance, if admittance = True) into
+        out, given the frequency grid and the parameter values in the order
+        of param_names. Each value may be a scalar or a column array, so that
+        many parameter sets are evaluated at once by broadcasting.
         """
 
+    @staticmethod
+    @abstractmethod
+    def dkernel(
+        grid: FrequencyGrid,
+        values: np.ndarray,
+        value: np.ndarray,
+        admittance: bool = False
+    ) -> List[np.ndarray]:
+        """
+        Returns the derivatives of the impedance (or of the admittance, if
+        admittance = True) with respect to each parameter, given the frequency
+        grid, the parameter values and the value already computed by
+        kernel(). Each derivative may be a scalar or an array that broadcasts
+        to value.
+        """
+
+    @property
+    def values(self) -> List[float]:
+        return self._values.tolist()
+
+    def dz_dparams(
+        self,
+        f: Union[float, int, List[Union[int, float]], np.ndarray] = F_DEFAULT
+    ) -> np.ndarray:
+        """
+        Returns an (n_params, len(f)) array with the derivatives of the
+        impedance with respect to each parameter, in the order of
+        param_names.
+        """
+        grid = as_frequency_grid(f)
+        values = self.values
+        z = self.kernel(grid, values, np.empty(grid.size, dtype=complex))
+        derivatives = self.dkernel(grid, values, z)
+        return np.array([np.broadcast_to(d, z.shape) for d in derivatives])
+
+    def _z_and_dz(
+        self,
+        grid: FrequencyGrid,
+        offsets: Dict[int, int],
+        n_params: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the impedance and its derivatives with respect to all the
+        n_params parameters of an enclosing circuit, where offsets maps each
+        element to the position of its first parameter.
+        """
+        values = self.values
+        z = self.kernel(grid, values, np.empty(grid.size, dtype=complex))
+        dz = np.zeros((n_params, grid.size), dtype=complex)
+        derivatives = self.dkernel(grid, values, z)
+        for row, derivative in enumerate(derivatives, offsets[id(self)]):
+            dz[row] += derivative
+        return z, dz
+
+    def compile(self) -> CompiledCircuit:
+        """
+        Returns a flat evaluation plan for the element.
+        """
+        return CompiledCircuit(self)
+
+    def simplify(
+        self,
+        fixed: Optional[List[str]] = None,
+        keep: Optional[List[str]] = None
+    ) -> "Simplification":
+        return Simplification(self.compile(), fixed, keep)
+
+    def z_batch(
+        self,
+        f: Union[float, int, List[Union[int, float]], np.ndarray],
+        params: np.ndarray,
+        out: Optional[np.ndarray] = None,
+        dtype: Optional[Union[type, np.dtype]] = None
+    ) -> np.ndarray:
+        """
+        Returns an (N, len(f)) array with the impedance for each row of
+        params, an (N, n_params) array whose columns follow param_names.
+        out and dtype are as in CompiledCircuit.z().
+        """
+        return self.compile().z_batch(f, params, out, dtype)
+
+    def sweep(
+        self,
+        param_name: str,
+        values: np.ndarray,
+        f: Union[float, int, List[Union[int, float]], np.ndarray] = F_DEFAULT
+    ) -> "sweep.SweepResult":
+        """
+        Returns the impedance for each value of the parameter param_name (as
+        in param_names), the others fixed at their current values, and the
+        normalized sensitivities to all parameters, from one batched
+        evaluation. See sweep.SweepResult.
+        """
+        return sweep.sweep(self, param_name, values, f)
+
+    def sweep2d(
+        self,
+        param_x: str,
+        values_x: np.ndarray,
+        param_y: str,
+        values_y: np.ndarray,
+        f: Union[float, int, List[Union[int, float]], np.ndarray] = F_DEFAULT
+    ) -> "sweep.SweepResult":
+        """
+        As sweep(), over the grid of values_x of param_x by values_y of
+        param_y.
+        """
+        return sweep.sweep2d(self, param_x, values_x, param_y, values_y, f)
+
     def zdata_as_dict(
         self,
         f: Union[float, int, List[Union[int, float]], np.ndarray] = F_DEFAULT,
@@ -207,23 +555,28 @@ class Resistor(ElectricalElement):
     """
     An ElectricalElement subclass representing a resistor.
     """
+    __slots__ = ()
+    symbol = 'R'
+    jit_code = jit.RESISTOR
+    param_names = ('R',)
+    log_params = ('R',)
+
     def __init__(self, R: float, label: str = 'R'):
         """
         Pending
         """
         super().__init__(R = R, label = label)
 
-    def z(
-        self, 
-        f: Union[float, int, List[Union[int, float]], np.ndarray] = F_DEFAULT,
-    ) -> Union[complex, np.ndarray]:
-        """
-        Pending
-        """
-        z = complex(self.R, 0)
-        if isinstance(f, (list, np.ndarray)):
-            z = z*np.ones(len(f))
-        return z
+    @staticmethod
+    def kernel(grid, values, out, admittance=False):
+        R, = values
+        out[...] = 1/R if admittance else R
+        return out
+
+    @staticmethod
+    def dkernel(grid, values, value, admittance=False):
+        R, = values
+        return [-1/R**2 if admittance else 1.0]
     
     def as_dict(self) -> Dict[str,float]:
         return {self.label:self.R}
@@ -233,26 +586,31 @@ class Capacitor(ElectricalElement):
     """
     An ElectricalElement subclass representing a capacitor.
     """
+    __slots__ = ()
+    symbol = 'C'
+    jit_code = jit.CAPACITOR
+    param_names = ('C',)
+    log_params = ('C',)
+
     def __init__(self, C: float, label: str = 'C'):
         """
         Pending
         """
         super().__init__(C = C, label = label)
 
+    @staticmethod
+    def kernel(grid, values, out, admittance=False):
+        C, = values
+        np.multiply(grid.jomega, C, out=out)
+        if not admittance:
+            np.reciprocal(out, out=out)
+        return out
+
+    @staticmethod
+    def dkernel(grid, values, value, admittance=False):
+        C, = values
+        return [grid.jomega if admittance else -value/C]
 
-    def z(
-        self, 
-        f: Union[float, int, List[Union[int, float]], np.ndarray] = F_DEFAULT,
-    ) -> Union[complex, np.ndarray]:
-        """
-        Pending
-        """
-        w = omega(f)
-        i = complex(0,1)
-        denominator = i*w*self.C
-        z = 1/denominator          
-        return z
-    
     def as_dict(self) -> Dict[str,float]:
         return {self.label:self.C}
 
@@ -262,24 +620,42 @@ class CPE(ElectricalElement):
     An ElectricalElement subclass representing a constant phase element (CPE).
     Identical to the class Q.
     """
+    __slots__ = ()
+    symbol = 'Q'
+    jit_code = jit.CONSTANT_PHASE
+    param_names = ('T', 'p')
+    log_params = ('T',)
+
     def __init__(self, T: float, p: float, label: str = 'Q'):
         super().__init__(T = T, p = p, label = label)
         """
         Pending
         """
 
-    def z(
-        self, 
-        f: Union[float, int, List[Union[int, float]], np.ndarray] = F_DEFAULT,
-    ) -> Union[complex, np.ndarray]:
-        """
-        Pending
-        """
-        w = omega(f)
-        i = complex(0,1)
-        denominator = self.T*(i*w)**self.p
-        z = 1/denominator          
-        return z
+    @staticmethod
+    def kernel(grid, values, out, admittance=False):
+        T, p = values
+        if np.ndim(p) == 0:
+            # (i*w)**p is looked up in the tables cached by the grid
+            np.multiply(grid.jomega_power(p), T, out=out)
+        else:
+            # (i*w)**p = w**p*exp(i*p*pi/2), so only a real power is needed
+            magnitude = out.real
+            if magnitude.dtype == np.float32:
+                # float32 exp is much slower on the strided real part of out
+                magnitude = np.empty(out.shape, dtype=np.float32)
+            np.multiply(grid.log_omega, p, out=magnitude)
+            np.exp(magnitude, out=magnitude)
+            np.multiply(magnitude, T*np.exp(I*PI/2*p), out=out)
+        if not admittance:
+            np.reciprocal(out, out=out)
+        return out
+
+    @staticmethod
+    def dkernel(grid, values, value, admittance=False):
+        T, p = values
+        sign = 1 if admittance else -1
+        return [sign*value/T, sign*value*grid.log_jomega]
     
     def as_dict(self) -> Dict[str,Dict[str,float]]:
         return {self.label:{'T':self.T, 'p':self.p}}
@@ -289,32 +665,318 @@ class Inductor(ElectricalElement):
     """
     An ElectricalElement subclass representing an inductor.
     """
+    __slots__ = ()
+    symbol = 'L'
+    jit_code = jit.INDUCTOR
+    param_names = ('L',)
+    log_params = ('L',)
+
     def __init__(self, L: float, label: str = 'L'):
         super().__init__(L = L, label = label)
         """
         Pending
         """
 
-    def z(
-        self, 
-        f: Union[float, int, List[Union[int, float]], np.ndarray] = F_DEFAULT,
-    ) -> Union[complex, np.ndarray]:
+    @staticmethod
+    def kernel(grid, values, out, admittance=False):
+        L, = values
+        np.multiply(grid.jomega, L, out=out)
+        if admittance:
+            np.reciprocal(out, out=out)
+        return out
+
+    @staticmethod
+    def dkernel(grid, values, value, admittance=False):
+        L, = values
+        return [-value/L if admittance else grid.jomega]
+
+    def as_dict(self) -> Dict[str, float]:
+        return {self.label: self.L}
+
+
+class Warburg(ElectricalElement):
+    """
+    An ElectricalElement subclass representing a semi-infinite Warburg
+    diffusion element, Z = sigma*(1 - i)/sqrt(omega) = sigma*sqrt(2/(i*omega)).
+    """
+    __slots__ = ()
+    symbol = 'W'
+    param_names = ('sigma',)
+    log_params = ('sigma',)
+
+    def __init__(self, sigma: float, label: str = 'W'):
         """
         Pending
         """
-        w = omega(f)
-        i = complex(0,1)
-        z = i*w*self.L          
-        return z
-    
+        super().__init__(sigma=sigma, label=label)
+
+    @staticmethod
+    def kernel(grid, values, out, admittance=False):
+        sigma, = values
+        np.multiply(grid.jomega_power(-0.5), sigma*np.sqrt(2), out=out)
+        if admittance:
+            np.reciprocal(out, out=out)
+        return out
+
+    @staticmethod
+    def dkernel(grid, values, value, admittance=False):
+        sigma, = values
+        return [-value/sigma if admittance else value/sigma]
+
     def as_dict(self) -> Dict[str,float]:
-        return {self.label:self.L}
+        return {self.label: self.sigma}
+
+
+class WarburgShort(ElectricalElement):
+    """
+    An ElectricalElement subclass representing a finite-length Warburg
+    element (transmissive boundary), Z = R*tanh(s)/s with
+    s = sqrt(i*omega*tau), where R is the diffusion resistance and
+    tau = L**2/D the diffusion time.
+    """
+    __slots__ = ()
+    symbol = 'Ws'
+    param_names = ('R', 'tau')
+    log_params = ('R', 'tau')
+
+    def __init__(self, R: float, tau: float, label: str = 'Ws'):
+        """
+        Pending
+        """
+        super().__init__(R=R, tau=tau, label=label)
+
+    @staticmethod
+    def kernel(grid, values, out, admittance=False):
+        R, tau = values
+        s = np.sqrt(grid.jomega*tau)
+        np.divide(np.tanh(s), s, out=out)
+        np.multiply(out, R, out=out)
+        if admittance:
+            np.reciprocal(out, out=out)
+        return out
+
+    @staticmethod
+    def dkernel(grid, values, value, admittance=False):
+        R, tau = values
+        z = 1/value if admittance else value
+        # d(tanh(s)/s)/dtau = (sech(s)**2 - tanh(s)/s)/(2*tau)
+        tanh = np.tanh(np.sqrt(grid.jomega*tau))
+        derivatives = [z/R, (R*(1 - tanh*tanh) - z)/(2*tau)]
+        return _admittance_derivatives(derivatives, value, admittance)
+
+    def as_dict(self) -> Dict[str, Dict[str, float]]:
+        return {self.label: {'R': self.R, 'tau': self.tau}}
+
+
+class WarburgOpen(ElectricalElement):
+    """
+    An ElectricalElement subclass representing a finite-space Warburg
+    element (reflective boundary), Z = R*coth(s)/s with s = sqrt(i*omega*tau).
+    At low frequencies it tends to R/3 in series with a capacitance tau/R,
+    as for diffusion towards a blocking boundary.
+    """
+    __slots__ = ()
+    symbol = 'Wo'
+    param_names = ('R', 'tau')
+    log_params = ('R', 'tau')
+
+    def __init__(self, R: float, tau: float, label: str = 'Wo'):
+        """
+        Pending
+        """
+        super().__init__(R=R, tau=tau, label=label)
+
+    @staticmethod
+    def kernel(grid, values, out, admittance=False):
+        R, tau = values
+        s = np.sqrt(grid.jomega*tau)
+        np.multiply(np.tanh(s), s, out=out)
+        np.divide(R, out, out=out)
+        if admittance:
+            np.reciprocal(out, out=out)
+        return out
+
+    @staticmethod
+    def dkernel(grid, values, value, admittance=False):
+        R, tau = values
+        z = 1/value if admittance else value
+        # d(coth(s)/s)/dtau = -(csch(s)**2 + coth(s)/s)/(2*tau)
+        coth = 1/np.tanh(np.sqrt(grid.jomega*tau))
+        derivatives = [z/R, -(R*(coth*coth - 1) + z)/(2*tau)]
+        return _admittance_derivatives(derivatives, value, admittance)
+
+    def as_dict(self) -> Dict[str, Dict[str, float]]:
+        return {self.label: {'R': self.R, 'tau': self.tau}}
+
+
+class Gerischer(ElectricalElement):
+    """
+    An ElectricalElement subclass representing a Gerischer element,
+    Z = R/sqrt(1 + i*omega*tau), as for diffusion coupled to a chemical
+    reaction, e.g. in mixed-conducting electrodes.
+    """
+    __slots__ = ()
+    symbol = 'G'
+    param_names = ('R', 'tau')
+    log_params = ('R', 'tau')
+
+    def __init__(self, R: float, tau: float, label: str = 'G'):
+        """
+        Pending
+        """
+        super().__init__(R=R, tau=tau, label=label)
+
+    @staticmethod
+    def kernel(grid, values, out, admittance=False):
+        R, tau = values
+        np.multiply(grid.jomega, tau, out=out)
+        out += 1
+        np.sqrt(out, out=out)
+        np.divide(R, out, out=out)
+        if admittance:
+            np.reciprocal(out, out=out)
+        return out
+
+    @staticmethod
+    def dkernel(grid, values, value, admittance=False):
+        R, tau = values
+        z = 1/value if admittance else value
+        jomega_tau = grid.jomega*tau
+        derivatives = [z/R, -z*jomega_tau/(2*tau*(1 + jomega_tau))]
+        return _admittance_derivatives(derivatives, value, admittance)
+
+    def as_dict(self) -> Dict[str, Dict[str, float]]:
+        return {self.label: {'R': self.R, 'tau': self.tau}}
+
+
+class HavriliakNegami(ElectricalElement):
+    """
+    An ElectricalElement subclass representing a Havriliak-Negami relaxation,
+    Z = R/(1 + (i*omega*tau)**alpha)**beta, which is an RC for alpha = beta
+    = 1, an RQ (Cole-Cole) for beta = 1 and Cole-Davidson for alpha = 1.
+    """
+    __slots__ = ()
+    symbol = 'H'
+    param_names = ('R', 'tau', 'alpha', 'beta')
+    log_params = ('R', 'tau')
+
+    def __init__(
+        self,
+        R: float,
+        tau: float,
+        alpha: float,
+        beta: float,
+        label: str = 'H'
+    ):
+        """
+        Pending
+        """
+        super().__init__(R=R, tau=tau, alpha=alpha, beta=beta, label=label)
+
+    @staticmethod
+    def kernel(grid, values, out, admittance=False):
+        R, tau, alpha, beta = values
+        out[...] = _jomega_tau_power(grid, tau, alpha)
+        out += 1
+        np.power(out, beta, out=out)
+        np.divide(R, out, out=out)
+        if admittance:
+            np.reciprocal(out, out=out)
+        return out
+
+    @staticmethod
+    def dkernel(grid, values, value, admittance=False):
+        R, tau, alpha, beta = values
+        z = 1/value if admittance else value
+        x = _jomega_tau_power(grid, tau, alpha)
+        ratio = -z*beta*x/(1 + x)
+        derivatives = [z/R,
+                       ratio*alpha/tau,
+                       ratio*(grid.log_jomega + np.log(tau)),
+                       -z*np.log(1 + x)]
+        return _admittance_derivatives(derivatives, value, admittance)
+
+    def as_dict(self) -> Dict[str, Dict[str, float]]:
+        return {self.label: {'R': self.R, 'tau': self.tau, 'alpha': self.alpha,
+                             'beta': self.beta}}
+
+
+class TransmissionLine(ElectricalElement):
+    """
+    An ElectricalElement subclass representing a uniform transmission-line
+    model of a porous electrode, the limit of an infinite ladder of ionic
+    resistances in the pores and R//Q interfaces to the solid:
+    Z = sqrt(R_ion*Z_int)*coth(sqrt(R_ion/Z_int)), where R_ion is the total
+    ionic resistance of the pores and Z_int = R_ct//Q the total interfacial
+    impedance (charge-transfer resistance R_ct, CPE T and p). A very large
+    R_ct gives a blocking electrode.
+    """
+    __slots__ = ()
+    symbol = 'TLM'
+    param_names = ('R_ion', 'R_ct', 'T', 'p')
+    log_params = ('R_ion', 'R_ct', 'T')
+
+    def __init__(
+        self,
+        R_ion: float,
+        R_ct: float,
+        T: float,
+        p: float,
+        label: str = 'TLM'
+    ):
+        """
+        Pending
+        """
+        super().__init__(R_ion=R_ion, R_ct=R_ct, T=T, p=p, label=label)
+
+    @staticmethod
+    def _interface(grid, values) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the interfacial admittance and u = sqrt(R_ion*Y_int).
+        """
+        R_ion, R_ct, T, p = values
+        y_int = _jomega_tau_power(grid, 1.0, p)*T + 1/R_ct
+        return y_int, np.sqrt(R_ion*y_int)
+
+    @staticmethod
+    def kernel(grid, values, out, admittance=False):
+        R_ion = values[0]
+        y_int, u = TransmissionLine._interface(grid, values)
+        # Z = R_ion*coth(u)/u
+        np.multiply(np.tanh(u), u, out=out)
+        np.divide(R_ion, out, out=out)
+        if admittance:
+            np.reciprocal(out, out=out)
+        return out
+
+    @staticmethod
+    def dkernel(grid, values, value, admittance=False):
+        R_ion, R_ct, T, p = values
+        z = 1/value if admittance else value
+        y_int, u = TransmissionLine._interface(grid, values)
+        g = z/R_ion
+        coth = 1/np.tanh(u)
+        csch2 = coth*coth - 1
+        # Z = R_ion*g(u), g(u) = coth(u)/u, and u*g'(u) = -(csch(u)**2 + g)
+        dz_dy = -R_ion*(csch2 + g)/(2*y_int)
+        power = _jomega_tau_power(grid, 1.0, p)
+        derivatives = [(g - csch2)/2,
+                       -dz_dy/(R_ct*R_ct),
+                       dz_dy*power,
+                       dz_dy*T*power*grid.log_jomega]
+        return _admittance_derivatives(derivatives, value, admittance)
+
+    def as_dict(self) -> Dict[str, Dict[str, float]]:
+        return {self.label: {'R_ion': self.R_ion, 'R_ct': self.R_ct,
+                             'T': self.T, 'p': self.p}}
 
 
 class R(Resistor):
     """
     Shorthand for the class Resistor.  
     """
+    __slots__ = ()
+
     def __init__(self, R: float, label: str = 'R'):
         super().__init__(R = R, label = label)
         """
@@ -326,6 +988,8 @@ class C(Capacitor):
     """
     Shorthand for the class Capacitor.  
     """
+    __slots__ = ()
+
     def __init__(self, C: float, label: str = 'C'):
         super().__init__(C = C, label = label)
         """
@@ -337,6 +1001,8 @@ class Q(CPE):
     """
     Shorthand for the class CPE  
     """
+    __slots__ = ()
+
     def __init__(self, T: float, p: float, label: str = 'Q'):
         super().__init__(T = T, p = p, label = label)
         """
@@ -348,6 +1014,8 @@ class L(Inductor):
     """
     Shorthand for the class Inductor.  
     """
+    __slots__ = ()
+
     def __init__(self, L: float, label: str = 'L'):
         super().__init__(L = L, label = label)
         """
@@ -393,23 +1061,71 @@ class Circuit(metaclass=ABCMeta):
         return ParallelCircuit(*parallel_pieces)
     
     def __eq__(self, other: Union["ElectricalElement", "Circuit"]) -> bool:
-        if isinstance(other, Circuit) and len(self) == len(other):
-            both_are_parallel_circuits = self.is_parallel_circuit and other.is_parallel_circuit
-            both_are_series_circuits = self.is_series_circuit and other.is_series_circuit
-            if both_are_parallel_circuits or both_are_series_circuits:
-                for piece in self:
-                    sorted_self = sorted(self.pieces, key = attrgetter())
-                    direct_match = self.piece1 == other.piece1 and self.piece2 == other.piece2
-                    reverse_match =  self.piece1 == other.piece2 and self.piece2 == other.piece1
-                return direct_match or reverse_match
-            else:
-                return False
+        """
+        Two circuits are equal if they have the same canonical form, i.e.
+        the same topology up to the order of pieces in series or in
+        parallel, with equal parameter values. Labels are ignored.
+        """
+        if isinstance(other, Circuit):
+            return (self.topology == other.topology and
+                    self.canonical_form(True) == other.canonical_form(True))
         else:
             return False
 
     def __ne__(self, other: Union["ElectricalElement", "Circuit"]) -> bool:
         return not self.__eq__(other)
 
+    def __hash__(self) -> int:
+        # consistent with __eq__, and unaffected by changes in parameter
+        # values; use circuit.topology as a key to ignore the values
+        return hash(self.topology)
+
+    def _associated_pieces(
+            self) -> List[Union["ElectricalElement", "Circuit"]]:
+        """
+        Returns the pieces of the expanded circuit, with nested circuits of
+        the same association (series in series, parallel in parallel)
+        replaced by their own pieces.
+        """
+        circuit = self.expanded()
+        pieces = []
+        for piece in circuit.pieces:
+            if isinstance(piece, Circuit):
+                piece = piece.expanded()
+                if piece.association_symbol == circuit.association_symbol:
+                    pieces.extend(piece._associated_pieces())
+                    continue
+            pieces.append(piece)
+        return pieces
+
+    def canonical_form(self, with_values: bool = False) -> str:
+        """
+        Returns a string that is the same for all circuits with the same
+        topology, written with the element symbols and the - (series) and
+        // (parallel) operators. Nested associations of the same kind are
+        flattened and the pieces of each association are sorted, e.g.
+        'R-(C//R)' for both R-(R//C) and (C//R)-R. If with_values = True, the
+        parameter values follow each symbol, e.g. 'R(10.0)'.
+        """
+        symbol = self.expanded().association_symbol
+        forms = []
+        for piece in self._associated_pieces():
+            form = piece.canonical_form(with_values)
+            forms.append(f'({form})' if isinstance(piece, Circuit) else form)
+        return symbol.join(sorted(forms))
+
+    @property
+    def topology(self) -> str:
+        """
+        Returns canonical_form() without parameter values. It is cached and
+        recomputed only if the pieces change.
+        """
+        cached = getattr(self, '_topology', None)
+        if cached is None or cached[0] is not self.pieces:
+            cached = (self.pieces, self.canonical_form())
+            self._topology = cached
+        return cached[1]
+
     def __iter__(self):
         return self.pieces.__iter__()
 
@@ -420,20 +1136,19 @@ class Circuit(metaclass=ABCMeta):
         return len(self.pieces)
 
     @property
-    def sorted_pieces(self) -> dict:
-        disassembled_pieces = {'R':[],'C':[],'Q':[],
-                               'L':[],'RC':[],'RQ':[],
-                               'RC U RQ':[],'Parallel':[],
-                               'Series':[]}
-        dp = disassembled_pieces
-        pieces = self.pieces
-        extended_pieces = pieces
-        if self.is_series_circuit:
-            for piece in pieces:
-                if piece.is_series_circuit:
-                    extended_pieces.extend(piece.pieces)
-        # sort pieces by class
-        for piece in extended_pieces:
+    def sorted_pieces(self) -> Dict[str, list]:
+        """
+        Returns the pieces of the circuit, with nested associations of the
+        same kind flattened (as in canonical_form and Simplification),
+        grouped by kind: 'R', 'C', 'Q' and 'L' elements sorted by R, C, T
+        and L; 'RC' and 'RQ' circuits, also together in 'RC U RQ', sorted by
+        decreasing relaxation frequency; other 'Parallel' and 'Series'
+        circuits and 'Other' elements (e.g. Warburg), sorted by canonical
+        form.
+        """
+        dp = {'R': [], 'C': [], 'Q': [], 'L': [], 'RC': [], 'RQ': [],
+              'RC U RQ': [], 'Parallel': [], 'Series': [], 'Other': []}
+        for piece in self._associated_pieces():
             if piece.is_resistor:
                 dp['R'].append(piece)
             elif piece.is_cpe:
@@ -452,27 +1167,43 @@ class Circuit(metaclass=ABCMeta):
                 dp['Parallel'].append(piece)
             elif piece.is_series_circuit:
                 dp['Series'].append(piece)
-        # sort pieces within same class
-        new_pieces = []
-        if self.is_series_circuit:
-            dp['R'].sort(key=lambda r: r.R)
-            dp['Q'].sort(key=lambda l: l.Q)
-            dp['C'].sort(key=lambda l: l.C)
-            dp['L'].sort(key=lambda l: l.L)
-            dp['RQ'].sort(key=lambda rq: rq.relax_freq)
-            dp['RC'].sort(key=lambda rc: rc.relax_freq)
-            dp['RC U RQ'].sort(key=lambda rc_or_rq: rc_or_rq.relax_freq)           
-            #dp['Parallel']. # Continue
-        elif self.is_parallel_circuit:
-            nothing = True # fix phony line
+            else:
+                dp['Other'].append(piece)
+        dp['R'].sort(key=lambda r: r.R)
+        dp['C'].sort(key=lambda c: c.C)
+        dp['Q'].sort(key=lambda q: q.T)
+        dp['L'].sort(key=lambda inductor: inductor.L)
+        for key in ('RC', 'RQ', 'RC U RQ'):
+            dp[key].sort(key=lambda rc_or_rq: rc_or_rq.relax_freq,
+                         reverse=True)
+        for key in ('Parallel', 'Series', 'Other'):
+            dp[key].sort(key=lambda piece: piece.canonical_form())
         return dp
 
-    def sorted(self, inplace=False) -> "Circuit":
-        nothing = True # fix phony line
-        #pieces = 
-
-
-
+    def sorted(self, inplace: bool = False) -> "Circuit":
+        """
+        Returns the equivalent circuit with its pieces in the order of the
+        spectrum: L, R, the RC and RQ circuits from the highest relaxation
+        frequency, other subcircuits (each sorted), other elements, and C
+        and Q last (see sorted_pieces). Nested associations of the same kind
+        are flattened. The elements are shared with this circuit, whose
+        pieces are replaced if inplace = True.
+        """
+        if self.is_rc:
+            if inplace:
+                return self
+            return self.res//(self.cpe if self.is_rq else self.cap)
+        dp = self.sorted_pieces
+        pieces = [*dp['L'], *dp['R'], *dp['RC U RQ']]
+        pieces += [piece.sorted(inplace)
+                   for piece in dp['Parallel'] + dp['Series']]
+        pieces += [*dp['Other'], *dp['C'], *dp['Q']]
+        if inplace:
+            self.pieces = pieces
+            return self
+        if self.expanded().is_series_circuit:
+            return SeriesCircuit(*pieces)
+        return ParallelCircuit(*pieces)
 
     def as_dict(self) -> Dict[str,dict]:
         pieces_keys = []
@@ -495,11 +1226,195 @@ class Circuit(metaclass=ABCMeta):
         return {self.label:pieces_dict}
 
     @abstractmethod
-    def z(self, f) -> complex:
+    def z(
+        self,
+        f: Union[float, int, List[Union[int, float]], np.ndarray] = F_DEFAULT,
+        out: Optional[np.ndarray] = None,
+        dtype: Optional[Union[type, np.dtype]] = None
+    ) -> Union[complex, np.ndarray]:
         """
-        Returns the impedance.
+        Returns the impedance. It is written into out, if given, with the
+        shape of f. dtype (complex128 or complex64) sets the precision of the
+        output.
         """
 
+    def expanded(self) -> "Circuit":
+        """
+        Returns the circuit written only in terms of series and parallel
+        associations. Subclasses with a custom structure override this.
+        """
+        return self
+
+    @property
+    def elements(self) -> List["ElectricalElement"]:
+        """
+        Returns the distinct electrical elements of the circuit, in the order
+        in which they first appear.
+        """
+        return self.compile().elements
+
+    def compile(self) -> CompiledCircuit:
+        """
+        Returns a flat evaluation plan of the circuit, which computes the same
+        impedance as z() without recursing through the pieces. Reducible
+        structure (see simplify()) is evaluated in its simplified form. The
+        plan is cached and rebuilt only if the pieces change.
+        """
+        plan = getattr(self, '_plan', None)
+        if plan is None or plan.pieces is not self.pieces:
+            plan = CompiledCircuit(self)
+            plan.set_simplification(Simplification(plan))
+            self._plan = plan
+        return plan
+
+    def simplify(
+        self,
+        fixed: Optional[List[str]] = None,
+        keep: Optional[List[str]] = None
+    ) -> "Simplification":
+        """
+        Returns an equivalent circuit with fewer elements, together with the
+        mapping between its parameters and those of this circuit. fixed:
+        names of parameters to be treated as fixed, in addition to those
+        flagged with <name>_isfixed = True. keep: names of parameters that
+        must not be merged. See Simplification.
+        """
+        return Simplification(self.compile(), fixed, keep)
+
+    def dz_dparams(
+        self,
+        f: Union[float, int, List[Union[int, float]], np.ndarray] = F_DEFAULT
+    ) -> np.ndarray:
+        """
+        Returns an (n_params, len(f)) array with the derivatives of the
+        impedance with respect to each parameter, in the order of
+        param_names, propagated through the pieces by the chain rule.
+        """
+        plan = self.compile()
+        grid = as_frequency_grid(f)
+        return self._z_and_dz(grid, plan.offsets, plan.n_params)[1]
+
+    def _z_and_dz(
+        self,
+        grid: FrequencyGrid,
+        offsets: Dict[int, int],
+        n_params: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the impedance and its derivatives with respect to all the
+        n_params parameters of an enclosing circuit, where offsets maps each
+        element to the position of its first parameter.
+        """
+        return self.expanded()._z_and_dz(grid, offsets, n_params)
+
+    def __getstate__(self) -> dict:
+        # the compiled plan is rebuilt on demand after copying or unpickling
+        state = self.__dict__.copy()
+        for name in ('_plan', '_topology', '_expanded', '_parents', '_z_cache',
+                     '_scratch'):
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        state = dict(state)
+        # circuits pickled before pieces became a property
+        pieces = state.pop('_pieces', state.pop('pieces', None))
+        self.__dict__.update(state)
+        self.pieces = pieces
+
+    @property
+    def pieces(self) -> List[Union["ElectricalElement", "Circuit"]]:
+        return self.__dict__.get('_pieces')
+
+    @pieces.setter
+    def pieces(
+        self, pieces: List[Union["ElectricalElement", "Circuit"]]
+    ) -> None:
+        """
+        Sets the pieces, registers the circuit as a parent of each one, so
+        that changes in their parameters invalidate its cached impedance,
+        and drops what this circuit and those containing it cached from the
+        old pieces. Modifying the list in place is not tracked; assign a new
+        list instead.
+        """
+        self._parents = getattr(self, '_parents', [])
+        self._pieces = pieces
+        _invalidate_structure(self)
+        for piece in pieces or []:
+            _add_parent(piece, self)
+
+    @property
+    def param_names(self) -> List[str]:
+        """
+        Returns the names of the circuit parameters, built from the element
+        labels, in the order used by z_batch() and the compiled plan.
+        """
+        return self.compile().param_names
+
+    @property
+    def param_index(self) -> Dict[str, int]:
+        """
+        Returns a dict mapping each parameter name to its position in the
+        parameter vector.
+        """
+        return self.compile().param_index
+
+    def get_params(self) -> np.ndarray:
+        """
+        Returns a read-only view of the parameter vector, ordered as
+        param_names. It reflects later changes to the parameters.
+        """
+        return self.compile().get_params()
+
+    def set_params(self, params: np.ndarray) -> None:
+        """
+        Copies params, ordered as param_names, into the parameter vector.
+        """
+        self.compile().set_params(params)
+
+    def z_batch(
+        self,
+        f: Union[float, int, List[Union[int, float]], np.ndarray],
+        params: np.ndarray,
+        out: Optional[np.ndarray] = None,
+        dtype: Optional[Union[type, np.dtype]] = None
+    ) -> np.ndarray:
+        """
+        Returns an (N, len(f)) array with the impedance for each of the N
+        parameter sets in params, an (N, n_params) array whose columns follow
+        param_names. All rows are evaluated at once by broadcasting. out and
+        dtype are as in CompiledCircuit.z().
+        """
+        return self.compile().z_batch(f, params, out, dtype)
+
+    def sweep(
+        self,
+        param_name: str,
+        values: np.ndarray,
+        f: Union[float, int, List[Union[int, float]], np.ndarray] = F_DEFAULT
+    ) -> "sweep.SweepResult":
+        """
+        Returns the impedance for each value of the parameter param_name (as
+        in param_names), the others fixed at their current values, and the
+        normalized sensitivities to all parameters, from one batched
+        evaluation. See sweep.SweepResult.
+        """
+        return sweep.sweep(self, param_name, values, f)
+
+    def sweep2d(
+        self,
+        param_x: str,
+        values_x: np.ndarray,
+        param_y: str,
+        values_y: np.ndarray,
+        f: Union[float, int, List[Union[int, float]], np.ndarray] = F_DEFAULT
+    ) -> "sweep.SweepResult":
+        """
+        As sweep(), over the grid of values_x of param_x by values_y of
+        param_y.
+        """
+        return sweep.sweep2d(self, param_x, values_x, param_y, values_y, f)
+
     def zdata_as_dict(
         self,
         f: Union[float, int, List[Union[int, float]], np.ndarray] = F_DEFAULT,
@@ -656,12 +1571,12 @@ class Circuit(metaclass=ABCMeta):
         series_RC_or_RQ_count = 0
         parallel_RC_or_RQ_count = 0
         for piece in self.pieces:
-            if piece.is_RC or piece.is_RQ:
+            if piece.is_rc:
                 series_RC_or_RQ_count += 1
             elif piece.is_parallel_circuit:
                 parallel_RC_or_RQ_count_partial = 0
                 for subpiece in piece.pieces:
-                    if subpiece.is_RC or subpiece.is_RQ:
+                    if subpiece.is_rc:
                         parallel_RC_or_RQ_count_partial += 1
                 if parallel_RC_or_RQ_count_partial == 2:
                     parallel_RC_or_RQ_count += 1
@@ -690,12 +1605,26 @@ class SeriesCircuit(Circuit):
     def z(
         self, 
         f: Union[float, int, List[Union[int, float]], np.ndarray] = F_DEFAULT,
+        out: Optional[np.ndarray] = None,
+        dtype: Optional[Union[type, np.dtype]] = None
     ) -> Union[complex, np.ndarray]:
         """
         Pending
         """
-        z = np.sum([piece.z(f) for piece in self.pieces], axis=0)
-        return z   
+        z = z_output(out, (np.size(f),), dtype)
+        z[...] = _z_cached(self.pieces[0], f, z.dtype)
+        for piece in self.pieces[1:]:
+            np.add(z, _z_cached(piece, f, z.dtype), out=z)
+        return complex(z[0]) if np.ndim(f) == 0 else z
+
+    def _z_and_dz(self, grid, offsets, n_params):
+        z = 0
+        dz = 0
+        for piece in self.pieces:
+            z_piece, dz_piece = piece._z_and_dz(grid, offsets, n_params)
+            z = z + z_piece
+            dz = dz + dz_piece
+        return z, dz
 
 
 class ParallelCircuit(Circuit):
@@ -716,14 +1645,34 @@ class ParallelCircuit(Circuit):
     def z(
         self, 
         f: Union[float, int, List[Union[int, float]], np.ndarray] = F_DEFAULT,
+        out: Optional[np.ndarray] = None,
+        dtype: Optional[Union[type, np.dtype]] = None
     ) -> Union[complex, np.ndarray]:
         """
         Pending
         """
         # 1/z = 1/z1 + 1/z2 + ...
-        z_inverse = np.sum([1/piece.z(f) for piece in self.pieces],axis=0)
-        z = 1/z_inverse    
-        return z
+        z = z_output(out, (np.size(f),), dtype)
+        z.fill(0)
+        scratch = getattr(self, '_scratch', None)
+        if (scratch is None or scratch.shape != z.shape
+                or scratch.dtype != z.dtype):
+            # kept between calls, as the pieces are evaluated one at a time
+            scratch = self._scratch = np.empty_like(z)
+        for piece in self.pieces:
+            np.reciprocal(_z_cached(piece, f, z.dtype), out=scratch)
+            np.add(z, scratch, out=z)
+        np.reciprocal(z, out=z)
+        return complex(z[0]) if np.ndim(f) == 0 else z
+
+    def _z_and_dz(self, grid, offsets, n_params):
+        # z = 1/sum(1/z_i), so dz = sum((z/z_i)**2*dz_i)
+        z_and_dz = [piece._z_and_dz(grid, offsets, n_params)
+                    for piece in self.pieces]
+        z = 1/np.sum([1/z_piece for z_piece, _ in z_and_dz], axis=0)
+        dz = np.sum([(z/z_piece)**2*dz_piece
+                     for z_piece, dz_piece in z_and_dz], axis=0)
+        return z, dz
 
 
 class RC(ParallelCircuit):
@@ -737,8 +1686,22 @@ class RC(ParallelCircuit):
         super().__init__(resistor, capacitor)
         self.res = resistor
         self.cap = capacitor
-        self.R = self.res.R
-        self.C = self.cap.C
+
+    @property
+    def R(self) -> float:
+        return self.res.R
+
+    @R.setter
+    def R(self, value: float) -> None:
+        self.res.R = value
+
+    @property
+    def C(self) -> float:
+        return self.cap.C
+
+    @C.setter
+    def C(self, value: float) -> None:
+        self.cap.C = value
     
     def as_dict(self) -> Dict[str,Dict[str,float]]:
         return {self.label:{'R':self.R, 'C':self.C}}
@@ -769,16 +1732,50 @@ class RQ(RC):
         super().__init__(resistor, cpe)
         self.res = resistor
         self.cpe = cpe
-        self.R = self.res.R
-        self.T = self.cpe.T
-        self.p = self.cpe.p
-        self.C = (self.R*self.T)**(1/self.p)/self.R    
+
+    @property
+    def T(self) -> float:
+        return self.cpe.T
+
+    @T.setter
+    def T(self, value: float) -> None:
+        self.cpe.T = value
+
+    @property
+    def p(self) -> float:
+        return self.cpe.p
+
+    @p.setter
+    def p(self, value: float) -> None:
+        self.cpe.p = value
+
+    @property
+    def C(self) -> float:
+        """
+        Pseudo-capacitance, (R*T)**(1/p)/R.
+        """
+        return (self.R*self.T)**(1/self.p)/self.R
 
     def as_dict(self) -> Dict[str,Dict[str,float]]:
         return {self.label:{'R':self.R, 
                             'T':self.T, 
                             'p':self.p}}
 
+
+def rc_pieces(piece: Union[ElectricalElement, Circuit]) -> List[RC]:
+    """
+    Returns the distinct RC and RQ circuits inside piece (including piece
+    itself), in order of appearance.
+    """
+    pairs = []
+    if isinstance(piece, RC):
+        pairs.append(piece)
+    for subpiece in getattr(piece, 'pieces', None) or []:
+        for pair in rc_pieces(subpiece):
+            if all(pair is not other for other in pairs):
+                pairs.append(pair)
+    return pairs
+
     
 class BrickLayerModelLike(Circuit):
     """
@@ -792,66 +1789,311 @@ class BrickLayerModelLike(Circuit):
     def z(
         self, 
         f: Union[float, int, List[Union[int, float]], np.ndarray] = F_DEFAULT,
+        out: Optional[np.ndarray] = None,
+        dtype: Optional[Union[type, np.dtype]] = None
     ) -> Union[complex, np.ndarray]:
         """
         Pending
         """
-        blm_like = self.pieces[0]//self.pieces[1]-self.pieces[2] 
-        return blm_like.z(f) 
-    
-    def sorted(self, inplace: bool=False) -> 'BrickLayerModelLike':
-        r1 = parallel_piece1.res
-        r2 = parallel_piece2.res
-        r3 = series_piece.res
-        c_or_q1 = parallel_piece1.cpe if parallel_piece1.cpe else parallel_piece1.cap
-        c_or_q2 = parallel_piece2.cpe if parallel_piece2.cpe else parallel_piece2.cap
-        c_or_q3 = series_piece.cpe if series_piece.cpe else series_piece.cap
-        par_Rs = [r1, r2]
-        par_Cs = []
-        par_Qs = []
-        for c_or_q in [c_or_q1, c_or_q2]:
-            if c_or_q.is_q:
-               par_Qs.append(c_or_q) 
-            else:
-               par_Cs.append(c_or_q)
-        if len(par_Cs) == 0:
-            ser_p = c_or_q3.p if c_or_q3.p else 1.0
-            par_Qs.sort(key=lambda q: abs(ser_p - q.p), reverse=True)
-            par_Rs.sort(key=lambda r: r.R)
-            par_Rs.sort(key=lambda r: abs((r//par_Qs[1]).tau - series_piece.tau),
-                        reverse = True)
-        elif len(par_Cs) == 1:
-            par_Cs_and_Qs = [par_Qs[0], par_Cs[0]] 
-            par_Rs.sort(key=lambda r: abs((r//par_Cs[0]).tau - series_piece.tau),
-                        reverse = True)  
-        else:
-            rc_or_rq_permutations = [r1//c_or_q1, r1//c_or_q2, r2//c_or_q1, r2//c_or_q2]
-            complement = [r2//c_or_q2, r2//c_or_q1, r1//c_or_q2, r1//c_or_q1]
-            ser_tau = series_piece.tau
-            par_gb = sorted(rc_or_rq_permutations,
-                            key = lambda rc_or_rq: abs(rc_or_rq.tau - ser_tau))
-            g = complement[rc_or_rq_permutations.index(par_gb)]
-            pieces = sorted([g, par_gb, series_piece], key = lambda rc_or_rq: rc_or_rq.tau)
-            par_Cs_and_Qs = [pieces[0].cap, pieces[1].cap]
-            par_Rs = [pieces[0].res, pieces[1].res]
-        new_pieces = [par_Rs[0]//par_Cs_and_Qs[0],
-                      par_Rs[1]//par_Cs_and_Qs[1],
-                      series_piece] 
+        z = z_output(out, (np.size(f),), dtype)
+        z[...] = _z_cached(self.expanded(), f, z.dtype)
+        return complex(z[0]) if np.ndim(f) == 0 else z
+
+    def expanded(self) -> Circuit:
+        cached = getattr(self, '_expanded', None)
+        if cached is None or cached[0] is not self.pieces:
+            circuit = self.pieces[0]//self.pieces[1]-self.pieces[2]
+            # changes inside the expanded circuit invalidate this one
+            _add_parent(circuit, self)
+            cached = (self.pieces, circuit)
+            self._expanded = cached
+        return cached[1]
+
+    def sorted(self, inplace: bool = False) -> "BrickLayerModelLike":
+        """
+        Returns the equivalent circuit in which the resistors and the
+        capacitors (or CPEs) of the two parallel pieces, all of which are in
+        parallel with each other, are paired so that one pair has the time
+        constant closest (on a log scale) to that of the series piece, with
+        the two pairs in order of increasing time constant. The elements are
+        shared with this circuit, whose pieces are replaced if inplace =
+        True.
+        """
+        first, second, series_piece = self.pieces
+        resistors = [first.res, second.res]
+        dielectrics = [first.cap, second.cap]  # RQ.cap is its CPE
+        pairings = [
+            [resistors[0]//dielectrics[0], resistors[1]//dielectrics[1]],
+            [resistors[0]//dielectrics[1], resistors[1]//dielectrics[0]]]
+        series_tau = series_piece.tau
+        with np.errstate(all='ignore'):
+            distances = [min(abs(np.log(piece.tau/series_tau))
+                             for piece in pairing)
+                         for pairing in pairings]
+        distances = np.nan_to_num(distances, nan=np.inf)
+        best = pairings[int(distances[1] < distances[0])]
+        new_pieces = [*sorted(best, key=lambda rc_or_rq: rc_or_rq.tau),
+                      series_piece]
         if inplace:
             self.pieces = new_pieces
+            return self
         return BrickLayerModelLike(*new_pieces)
 
-          
-
 
+class Simplification:
+    """
+    An equivalent, simplified version of a circuit, together with the
+    mapping between its parameters and those of the original circuit. The
+    simplification
+    - merges resistors, capacitors and inductors in series or in parallel
+      into a single element, labeled after the merged ones (e.g. R1-R2
+      becomes a resistor 'R1-R2' with R = R1 + R2, and C1//C2 a capacitor
+      'C1//C2' with C = C1 + C2);
+    - replaces CPEs whose p is fixed at 1 by capacitors with C = T;
+    - flattens nested associations of the same kind.
+    Only parameters that are both free or both fixed are merged, so that
+    fixed values are never changed, and parameters listed in keep are never
+    merged. Circuits in which an element appears more than once are not
+    simplified.
+
+    Each parameter of the simplified circuit is given by a rule: ('param',
+    idx) for a parameter copied from position idx of the original vector, or
+    ('sum', rules) and ('reciprocal_sum', rules) for merged ones.
+    """
+    def __init__(
+        self,
+        plan: CompiledCircuit,
+        fixed: Optional[List[str]] = None,
+        keep: Optional[List[str]] = None
+    ):
+        """
+        plan: the compiled plan of the original circuit.
+        """
+        self.plan = plan
+        self.original = plan.circuit
+        self.param_names = plan.param_names
+        fixed = set(fixed) if fixed else set()
+        self._keep = set(keep) if keep else set()
+        self._fixed = []
+        for element in plan.elements:
+            for name in element.param_names:
+                label = plan.param_names[len(self._fixed)]
+                self._fixed.append(getattr(element, f'{name}_isfixed', False)
+                                   or label in fixed)
+        # (T, p) positions of CPEs replaced by capacitors
+        self.unit_powers = []
+        self._rules = {}       # id of a new element -> (rules, fixed flags)
+        if self._has_repeated_elements(self.original):
+            self.circuit = self.original
+            self.compiled = plan
+            self.rules = [('param', idx) for idx in range(plan.n_params)]
+            self.fixed_names = [
+                name for name, isfixed in zip(plan.param_names, self._fixed)
+                if isfixed]
+            self.reduces = False
+            return
+        self.circuit = self._simplify(self.original, plan.get_params())
+        self.compiled = CompiledCircuit(self.circuit)
+        self.rules = []
+        self.fixed_names = []
+        for element in self.compiled.elements:
+            rules, flags = self._rules[id(element)]
+            self.rules.extend(rules)
+            offset = self.compiled.offsets[id(element)]
+            self.fixed_names.extend(
+                self.compiled.param_names[offset + idx]
+                for idx, isfixed in enumerate(flags) if isfixed)
+        self.reduces = (
+            self.compiled.n_params < plan.n_params or
+            len(self.compiled.instructions) < len(plan.instructions) or
+            len(self.unit_powers) > 0)
+
+    @staticmethod
+    def _has_repeated_elements(
+            piece: Union[ElectricalElement, Circuit]) -> bool:
+        seen = set()
+        stack = [piece]
+        while stack:
+            piece = stack.pop()
+            if getattr(piece, 'pieces', None) is None:
+                if id(piece) in seen:
+                    return True
+                seen.add(id(piece))
+            else:
+                stack.extend(piece.expanded().pieces)
+        return False
 
+    def _new_element(
+        self,
+        template: ElectricalElement,
+        values: List[float],
+        label: str,
+        rules: List[tuple],
+        flags: List[bool]
+    ) -> ElectricalElement:
+        """
+        Returns a copy of template (keeping its class and flags) with new
+        values and label, and records its rules.
+        """
+        element = copy.copy(template)
+        element._values = np.array(values, dtype=float)
+        element.label = label
+        self._rules[id(element)] = (rules, flags)
+        return element
+
+    def _simplify(
+        self,
+        piece: Union[ElectricalElement, Circuit],
+        params: np.ndarray
+    ) -> Union[ElectricalElement, Circuit]:
+        if getattr(piece, 'pieces', None) is None:
+            offset = self.plan.offsets[id(piece)]
+            if (piece.symbol == 'Q' and self._fixed[offset + 1]
+                    and params[offset + 1] == 1.0):
+                self.unit_powers.append((offset, offset + 1))
+                capacitor = Capacitor(C=params[offset], label=piece.label)
+                self._rules[id(capacitor)] = ([('param', offset)],
+                                              [self._fixed[offset]])
+                return capacitor
+            size = len(piece.param_names)
+            return self._new_element(
+                piece,
+                params[offset:offset + size],
+                piece.label,
+                [('param', idx) for idx in range(offset, offset + size)],
+                self._fixed[offset:offset + size])
+        circuit = piece.expanded()
+        symbol = circuit.association_symbol
+        children = [self._simplify(child, params)
+                    for child in circuit._associated_pieces()]
+        groups = {}
+        order = []
+        for child in children:
+            kind = MERGE_RULES.get((symbol, getattr(child, 'symbol', None)))
+            key = id(child)
+            if kind is not None:
+                rules, flags = self._rules[id(child)]
+                names = [self.param_names[idx]
+                         for idx in self._leaves(rules[0])]
+                if not self._keep.intersection(names):
+                    key = (child.symbol, flags[0])
+            if key not in groups:
+                groups[key] = []
+                order.append(key)
+            groups[key].append(child)
+        pieces = []
+        for key in order:
+            members = groups[key]
+            if len(members) == 1:
+                pieces.append(members[0])
+                continue
+            kind = MERGE_RULES[(symbol, members[0].symbol)]
+            rule = (kind, tuple(self._rules[id(member)][0][0]
+                                for member in members))
+            pieces.append(self._new_element(
+                members[0],
+                [self._evaluate(rule, list(params))],
+                symbol.join(member.label for member in members),
+                [rule],
+                self._rules[id(members[0])][1]))
+        if len(pieces) == 1:
+            return pieces[0]
+        if symbol == '-':
+            return SeriesCircuit(*pieces)
+        if len(pieces) == 2:
+            return pieces[0]//pieces[1]
+        return ParallelCircuit(*pieces)
+
+    @staticmethod
+    def _leaves(rule: tuple) -> List[int]:
+        kind, arg = rule
+        if kind == 'param':
+            return [arg]
+        return sorted({idx for subrule in arg
+                       for idx in Simplification._leaves(subrule)})
+
+    @staticmethod
+    def _columns(params: np.ndarray) -> list:
+        """
+        Returns the parameters as a list of NumPy scalars (which divide by
+        zero as IEEE floats), or of columns if params is 2D, which is faster
+        to index than the array.
+        """
+        return list(params) if params.ndim == 1 else list(params.T)
+
+    @staticmethod
+    def _evaluate(rule: tuple, columns: list) -> Union[float, np.ndarray]:
+        kind, arg = rule
+        if kind == 'param':
+            return columns[arg]
+        values = [Simplification._evaluate(subrule, columns)
+                  for subrule in arg]
+        if kind == 'sum':
+            return sum(values)
+        return 1/sum(1/value for value in values)
+
+    def is_valid(self, params: np.ndarray) -> bool:
+        """
+        Returns True if the simplified circuit is equivalent to the original
+        one for params, i.e. if the p of every replaced CPE is still 1.
+        """
+        return all((params[..., p] == 1.0).all() for _, p in self.unit_powers)
+
+    def transform(self, params: np.ndarray) -> np.ndarray:
+        """
+        Returns the parameters of the simplified circuit for parameters of
+        the original one (one set per row, if params is 2D).
+        """
+        params = np.asarray(params, dtype=float)
+        columns = self._columns(params)
+        if params.ndim == 1:
+            return np.array([self._evaluate(rule, columns)
+                             for rule in self.rules])
+        return np.column_stack([self._evaluate(rule, columns)
+                                for rule in self.rules])
+
+    def expand(
+        self,
+        simplified_params: np.ndarray,
+        params: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """
+        Returns parameters of the original circuit that reproduce
+        simplified_params. Copied parameters are set directly, and the
+        parameters merged into a single one are scaled by a common factor,
+        keeping the ratios they have in params (by default, the current
+        parameters of the original circuit).
+        """
+        simplified_params = np.asarray(simplified_params, dtype=float)
+        if params is None:
+            params = self.plan.get_params()
+        params = np.asarray(params, dtype=float)
+        shape = simplified_params.shape[:-1] + params.shape[-1:]
+        expanded = np.array(np.broadcast_to(params, shape))
+        columns = self._columns(params)
+        for idx, rule in enumerate(self.rules):
+            value = simplified_params[..., idx]
+            if rule[0] == 'param':
+                expanded[..., rule[1]] = value
+            else:
+                scale = value/self._evaluate(rule, columns)
+                expanded[..., self._leaves(rule)] *= np.expand_dims(scale, -1)
+        return expanded
 
+    def simplified_names(self) -> Dict[str, str]:
+        """
+        Returns a dict mapping the names of the original parameters that are
+        copied unchanged to their names in the simplified circuit.
+        """
+        names = {}
+        for name, rule in zip(self.compiled.param_names, self.rules):
+            if rule[0] == 'param':
+                names[self.param_names[rule[1]]] = name
+        return names
 
 
 ### implementar o método mágico que permite saber se um elemento ou subcircuito 
 ### está contido no circuito
 
-### Consertar __eq__ de Circuit
-
 ### Fazer RQ//R//Q ser interpretado como RQ//RQ
 
@@ -0,0 +1,480 @@
+# coding: utf-8
+
+"""
+This module provides a flat, register-based evaluation plan for electrical
+elements and circuits.
+"""
+
+import numpy as np
+from typing import TYPE_CHECKING, List, Optional, Tuple, Union
+
+from automaterials.experiment.eis import jit
+from automaterials.experiment.eis.properties import (
+    FrequencyGrid, as_frequency_grid, F_DEFAULT)
+
+if TYPE_CHECKING:
+    from automaterials.experiment.eis.circuits import (
+        Circuit, ElectricalElement, Simplification)
+
+__author__ = "Rodolpho Mouta"
+__maintainer__ = "Rodolpho Mouta"
+__email__ = "mouta.rodolpho@gmail.com"
+
+"""
+Instruction codes
+"""
+# write/add the impedance (or admittance) of an element to a register
+LEAF = 0
+# write/add the reciprocal of a register to another register
+INVERT = 1
+
+"""
+Buffer sizes
+"""
+BLOCK_SIZE = 2**15     # complex values per register when evaluating batches
+MAX_CACHED_SHAPES = 8  # register sets kept between calls
+
+"""
+Output types
+"""
+Z_DTYPES = (np.dtype(np.complex128), np.dtype(np.complex64))
+
+
+def z_output(
+    out: Optional[np.ndarray],
+    shape: Tuple[int, ...],
+    dtype: Optional[Union[type, np.dtype]] = None
+) -> np.ndarray:
+    """
+    Returns out, if given, after checking its shape and dtype, or a new array
+    otherwise. dtype must be complex128 or complex64, and defaults to the
+    dtype of out, if given, or complex128.
+    """
+    if dtype is None:
+        dtype = out.dtype if out is not None else Z_DTYPES[0]
+    dtype = np.dtype(dtype)
+    if dtype not in Z_DTYPES:
+        raise ValueError(
+            f'dtype must be complex128 or complex64, not {dtype}.')
+    if out is None:
+        return np.empty(shape, dtype=dtype)
+    if out.shape != tuple(shape) or out.dtype != dtype:
+        raise ValueError(
+            f'out must be a {dtype} array with shape {tuple(shape)}, '
+            f'not a {out.dtype} array with shape {out.shape}.')
+    return out
+
+
+class CompiledCircuit:
+    """
+    A flat evaluation plan for an electrical element or circuit. The tree of
+    pieces is walked only once, at construction, and turned into a list of
+    instructions that operate on preallocated complex registers. Pieces in
+    series are accumulated as impedances and pieces in parallel as
+    admittances, so that each element is evaluated directly in the domain its
+    parent needs and a reciprocal is only taken where series and parallel
+    associations meet.
+
+    The parameters of all elements live in a single contiguous float64
+    vector, ordered as param_names, and each element reads its values from a
+    view into it. Pushing a new parameter vector is then a single copy.
+    """
+    def __init__(self, circuit: Union["ElectricalElement", "Circuit"]):
+        """
+        Pending
+        """
+        self.circuit = circuit
+        self.pieces = getattr(circuit, 'pieces', None)
+        self.elements = []
+        self.instructions = []
+        self.n_params = 0
+        self.n_registers = 1
+        self.offsets = {}
+        self._buffers = {}
+        self._tangent_buffers = {}
+        self.simplification = None
+        self.admittance_output = self._is_parallel(circuit)
+        self._emit(circuit, 0, self.admittance_output, True)
+        self.param_names = self._label_params()
+        self.param_index = {name: idx
+                            for idx, name in enumerate(self.param_names)}
+        self.jit_program = jit.program(self.instructions)
+        self._storage = np.empty(self.n_params, dtype=float)
+        self._readonly = self._storage.view()
+        self._readonly.flags.writeable = False
+        self._changed = np.empty(self.n_params, dtype=bool)
+        self._owners = np.repeat(
+            np.arange(len(self.elements)),
+            [len(element.param_names) for element in self.elements])
+        self._bind()
+
+    @staticmethod
+    def _is_leaf(piece: Union["ElectricalElement", "Circuit"]) -> bool:
+        return getattr(piece, 'pieces', None) is None
+
+    @staticmethod
+    def _is_parallel(piece: Union["ElectricalElement", "Circuit"]) -> bool:
+        if CompiledCircuit._is_leaf(piece):
+            return False
+        return piece.expanded().is_parallel_circuit
+
+    def _register_element(self, element: "ElectricalElement") -> int:
+        """
+        Returns the index of the first parameter of element in the parameter
+        vector, adding the element to the plan if it was not seen before. An
+        element that appears more than once in the circuit shares its
+        parameters.
+        """
+        key = id(element)
+        if key not in self.offsets:
+            self.offsets[key] = self.n_params
+            self.elements.append(element)
+            self.n_params += len(element.param_names)
+        return self.offsets[key]
+
+    def _label_params(self) -> List[str]:
+        """
+        Returns one name per parameter, built from the element labels.
+        Repeated labels are numbered, as in Circuit.as_dict(), and elements
+        with more than one parameter get the parameter name appended, e.g.
+        'Q1_T' and 'Q1_p'.
+        """
+        labels = [element.label for element in self.elements]
+        for label in list(labels):
+            repeated = [jdx for jdx, other in enumerate(labels)
+                        if other == label]
+            if len(repeated) > 1:
+                for number, jdx in enumerate(repeated):
+                    labels[jdx] = f'{label}{number + 1}'
+        names = []
+        for label, element in zip(labels, self.elements):
+            if len(element.param_names) == 1:
+                names.append(label)
+            else:
+                names.extend(f'{label}_{name}' for name in element.param_names)
+        return names
+
+    def _emit(
+        self,
+        piece: Union["ElectricalElement", "Circuit"],
+        register: int,
+        admittance: bool,
+        first: bool
+    ) -> None:
+        """
+        Appends the instructions that write (first = True) or add the
+        impedance of piece, or its admittance if admittance = True, to the
+        given register.
+        """
+        self.n_registers = max(self.n_registers, register + 1)
+        if self._is_leaf(piece):
+            start = self._register_element(piece)
+            stop = start + len(piece.param_names)
+            self.instructions.append(
+                (LEAF, register, first, type(piece), start, stop, admittance))
+            return
+        piece = piece.expanded()
+        piece_admittance = piece.is_parallel_circuit
+        if piece_admittance == admittance:
+            # same domain as the parent: accumulate directly
+            for idx, subpiece in enumerate(piece.pieces):
+                self._emit(subpiece, register, admittance, first and idx == 0)
+        else:
+            for idx, subpiece in enumerate(piece.pieces):
+                self._emit(subpiece, register + 1, piece_admittance, idx == 0)
+            self.instructions.append(
+                (INVERT, register, first, register + 1, None, None, None))
+
+    def _registers(
+        self,
+        shape: Tuple[int, ...],
+        dtype: np.dtype = Z_DTYPES[0]
+    ) -> List[np.ndarray]:
+        """
+        Returns the work registers, with a free slot for the output one at
+        index 0 and a scratch buffer at the end. They are allocated only once
+        per shape and dtype.
+        """
+        key = (shape, dtype)
+        buffers = self._buffers.get(key)
+        if buffers is None:
+            if len(self._buffers) >= MAX_CACHED_SHAPES:
+                self._buffers.clear()
+            buffers = [None] + [np.empty(shape, dtype=dtype)
+                                for _ in range(self.n_registers)]
+            self._buffers[key] = buffers
+        return buffers
+
+    def _run(
+        self,
+        grid: FrequencyGrid,
+        columns: Union[List[float], np.ndarray],
+        out: np.ndarray
+    ) -> np.ndarray:
+        """
+        Executes the instructions, writing the impedance into out.
+        """
+        registers = self._registers(out.shape, out.dtype)
+        scratch = registers[-1]
+        registers[0] = out
+        for (op, reg, first, source, start, stop,
+             admittance) in self.instructions:
+            if op == LEAF:
+                if first:
+                    source.kernel(grid, columns[start:stop], registers[reg],
+                                  admittance)
+                else:
+                    source.kernel(grid, columns[start:stop], scratch,
+                                  admittance)
+                    np.add(registers[reg], scratch, out=registers[reg])
+            elif first:
+                np.reciprocal(registers[source], out=registers[reg])
+            else:
+                np.reciprocal(registers[source], out=registers[source])
+                np.add(registers[reg], registers[source], out=registers[reg])
+        registers[0] = None
+        if self.admittance_output:
+            np.reciprocal(out, out=out)
+        return out
+
+    def _tangent_registers(self, shape: Tuple[int, ...]) -> List[np.ndarray]:
+        """
+        Returns the derivative registers matching _registers(), each with one
+        row per parameter.
+        """
+        buffers = self._tangent_buffers.get(shape)
+        if buffers is None:
+            if len(self._tangent_buffers) >= MAX_CACHED_SHAPES:
+                self._tangent_buffers.clear()
+            buffers = [None] + [np.empty(shape, dtype=complex)
+                                for _ in range(self.n_registers - 1)]
+            self._tangent_buffers[shape] = buffers
+        return buffers
+
+    def _run_tangent(
+        self,
+        grid: FrequencyGrid,
+        columns: Union[List[float], np.ndarray],
+        out: np.ndarray,
+        tangent: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Executes the instructions carrying, next to each register, its
+        derivatives with respect to all parameters (forward-mode
+        differentiation). The impedance is written into out and its
+        derivatives into tangent.
+        """
+        registers = self._registers(out.shape)
+        tangents = self._tangent_registers(tangent.shape)
+        scratch = registers[-1]
+        registers[0] = out
+        tangents[0] = tangent
+        for (op, reg, first, source, start, stop,
+             admittance) in self.instructions:
+            if op == LEAF:
+                values = columns[start:stop]
+                value = registers[reg] if first else scratch
+                source.kernel(grid, values, value, admittance)
+                if first:
+                    tangents[reg].fill(0)
+                derivatives = source.dkernel(grid, values, value, admittance)
+                for row, derivative in enumerate(derivatives, start):
+                    tangents[reg][row] += derivative
+                if not first:
+                    np.add(registers[reg], scratch, out=registers[reg])
+            else:
+                # d(1/u) = -du/u**2
+                inverse = np.reciprocal(registers[source],
+                                        out=registers[source])
+                np.multiply(inverse, inverse, out=scratch)
+                np.negative(scratch, out=scratch)
+                np.multiply(tangents[source], scratch, out=tangents[source])
+                if first:
+                    np.copyto(registers[reg], inverse)
+                    np.copyto(tangents[reg], tangents[source])
+                else:
+                    np.add(registers[reg], inverse, out=registers[reg])
+                    np.add(tangents[reg], tangents[source], out=tangents[reg])
+        registers[0] = None
+        tangents[0] = None
+        if self.admittance_output:
+            np.reciprocal(out, out=out)
+            np.multiply(out, out, out=scratch)
+            np.negative(scratch, out=scratch)
+            np.multiply(tangent, scratch, out=tangent)
+        return out, tangent
+
+    def _bind(self) -> None:
+        """
+        Copies the current values of the elements into the parameter vector
+        and makes each element read its values from a view into it.
+        """
+        for element in self.elements:
+            offset = self.offsets[id(element)]
+            view = self._storage[offset:offset + len(element.param_names)]
+            view[...] = element._values
+            element._values = view
+
+    def _check_binding(self) -> None:
+        """
+        Rebinds the elements if any of them was since bound to another
+        vector, e.g. by compiling another circuit that shares it.
+        """
+        for element in self.elements:
+            if element._values.base is not self._storage:
+                self._bind()
+                return
+
+    def set_simplification(self, simplification: "Simplification") -> None:
+        """
+        Makes z() evaluate batches of parameter sets on the simplified
+        circuit of simplification, an equivalent circuit with fewer elements,
+        whenever it is valid for the given parameters, which are still given
+        in the order of param_names. Single parameter sets and derivatives
+        are evaluated directly, since mapping them to and from the simplified
+        circuit costs about as much as it saves.
+        """
+        self.simplification = (simplification if simplification.reduces
+                               else None)
+
+    def get_params(self) -> np.ndarray:
+        """
+        Returns a read-only view of the parameter vector, ordered as
+        param_names.
+        """
+        self._check_binding()
+        return self._readonly
+
+    def set_params(self, params: np.ndarray) -> None:
+        """
+        Copies params, ordered as param_names, into the parameter vector.
+        Elements whose values changed drop their cached impedances, and
+        those of the circuits containing them.
+        """
+        self._check_binding()
+        changed = np.not_equal(self._storage, params, out=self._changed)
+        self._storage[...] = params
+        if changed.any():
+            for idx in np.unique(self._owners[changed]):
+                self.elements[idx].invalidate_cache()
+
+    def z(
+        self,
+        f: Union[float, int, List[Union[int, float]], np.ndarray] = F_DEFAULT,
+        params: Optional[np.ndarray] = None,
+        out: Optional[np.ndarray] = None,
+        dtype: Optional[Union[type, np.dtype]] = None
+    ) -> Union[complex, np.ndarray]:
+        """
+        Returns the impedance. If params is not provided, the current
+        parameter values of the elements are used. If params is a 2D array
+        with one parameter set per row, the output has one spectrum per row.
+
+        The impedance is written into out, if given, which avoids allocating
+        any array when f is a FrequencyGrid. dtype (complex128 or complex64)
+        sets the precision of the output and of the work registers.
+
+        Batches run on the backend selected with jit.set_backend: with
+        'numba', each parameter row is evaluated in one fused loop over the
+        frequencies, in double precision whatever dtype is. Only plans made
+        of R, C, Q and L have a jit_program; the others fall back to NumPy.
+        """
+        if params is None:
+            params = self.get_params()
+        params = np.asarray(params, dtype=float)
+        simplification = self.simplification
+        if (simplification is not None and params.ndim == 2 and
+                simplification.is_valid(params)):
+            return simplification.compiled.z(
+                f, simplification.transform(params), out, dtype)
+        is_scalar = np.ndim(f) == 0
+        grid = as_frequency_grid(f)
+        if params.ndim == 2:
+            z = z_output(out, (params.shape[0], grid.size), dtype)
+            if jit.get_backend() == 'numba':
+                if self.jit_program is not None:
+                    jit.z_rows(self.jit_program, self.admittance_output,
+                               self.n_registers, grid.omega, params, z)
+                    return z[..., 0] if is_scalar else z
+                jit.warn_fallback(self.elements)
+            # the kernels compute in the precision of the grid and parameters
+            grid = grid.with_precision(z.dtype)
+            params = params.astype(grid.dtype, copy=False)
+            # rows are processed in blocks that keep the registers in cache
+            rows = max(1, BLOCK_SIZE//grid.size)
+            for start in range(0, params.shape[0], rows):
+                block = params[start:start + rows]
+                self._run(grid, block.T[..., None], z[start:start + rows])
+        else:
+            z = z_output(out, (grid.size,), dtype)
+            grid = grid.with_precision(z.dtype)
+            # NumPy scalars, as in the batched path, so that e.g. R = 0 gives
+            # inf (and an admittance of 0) instead of ZeroDivisionError
+            z = self._run(grid, list(params.astype(grid.dtype, copy=False)), z)
+        if is_scalar:
+            return z[..., 0] if z.ndim > 1 else complex(z[0])
+        return z
+
+    def z_and_jacobian(
+        self,
+        f: Union[float, int, List[Union[int, float]], np.ndarray] = F_DEFAULT,
+        params: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the impedance and its analytic derivatives with respect to
+        each parameter, both from a single pass over the plan. The
+        derivatives have shape (n_params, len(f)), or (N, n_params, len(f))
+        if params is a 2D array with N rows.
+        """
+        if params is None:
+            params = self.get_params()
+        params = np.asarray(params, dtype=float)
+        grid = as_frequency_grid(f)
+        if params.ndim == 2:
+            n_rows = params.shape[0]
+            z = np.empty((n_rows, grid.size), dtype=complex)
+            jacobian = np.empty((n_rows, self.n_params, grid.size),
+                                dtype=complex)
+            rows = max(1, BLOCK_SIZE//(grid.size*(self.n_params + 1)))
+            for start in range(0, n_rows, rows):
+                block = params[start:start + rows]
+                tangent = np.empty((self.n_params, len(block), grid.size),
+                                   dtype=complex)
+                self._run_tangent(grid, block.T[..., None],
+                                  z[start:start + rows], tangent)
+                jacobian[start:start + rows] = tangent.transpose(1, 0, 2)
+        else:
+            z = np.empty(grid.size, dtype=complex)
+            jacobian = np.empty((self.n_params, grid.size), dtype=complex)
+            self._run_tangent(grid, list(params), z, jacobian)
+        return z, jacobian
+
+    def jacobian(
+        self,
+        f: Union[float, int, List[Union[int, float]], np.ndarray] = F_DEFAULT,
+        params: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """
+        Returns the analytic derivatives of the impedance with respect to
+        each parameter, with shape (n_params, len(f)), or (N, n_params,
+        len(f)) if params is a 2D array with N rows.
+        """
+        return self.z_and_jacobian(f, params)[1]
+
+    def z_batch(
+        self,
+        f: Union[float, int, List[Union[int, float]], np.ndarray],
+        params: np.ndarray,
+        out: Optional[np.ndarray] = None,
+        dtype: Optional[Union[type, np.dtype]] = None
+    ) -> np.ndarray:
+        """
+        Returns an (N, len(f)) array with the impedance for each of the N rows
+        of params, an (N, n_params) array whose columns follow param_names.
+        out and dtype are as in z().
+        """
+        params = np.asarray(params, dtype=float)
+        if params.ndim != 2 or params.shape[1] != self.n_params:
+            raise ValueError(f'params must have shape (N, {self.n_params}), '
+                             f'following {self.param_names}.')
+        return self.z(np.atleast_1d(f), params, out, dtype)
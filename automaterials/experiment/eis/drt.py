@@ -0,0 +1,333 @@
+# coding: utf-8
+
+"""
+This module provides the distribution of relaxation times (DRT) of impedance
+spectra, computed by Tikhonov-regularized non-negative least squares, which
+shows how many processes a spectrum holds before a circuit is chosen.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import nnls
+from typing import Dict, List, Optional, Union
+
+from automaterials.experiment.eis.properties import ZData
+from automaterials.utils.constants import PI
+
+__author__ = "Rodolpho Mouta"
+__maintainer__ = "Rodolpho Mouta"
+__email__ = "mouta.rodolpho@gmail.com"
+
+"""
+Constants
+"""
+# candidates for GCV and L-curve selection
+LAMBDA_GRID = np.logspace(-10, 0, 51)
+SUPPORTED_LAMBDA_METHODS = ('gcv', 'lcurve')
+MAX_CACHED_MATRICES = 8               # discretizations kept between calls
+
+
+class DRTMatrices:
+    """
+    The discretization of the DRT model for one frequency grid and one tau
+    grid, with its factorizations. The model is
+
+        Z = R_inf + i*omega*L + sum_k gamma_k*dlntau_k/(1 + i*omega*tau_k),
+
+    with real and imaginary parts stacked as rows. R_inf and L, which are not
+    regularized, are eliminated by projecting onto the orthogonal complement
+    of their columns, and the SVD of the projected gamma columns gives the
+    regularized solution, its residual and GCV for any lambda in closed form.
+    """
+    def __init__(self, f: np.ndarray, tau: np.ndarray, inductance: bool):
+        """
+        Pending
+        """
+        self.f = f
+        self.tau = tau
+        self.inductance = inductance
+        omega = 2*PI*f
+        omega_tau = np.outer(omega, tau)
+        dlntau = np.gradient(np.log(tau)) if len(tau) > 1 else np.ones(1)
+        denominator = 1 + omega_tau**2
+        self.gamma_columns = np.concatenate([dlntau/denominator,
+                                             -dlntau*omega_tau/denominator])
+        fixed_columns = [np.concatenate([np.ones_like(omega),
+                                         np.zeros_like(omega)])]
+        if inductance:
+            fixed_columns.append(np.concatenate([np.zeros_like(omega), omega]))
+        self.fixed_columns = np.column_stack(fixed_columns)
+        self.q_fixed, self.r_fixed = np.linalg.qr(self.fixed_columns)
+        projected = self.project(self.gamma_columns)
+        self.u, self.s, self.vt = np.linalg.svd(projected, full_matrices=False)
+        self.n_rows = self.gamma_columns.shape[0]
+        self.dof = self.n_rows - self.fixed_columns.shape[1]
+
+    def project(self, b: np.ndarray) -> np.ndarray:
+        """
+        Removes from b (rows as in the model) its component along the R_inf
+        and L columns.
+        """
+        return b - self.q_fixed @ (self.q_fixed.T @ b)
+
+    def fixed_values(self, b: np.ndarray, gamma: np.ndarray) -> np.ndarray:
+        """
+        Returns R_inf (and L) that best fit b (one column per spectrum) given
+        gamma (one row per spectrum).
+        """
+        rest = b - self.gamma_columns @ gamma.T
+        return np.linalg.solve(self.r_fixed, self.q_fixed.T @ rest).T
+
+
+def tau_grid(
+    f: Union[List[float], np.ndarray],
+    pts_per_decade: int = 10,
+    extension: float = 1.0
+) -> np.ndarray:
+    """
+    Returns log-spaced relaxation times covering 1/omega for all of f,
+    extended by extension decades at both ends.
+    """
+    omega = 2*PI*np.asarray(f, dtype=float)
+    start = np.log10(1/omega.max()) - extension
+    stop = np.log10(1/omega.min()) + extension
+    return np.logspace(start, stop, int((stop - start)*pts_per_decade) + 1)
+
+
+_matrices = {}
+
+
+def drt_matrices(
+    f: Union[List[float], np.ndarray],
+    tau: np.ndarray,
+    inductance: bool = True
+) -> DRTMatrices:
+    """
+    Returns the DRTMatrices for f and tau, built only once per pair of grids.
+    """
+    f = np.asarray(f, dtype=float)
+    tau = np.asarray(tau, dtype=float)
+    key = (f.tobytes(), tau.tobytes(), inductance)
+    matrices = _matrices.get(key)
+    if matrices is None:
+        if len(_matrices) >= MAX_CACHED_MATRICES:
+            del _matrices[next(iter(_matrices))]
+        matrices = DRTMatrices(f, tau, inductance)
+        _matrices[key] = matrices
+    return matrices
+
+
+class DRTResult:
+    """
+    Stores the DRT of one spectrum: gamma (in ohms per unit of ln(tau)) on
+    the tau grid, R_inf, L (None if not fitted), the regularization
+    parameter, and the spectrum rebuilt from them.
+    """
+    def __init__(
+        self,
+        f: np.ndarray,
+        z: np.ndarray,
+        tau: np.ndarray,
+        gamma: np.ndarray,
+        R_inf: float,
+        L: Optional[float],
+        lambda_: float,
+        z_fit: np.ndarray
+    ):
+        """
+        Pending
+        """
+        self.f = f
+        self.z = z
+        self.tau = tau
+        self.gamma = gamma
+        self.R_inf = R_inf
+        self.L = L
+        self.lambda_ = lambda_
+        self.z_fit = z_fit
+        modulus = np.abs(z)
+        modulus[modulus == 0] = 1.0
+        self.residuals_real = (z.real - z_fit.real)/modulus
+        self.residuals_imag = (z.imag - z_fit.imag)/modulus
+
+    @property
+    def R_pol(self) -> float:
+        """
+        The polarization resistance, i.e., the area under gamma.
+        """
+        dlntau = (np.gradient(np.log(self.tau)) if len(self.tau) > 1
+                  else np.ones(1))
+        return float(np.sum(self.gamma*dlntau))
+
+    def peaks(self, threshold: float = 0.01) -> np.ndarray:
+        """
+        Returns the relaxation times at the local maxima of gamma higher than
+        threshold times its largest value, each roughly one process.
+        """
+        gamma = np.concatenate([[0.0], self.gamma, [0.0]])
+        is_peak = ((gamma[1:-1] > gamma[:-2]) & (gamma[1:-1] >= gamma[2:]) &
+                   (gamma[1:-1] > threshold*gamma.max()))
+        return self.tau[is_peak]
+
+    def as_dataframe(self) -> pd.DataFrame:
+        """
+        Returns a pandas DataFrame with columns tau and gamma.
+        """
+        return pd.DataFrame({'tau': self.tau, 'gamma': self.gamma})
+
+
+def _select_lambda(
+    matrices: DRTMatrices,
+    beta: np.ndarray,
+    outside: np.ndarray,
+    method: str
+) -> np.ndarray:
+    """
+    Returns, for each row of beta (the projected data in the basis of the
+    left singular vectors), the value of LAMBDA_GRID that minimizes GCV or
+    that sits at the corner (largest curvature) of the L-curve. All
+    spectra and candidates are evaluated at once.
+    """
+    s2 = matrices.s**2
+    filters = s2/(s2 + LAMBDA_GRID[:, None])                # (lambdas, r)
+    beta2 = (beta**2).T                                     # (r, N)
+    residual = ((1 - filters)**2 @ beta2) + outside         # (lambdas, N)
+    if method == 'gcv':
+        trace = matrices.dof - filters.sum(axis=1)
+        gcv = residual/trace[:, None]**2
+        return LAMBDA_GRID[np.argmin(gcv, axis=0)]
+    with np.errstate(divide='ignore'):
+        norm = (filters**2/np.where(s2 > 0, s2, np.inf)) @ beta2
+    x = 0.5*np.log(np.maximum(residual, np.finfo(float).tiny))
+    y = 0.5*np.log(np.maximum(norm, np.finfo(float).tiny))
+    t = np.log(LAMBDA_GRID)
+    dx, dy = np.gradient(x, t, axis=0), np.gradient(y, t, axis=0)
+    ddx, ddy = np.gradient(dx, t, axis=0), np.gradient(dy, t, axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        curvature = (dx*ddy - ddx*dy)/(dx**2 + dy**2)**1.5
+    curvature = np.nan_to_num(curvature, nan=-np.inf)
+    return LAMBDA_GRID[np.argmax(curvature[1:-1], axis=0) + 1]
+
+
+def _nnls(
+    matrices: DRTMatrices,
+    beta: np.ndarray,
+    lambdas: np.ndarray,
+    max_iter: Optional[int]
+) -> np.ndarray:
+    """
+    Solves min |P(A*gamma - b)|**2 + lambda*|gamma|**2 with gamma >= 0 for
+    each spectrum, where P removes the R_inf and L directions. Through the
+    cached SVD, this is the small problem |S*V^T*gamma - beta|**2 +
+    lambda*|gamma|**2, whose matrix is built once per distinct lambda.
+    """
+    reduced = matrices.s[:, None]*matrices.vt
+    identity = np.eye(reduced.shape[1])
+    padding = np.zeros(reduced.shape[1])
+    systems = {}
+    gamma = np.empty((len(beta), reduced.shape[1]))
+    for idx, (beta_row, lambda_) in enumerate(zip(beta, lambdas)):
+        system = systems.get(lambda_)
+        if system is None:
+            system = np.vstack([reduced, np.sqrt(lambda_)*identity])
+            systems[lambda_] = system
+        gamma[idx] = nnls(system, np.concatenate([beta_row, padding]),
+                          maxiter=max_iter)[0]
+    return gamma
+
+
+def _drt_batch(
+    f: np.ndarray,
+    z: np.ndarray,
+    lambda_: Union[float, str],
+    tau: Optional[np.ndarray],
+    inductance: bool,
+    max_iter: Optional[int]
+) -> List[DRTResult]:
+    """
+    Computes the DRT of each row of z (N, len(f)), all measured at the same
+    frequencies, sharing one DRTMatrices.
+    """
+    if tau is None:
+        tau = tau_grid(f)
+    matrices = drt_matrices(f, tau, inductance)
+    # spectra are normalized, so that lambda does not depend on their scale
+    # (an all-zero spectrum is left as is, and gives gamma = 0)
+    scale = np.abs(z).max(axis=1)
+    scale[scale == 0] = 1.0
+    b = np.concatenate([z.real, z.imag], axis=1).T/scale    # (rows, N)
+    projected = matrices.project(b)
+    beta = (matrices.u.T @ projected).T                     # (N, r)
+    if isinstance(lambda_, str):
+        if lambda_ not in SUPPORTED_LAMBDA_METHODS:
+            print('WARNING: lambda_ = '+lambda_ +
+                  ' not supported. Switching to gcv...')
+            lambda_ = 'gcv'
+        outside = np.sum(projected**2, axis=0) - np.sum(beta**2, axis=1)
+        lambdas = _select_lambda(matrices, beta, np.maximum(outside, 0),
+                                 lambda_)
+    else:
+        lambdas = np.full(len(z), float(lambda_))
+    gamma = _nnls(matrices, beta, lambdas, max_iter)
+    fixed = matrices.fixed_values(b, gamma)
+    rows = matrices.fixed_columns @ fixed.T + matrices.gamma_columns @ gamma.T
+    n = len(f)
+    z_fit = ((rows[:n] + 1j*rows[n:])*scale).T
+    results = []
+    for idx in range(len(z)):
+        L = float(fixed[idx, 1]*scale[idx]) if inductance else None
+        results.append(DRTResult(f, z[idx], tau, gamma[idx]*scale[idx],
+                                 float(fixed[idx, 0]*scale[idx]), L,
+                                 float(lambdas[idx]), z_fit[idx]))
+    return results
+
+
+def drt(
+    zdata: ZData,
+    lambda_: Union[float, str] = 'gcv',
+    tau: Optional[np.ndarray] = None,
+    inductance: bool = True,
+    max_iter: Optional[int] = None
+) -> DRTResult:
+    """
+    Computes the distribution of relaxation times of zdata by Tikhonov-
+    regularized non-negative least squares on the real and imaginary parts,
+    with R_inf and (if inductance = True) a series inductance fitted along.
+
+    lambda_: the regularization parameter, for the spectrum normalized by
+    its largest |Z|, or 'gcv' (generalized cross-validation) or 'lcurve'
+    (corner of the L-curve) to choose it from LAMBDA_GRID.
+    tau: the relaxation times at which gamma is computed; by default
+    tau_grid(zdata.f).
+    max_iter: iteration limit of the non-negative least-squares solver
+    (scipy.optimize.nnls), by default 3 times the number of tau values.
+    """
+    f = np.asarray(zdata.f, dtype=float)
+    z = np.asarray(zdata.z, dtype=complex)
+    return _drt_batch(f, z[None, :], lambda_, tau, inductance, max_iter)[0]
+
+
+def drt_series(
+    series: Dict[float, ZData],
+    lambda_: Union[float, str] = 'gcv',
+    tau: Optional[np.ndarray] = None,
+    inductance: bool = True,
+    max_iter: Optional[int] = None
+) -> Dict[float, DRTResult]:
+    """
+    Computes the DRT of every spectrum of series (e.g. {temperature: ZData},
+    as given by SmartFileReader.get_zdata_series), with the arguments of drt,
+    and returns the results with the same keys. Spectra measured at the same
+    frequencies share one factorization and are solved together.
+    """
+    groups = {}
+    for key, zdata in series.items():
+        f = np.asarray(zdata.f, dtype=float)
+        groups.setdefault(f.tobytes(), (f, []))[1].append(key)
+    results = {}
+    for f, keys in groups.values():
+        z = np.array([np.asarray(series[key].z, dtype=complex)
+                      for key in keys])
+        batch = _drt_batch(f, z, lambda_, tau, inductance, max_iter)
+        results.update(zip(keys, batch))
+    return {key: results[key] for key in series}
@@ -0,0 +1,581 @@
+# coding: utf-8
+
+"""
+This module provides classes and functions used to fit equivalent circuits to
+impedance data by complex nonlinear least squares (CNLS).
+"""
+
+import copy
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from scipy.optimize import OptimizeResult, least_squares
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple, Union
+
+from automaterials.experiment.eis.properties import (
+    ZData, ZDataCollection, as_frequency_grid)
+
+if TYPE_CHECKING:
+    from automaterials.experiment.eis.circuits import (
+        Circuit, ElectricalElement, Simplification)
+
+__author__ = "Rodolpho Mouta"
+__maintainer__ = "Rodolpho Mouta"
+__email__ = "mouta.rodolpho@gmail.com"
+
+"""
+Constants
+"""
+SUPPORTED_WEIGHTINGS = ('unit', 'modulus', 'proportional')
+SEARCH_SPAN = 3.0  # decades searched around the current value by global_fit
+# limits of log-scaled u
+LOG_RANGE = (np.log(np.finfo(float).tiny), np.log(np.finfo(float).max))
+LARGE_RESIDUAL = 1e100  # stands for residuals that cannot be evaluated
+
+
+class CNLSProblem:
+    """
+    A complex nonlinear least-squares problem built from a circuit and a
+    spectrum. Free parameters are mapped to a vector u in which positive
+    quantities (R, C, T, L) are on a log scale, and the residual stacks the
+    weighted real and imaginary deviations between model and data. Parameters
+    whose element has a True <name>_isfixed flag (as in ZView elements) or
+    that are listed in fixed are kept at their current values.
+    """
+    def __init__(
+        self,
+        circuit: Union["ElectricalElement", "Circuit"],
+        zdata: ZData,
+        weighting: Union[str, np.ndarray] = 'modulus',
+        fixed: Optional[List[str]] = None
+    ):
+        """
+        Pending
+        """
+        self.circuit = circuit
+        self.plan = circuit.compile()
+        self.param_names = self.plan.param_names
+        self.params = self.plan.get_params().copy()
+        self.f = as_frequency_grid(zdata.f)
+        self.z = np.asarray(zdata.z, dtype=complex)
+        fixed = set(fixed) if fixed else set()
+        is_free = []
+        is_log = []
+        names = iter(self.param_names)
+        values = iter(self.params)
+        for element in self.plan.elements:
+            for name in element.param_names:
+                label = next(names)
+                value = next(values)
+                isfixed = getattr(element, f'{name}_isfixed', False)
+                is_free.append(not isfixed and label not in fixed)
+                is_log.append(name in element.log_params and value > 0)
+        self.free = np.flatnonzero(is_free)
+        self.log_scale = np.array(is_log, dtype=bool)[self.free]
+        self.free_names = [self.param_names[idx] for idx in self.free]
+        self.weights = self._weights(weighting)
+
+    def _weights(self, weighting: Union[str, np.ndarray]) -> np.ndarray:
+        """
+        Returns the weights of the stacked residual, interleaved as
+        (real, imag) pairs to match z.view(float).
+        """
+        z = self.z
+        if isinstance(weighting, str):
+            if weighting not in SUPPORTED_WEIGHTINGS:
+                print('WARNING: weighting '+weighting +
+                      ' not supported. Switching to modulus...')
+                weighting = 'modulus'
+            if weighting == 'unit':
+                weights = np.ones((z.size, 2))
+            elif weighting == 'modulus':
+                weights = np.repeat(1/np.abs(z), 2).reshape(-1, 2)
+            else:
+                weights = 1/np.abs(np.column_stack((z.real, z.imag)))
+        else:
+            weights = np.asarray(weighting, dtype=float)
+            weights = np.broadcast_to(weights.reshape(z.size, -1), (z.size, 2))
+        weights = np.where(np.isfinite(weights), weights, 0.0)
+        return np.ascontiguousarray(weights).ravel()
+
+    @property
+    def n_free(self) -> int:
+        return self.free.size
+
+    def to_params(self, u: np.ndarray) -> np.ndarray:
+        """
+        Returns the full parameter vector (or one per row, if u is 2D) for
+        the free parameters u. Log-scaled values are kept within the normal
+        float range, so that they never underflow to 0 or overflow to inf.
+        """
+        u = np.asarray(u, dtype=float)
+        theta = np.where(self.log_scale, np.exp(np.clip(u, *LOG_RANGE)), u)
+        if u.ndim == 2:
+            params = np.repeat(self.params[None, :], len(u), axis=0)
+        else:
+            params = self.params.copy()
+        params[..., self.free] = theta
+        return params
+
+    def from_params(self, params: np.ndarray) -> np.ndarray:
+        """
+        Returns the free-parameter vector u for a full parameter vector.
+        """
+        theta = np.asarray(params, dtype=float)[..., self.free]
+        with np.errstate(divide='ignore'):
+            return np.where(self.log_scale, np.log(np.abs(theta)), theta)
+
+    def bounds(
+        self,
+        bounds: Optional[Dict[str, Tuple[Optional[float], Optional[float]]]]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Converts bounds given as {name: (lower, upper)} into bounds on u. A
+        None limit means unbounded.
+        """
+        lower = np.full(self.n_free, -np.inf)
+        upper = np.full(self.n_free, np.inf)
+        bounds = bounds if bounds else {}
+        for idx, name in enumerate(self.free_names):
+            low, high = bounds.get(name, (None, None))
+            if self.log_scale[idx]:
+                low = np.log(low) if low is not None and low > 0 else None
+                high = np.log(high) if high is not None else None
+            if low is not None:
+                lower[idx] = low
+            if high is not None:
+                upper[idx] = high
+        return lower, upper
+
+    def model(self, u: np.ndarray) -> np.ndarray:
+        """
+        Returns the model impedance for the free parameters u (one spectrum
+        per row if u is 2D).
+        """
+        return self.plan.z(self.f, self.to_params(u))
+
+    def residuals(self, u: np.ndarray) -> np.ndarray:
+        """
+        Returns the weighted residual, with the real and imaginary parts of
+        each point interleaved. Values that cannot be evaluated (e.g. at a
+        zero resistance in parallel) are replaced by LARGE_RESIDUAL, so that
+        the optimizer steps back instead of failing.
+        """
+        with np.errstate(all='ignore'):
+            deviation = self.model(u) - self.z
+            residuals = deviation.view(float)*self.weights
+        return np.nan_to_num(residuals, nan=LARGE_RESIDUAL,
+                             posinf=LARGE_RESIDUAL, neginf=-LARGE_RESIDUAL)
+
+    def cost(self, u: np.ndarray) -> np.ndarray:
+        """
+        Returns half the sum of squared residuals, one value per row if u is
+        2D, in which case all rows are evaluated in one batched call. Rows
+        whose model cannot be evaluated cost inf.
+        """
+        with np.errstate(all='ignore'):
+            cost = 0.5*np.sum(self.residuals(u)**2, axis=-1)
+        return np.where(np.isfinite(cost), cost, np.inf)
+
+    def jacobian(self, u: np.ndarray) -> np.ndarray:
+        """
+        Returns the Jacobian of residuals(), from the analytic derivatives of
+        the compiled circuit. Derivatives that cannot be evaluated are 0.
+        """
+        params = self.to_params(u)
+        with np.errstate(all='ignore'):
+            dz = self.plan.jacobian(self.f, params)[self.free]
+            # derivatives with respect to log-scaled parameters:
+            # d/du = theta*d/dtheta
+            dz *= np.where(self.log_scale, params[self.free], 1.0)[:, None]
+            jacobian = (dz.view(float)*self.weights).T
+        return np.nan_to_num(jacobian, nan=0.0, posinf=LARGE_RESIDUAL,
+                             neginf=-LARGE_RESIDUAL)
+
+
+class FitResult:
+    """
+    Stores the outcome of a CNLS fit: the fitted circuit, the parameter
+    values, the covariance and standard errors of the free parameters, and
+    goodness-of-fit figures. n_free is the number of parameters actually
+    fitted.
+
+    If the fit was done on a simplified circuit, everything refers to the
+    parameters of the original circuit. Parameters merged into one (e.g. R1
+    and R2 of R1-R2) cannot be told apart by the data: their stderr is inf
+    and their rows and columns of covariance are NaN. The fitted parameters
+    of the simplified circuit (e.g. 'R1-R2'), with their own covariance and
+    standard errors, are kept in simplified_names, simplified_free_names,
+    simplified_covariance and simplified_stderr, and the mapping between
+    both in simplification.
+    """
+    def __init__(
+        self,
+        problem: CNLSProblem,
+        solution: "OptimizeResult",
+        simplification: Optional["Simplification"] = None
+    ):
+        """
+        Pending
+        """
+        self.param_names = problem.param_names
+        self.free_names = problem.free_names
+        self.params = problem.to_params(solution.x)
+        self.chi2 = float(2*solution.cost)
+        self.dof = max(problem.weights.size - problem.n_free, 1)
+        self.chi2_reduced = self.chi2/self.dof
+        self.n_free = problem.n_free
+        self.nfev = solution.nfev
+        self.success = solution.success
+        self.message = solution.message
+        self.covariance = self._covariance(problem, solution)
+        stderr = np.sqrt(np.abs(np.diag(self.covariance)))
+        self.stderr = dict.fromkeys(self.param_names, 0.0)
+        self.stderr.update(zip(self.free_names, stderr.tolist()))
+        self.simplified_names = self.param_names
+        self.simplified_free_names = self.free_names
+        self.simplified_covariance = self.covariance
+        self.simplified_stderr = self.stderr
+        self.simplification = simplification
+        circuit = problem.circuit
+        if simplification is not None:
+            self._expand(simplification)
+            circuit = simplification.original
+        self.circuit = copy.deepcopy(circuit)
+        self.circuit.compile().set_params(self.params)
+
+    def _expand(self, simplification: "Simplification") -> None:
+        """
+        Converts params, stderr, free_names and covariance to the parameters
+        of the original circuit. Copied parameters keep their errors and
+        covariances, while merged ones are marked as not identifiable.
+        """
+        names = simplification.param_names
+        # position in the simplified covariance of each copied parameter
+        position = {}
+        merged = set()
+        simplified_index = {name: idx
+                            for idx, name in enumerate(self.free_names)}
+        for name, rule in zip(self.param_names, simplification.rules):
+            if rule[0] == 'param':
+                if name in simplified_index:
+                    position[names[rule[1]]] = simplified_index[name]
+            elif name in simplified_index:
+                merged.update(names[idx]
+                              for idx in simplification._leaves(rule))
+        free_names = [name for name in names
+                      if name in position or name in merged]
+        covariance = np.full((len(free_names), len(free_names)), np.nan)
+        copied = [idx for idx, name in enumerate(free_names)
+                  if name in position]
+        source = [position[free_names[idx]] for idx in copied]
+        covariance[np.ix_(copied, copied)] = \
+            self.covariance[np.ix_(source, source)]
+        stderr = dict.fromkeys(names, 0.0)
+        for idx, name in enumerate(free_names):
+            if name in merged:
+                covariance[idx, idx] = np.inf
+                stderr[name] = np.inf
+            else:
+                stderr[name] = self.stderr[self.free_names[position[name]]]
+        self.params = simplification.expand(self.params)
+        self.param_names = names
+        self.free_names = free_names
+        self.covariance = covariance
+        self.stderr = stderr
+
+    def _covariance(
+        self,
+        problem: CNLSProblem,
+        solution: "OptimizeResult"
+    ) -> np.ndarray:
+        """
+        Returns the covariance of the free parameters, from the Jacobian at
+        the solution and the reduced chi-square, converted from the log scale
+        where needed.
+        """
+        jac = solution.jac
+        cov_u = np.linalg.pinv(jac.T @ jac)*self.chi2_reduced
+        theta = self.params[problem.free]
+        scale = np.where(problem.log_scale, theta, 1.0)
+        # fits that wandered to extreme values may have infinite errors
+        with np.errstate(over='ignore', invalid='ignore'):
+            return cov_u*np.outer(scale, scale)
+
+    def as_dict(self) -> Dict[str, float]:
+        return dict(zip(self.param_names, self.params.tolist()))
+
+    def as_dataframe(self) -> pd.DataFrame:
+        """
+        Returns a pandas DataFrame with the value and standard error of each
+        parameter, indexed by parameter name.
+        """
+        stderr = [self.stderr[name] for name in self.param_names]
+        return pd.DataFrame({'value': self.params, 'stderr': stderr},
+                            index=self.param_names)
+
+
+def fit(
+    circuit: Union["ElectricalElement", "Circuit"],
+    zdata: ZData,
+    weighting: Union[str, np.ndarray] = 'modulus',
+    bounds: Optional[
+        Dict[str, Tuple[Optional[float], Optional[float]]]] = None,
+    fixed: Optional[List[str]] = None,
+    max_nfev: Optional[int] = None,
+    simplify: bool = True
+) -> FitResult:
+    """
+    Fits circuit to zdata by complex nonlinear least squares, starting from
+    the current parameter values of the circuit, which is left unchanged.
+
+    weighting: 'unit', 'modulus' (1/|Z| on both parts), 'proportional'
+    (1/|Z_re| and 1/|Z_im|), or an array of weights, one per point.
+    bounds: {name: (lower, upper)} for any parameter in circuit.param_names;
+    None means unbounded.
+    fixed: names of parameters to keep fixed, in addition to those flagged
+    with <name>_isfixed = True on their elements.
+    simplify: if True, reducible structure (e.g. resistors in series or
+    CPEs with p fixed at 1) is fitted in its simplified form, with fewer
+    parameters, and the result is mapped back to the parameters of circuit.
+    Parameters with bounds are never merged.
+    """
+    simplification = None
+    if simplify:
+        simplification = circuit.simplify(
+            fixed, keep=list(bounds) if bounds else None)
+        if simplification.reduces:
+            names = simplification.simplified_names()
+            circuit = simplification.circuit
+            fixed = simplification.fixed_names
+            if bounds:
+                bounds = {names[name]: limits
+                          for name, limits in bounds.items()
+                          if name in names}
+        else:
+            simplification = None
+    problem = CNLSProblem(circuit, zdata, weighting, fixed)
+    if problem.n_free == 0:
+        raise ValueError('All parameters of the circuit are fixed.')
+    u0 = problem.from_params(problem.params)
+    lower, upper = problem.bounds(bounds)
+    is_bounded = np.isfinite(lower).any() or np.isfinite(upper).any()
+    if is_bounded:
+        u0 = np.clip(u0, lower, upper)
+    method = 'trf' if is_bounded else 'lm'
+    solution = least_squares(problem.residuals,
+                             u0,
+                             jac=problem.jacobian,
+                             bounds=(lower, upper),
+                             method=method,
+                             max_nfev=max_nfev)
+    return FitResult(problem, solution, simplification)
+
+
+def _search_bounds(
+    problem: CNLSProblem,
+    bounds: Optional[Dict[str, Tuple[Optional[float], Optional[float]]]],
+    span: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns finite bounds on u for the global search: the given bounds where
+    available, span decades around the current value for log-scaled
+    parameters, and [0, 1] (e.g. CPE exponents) or the current value plus or
+    minus its magnitude for the others.
+    """
+    lower, upper = problem.bounds(bounds)
+    u0 = problem.from_params(problem.params)
+    half_width = np.where(problem.log_scale, span*np.log(10),
+                          np.maximum(np.abs(u0), 1.0))
+    is_unit = ~problem.log_scale & (u0 >= 0) & (u0 <= 1)
+    default_lower = np.where(is_unit, 0.0, u0 - half_width)
+    default_upper = np.where(is_unit, 1.0, u0 + half_width)
+    lower = np.where(np.isfinite(lower), lower, default_lower)
+    upper = np.where(np.isfinite(upper), upper, default_upper)
+    return lower, upper
+
+
+def _evolve(
+    problem: CNLSProblem,
+    lower: np.ndarray,
+    upper: np.ndarray,
+    popsize: int,
+    generations: int,
+    tol: float,
+    rng: np.random.Generator
+) -> Tuple[np.ndarray, float]:
+    """
+    Minimizes problem.cost within [lower, upper] by differential evolution
+    (current-to-best/1/bin with dithered mutation) and returns the best u
+    and its cost. The population starts from a Latin hypercube plus the
+    current parameters, and each generation is evaluated in one batched
+    call.
+    """
+    n_free = lower.size
+    width = upper - lower
+    strata = np.argsort(rng.random((popsize, n_free)), axis=0)
+    population = lower + (strata + rng.random((popsize, n_free)))/popsize*width
+    population[0] = np.clip(problem.from_params(problem.params), lower, upper)
+    cost = problem.cost(population)
+    rows = np.arange(popsize)
+    for _ in range(generations):
+        best = population[np.argmin(cost)]
+        # two distinct partners for each member, both other than itself
+        keys = rng.random((popsize, popsize))
+        keys[rows, rows] = 2.0
+        partners = np.argpartition(keys, 2, axis=1)[:, :2]
+        scale = rng.uniform(0.5, 1.0)
+        difference = population[partners[:, 0]] - population[partners[:, 1]]
+        mutant = (population + scale*(best - population) +
+                  scale*difference)
+        # components out of bounds land between the parent and the bound
+        mutant = np.where(mutant < lower, (population + lower)/2, mutant)
+        mutant = np.where(mutant > upper, (population + upper)/2, mutant)
+        crossover = rng.random((popsize, n_free)) < 0.9
+        crossover[rows, rng.integers(0, n_free, popsize)] = True
+        trial = np.where(crossover, mutant, population)
+        trial_cost = problem.cost(trial)
+        improved = trial_cost <= cost
+        population[improved] = trial[improved]
+        cost[improved] = trial_cost[improved]
+        finite = cost[np.isfinite(cost)]
+        if (finite.size == popsize
+                and np.std(finite) <= tol*np.abs(np.mean(finite))):
+            break
+    idx = np.argmin(cost)
+    return population[idx], float(cost[idx])
+
+
+def global_fit(
+    circuit: Union["ElectricalElement", "Circuit"],
+    zdata: ZData,
+    weighting: Union[str, np.ndarray] = 'modulus',
+    bounds: Optional[
+        Dict[str, Tuple[Optional[float], Optional[float]]]] = None,
+    fixed: Optional[List[str]] = None,
+    max_nfev: Optional[int] = None,
+    popsize: int = 100,
+    generations: int = 200,
+    span: float = SEARCH_SPAN,
+    tol: float = 1e-6,
+    seed: Optional[int] = None
+) -> FitResult:
+    """
+    Fits circuit to zdata when its current parameters may be off by decades:
+    a differential evolution search over the free parameters, in log space
+    for positive quantities, finds a starting point that is then refined by
+    fit(). The circuit itself is left unchanged.
+
+    popsize, generations: size of the population (at least 3, as each
+    mutation combines two other members with the best one), all of which is
+    evaluated in one batched call per generation, and maximum number of
+    generations.
+    The search stops earlier when the spread of costs in the population
+    falls below tol relative to their mean.
+    span: decades searched on each side of the current value of parameters
+    without bounds (CPE exponents are searched in [0, 1]).
+    seed: seed of the random generator, for reproducible searches.
+    Other arguments are as in fit().
+    """
+    if popsize < 3:
+        raise ValueError(f'popsize must be at least 3, not {popsize}.')
+    problem = CNLSProblem(circuit, zdata, weighting, fixed)
+    if problem.n_free == 0:
+        raise ValueError('All parameters of the circuit are fixed.')
+    lower, upper = _search_bounds(problem, bounds, span)
+    rng = np.random.default_rng(seed)
+    u, _ = _evolve(problem, lower, upper, popsize, generations, tol, rng)
+    start = copy.deepcopy(circuit)
+    start.compile().set_params(problem.to_params(u))
+    return fit(start, zdata, weighting, bounds, fixed, max_nfev)
+
+
+def _fit_chunk(
+    circuit: Union["ElectricalElement", "Circuit"],
+    chunk: List[Tuple[float, ZData]],
+    weighting: Union[str, np.ndarray],
+    bounds: Optional[Dict[str, Tuple[Optional[float], Optional[float]]]],
+    fixed: Optional[List[str]],
+    max_nfev: Optional[int]
+) -> List[dict]:
+    """
+    Fits the spectra of chunk in order, starting each fit from the result of
+    the previous one, and returns one table row per spectrum.
+    """
+    circuit = copy.deepcopy(circuit)
+    plan = circuit.compile()
+    rows = []
+    for key, zdata in chunk:
+        row = {'key': key}
+        try:
+            result = fit(circuit, zdata, weighting, bounds, fixed, max_nfev)
+        except (ArithmeticError, ValueError, np.linalg.LinAlgError) as error:
+            print(f'WARNING: fit at {key} failed ({error}). Skipping...')
+            row.update(dict.fromkeys(plan.param_names, np.nan))
+            row.update(success=False)
+            rows.append(row)
+            continue
+        if result.success and np.isfinite(result.params).all():
+            # warm start: the next spectrum starts from this result
+            plan.set_params(result.params)
+        row.update(result.as_dict())
+        row.update({f'{name}_stderr': value
+                    for name, value in result.stderr.items()})
+        row.update(chi2_reduced=result.chi2_reduced, nfev=result.nfev,
+                   success=result.success)
+        rows.append(row)
+    return rows
+
+
+def fit_series(
+    circuit: Union["ElectricalElement", "Circuit"],
+    series: Union[Dict[float, ZData], ZDataCollection],
+    weighting: Union[str, np.ndarray] = 'modulus',
+    bounds: Optional[
+        Dict[str, Tuple[Optional[float], Optional[float]]]] = None,
+    fixed: Optional[List[str]] = None,
+    max_nfev: Optional[int] = None,
+    processes: Optional[int] = None,
+    index_name: str = 'temperature'
+) -> pd.DataFrame:
+    """
+    Fits circuit to every spectrum of series (e.g. {temperature: ZData}, as
+    given by SmartFileReader.get_zdata_series or nyquistlib.get_data_exp) and
+    returns a table of fitted parameters, standard errors and fit figures
+    indexed by the series keys. The circuit itself is left unchanged.
+
+    The sorted keys are split into one contiguous chunk per process. Within a
+    chunk, each fit starts from the result at the neighbouring key, and the
+    first one from the current parameters of circuit. processes = 1 fits
+    everything in the current process; None uses all available CPUs.
+
+    series may also be a ZDataCollection, fitted in its order, in which case
+    the table is indexed by spectrum and joined to the metadata.
+    """
+    metadata = None
+    if isinstance(series, ZDataCollection):
+        metadata = series.metadata
+        series = series.as_series()
+    keys = sorted(series)
+    if not keys:
+        raise ValueError('The series has no spectra.')
+    if processes is None:
+        processes = os.cpu_count() or 1
+    processes = max(1, min(processes, len(keys)))
+    chunks = [[(keys[idx], series[keys[idx]]) for idx in chunk]
+              for chunk in np.array_split(np.arange(len(keys)), processes)]
+    args = (weighting, bounds, fixed, max_nfev)
+    if processes == 1:
+        rows = _fit_chunk(circuit, chunks[0], *args)
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = [executor.submit(_fit_chunk, circuit, chunk, *args)
+                       for chunk in chunks]
+            rows = [row for future in futures for row in future.result()]
+    table = pd.DataFrame(rows).set_index('key')
+    if metadata is not None:
+        table.index.name = metadata.index.name
+        return metadata.join(table)
+    table.index.name = index_name
+    return table
@@ -0,0 +1,193 @@
+# coding: utf-8
+
+"""
+This module provides estimates of circuit parameters from features of an
+impedance spectrum (arcs, intercepts and tails), used as starting values for
+fits.
+"""
+
+import copy
+import numpy as np
+from typing import List, Union
+
+from automaterials.experiment.eis.circuits import (
+    RC, RQ, Circuit, ElectricalElement, rc_pieces)
+from automaterials.experiment.eis.properties import ZData
+from automaterials.utils.constants import PI
+
+__author__ = "Rodolpho Mouta"
+__maintainer__ = "Rodolpho Mouta"
+__email__ = "mouta.rodolpho@gmail.com"
+
+"""
+Constants
+"""
+# arcs lower than this fraction of the highest are ignored
+MIN_ARC_HEIGHT = 0.05
+# limits of the CPE exponents estimated from arc depression
+P_RANGE = (0.3, 1.0)
+
+
+class SpectrumFeatures:
+    """
+    The arcs of a spectrum, located at the maxima of -Z_im vs f, each with
+    its apex frequency, time constant (1/(2*pi*f_apex), as in RC.tau and
+    RC.relax_freq), resistance (twice the distance in Z_re from its high-
+    frequency end to its apex) and CPE exponent (from how depressed the arc
+    is, as -Z_im at the apex is R*tan(p*pi/4)/2 for an RQ). Arcs are sorted
+    by increasing time constant. Also stores the high-frequency intercept
+    R_inf, the inductance L from a positive Z_im at the highest frequency,
+    and the exponent and -Z_im of the low-frequency tail.
+    """
+    def __init__(self, zdata: ZData, min_height: float = MIN_ARC_HEIGHT):
+        """
+        Pending
+        """
+        order = np.argsort(np.asarray(zdata.f, dtype=float))[::-1]
+        f = np.asarray(zdata.f, dtype=float)[order]
+        z = np.asarray(zdata.z, dtype=complex)[order]
+        self.f, self.z = f, z
+        omega = 2*PI*f
+        height = -z.imag
+        smooth = height.copy()
+        if f.size > 2:
+            smooth[1:-1] = (0.25*height[:-2] + 0.5*height[1:-1] +
+                            0.25*height[2:])
+        padded = np.concatenate([[-np.inf], smooth, [-np.inf]])
+        is_apex = (padded[1:-1] > padded[:-2]) & (padded[1:-1] >= padded[2:])
+        # heights are relative to the highest arc, not to a capacitive tail
+        # rising up to the lowest frequency
+        arcs = smooth[:-1][is_apex[:-1]]
+        highest = arcs.max() if arcs.size else smooth.max()
+        apex = np.flatnonzero(is_apex & (smooth > min_height*max(highest, 0)))
+        # the high-frequency end of each arc: the lowest point between it and
+        # the previous arc (or the highest frequency)
+        starts = np.concatenate([[0], apex[:-1]])
+        ends = [np.argmin(smooth[start:stop + 1]) + start if stop > start
+                else stop for start, stop in zip(starts, apex)]
+        ends = np.array(ends, dtype=int)
+        # an apex at the lowest frequency may be a capacitive tail instead
+        self.at_low_end = apex == f.size - 1
+        self.f_apex = f[apex]
+        self.tau = 1/(2*PI*self.f_apex)
+        R = 2*(z.real[apex] - z.real[ends])
+        self.R = np.where(R > 0, R, 2*height[apex])
+        ratio = np.clip(2*height[apex]/self.R, 0, None)
+        self.p = np.clip(4/PI*np.arctan(ratio), *P_RANGE)
+        self.R_inf = float(z.real[ends[0]]) if apex.size else float(z.real[0])
+        self.L = float(z.imag[0]/omega[0]) if z.imag[0] > 0 else 0.0
+        tail = slice(-2, None) if f.size >= 2 else slice(None)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slope = (np.diff(np.log(np.abs(height[tail]))) /
+                     np.diff(np.log(omega[tail])))
+        if slope.size and np.isfinite(slope[0]):
+            self.tail_p = float(np.clip(-slope[0], *P_RANGE))
+        else:
+            self.tail_p = 1.0
+        self.tail_height = float(height[-1])
+        self.tail_omega = float(omega[-1])
+
+    @property
+    def n_arcs(self) -> int:
+        return self.tau.size
+
+    def drop_low_end(self) -> None:
+        """
+        Drops the arc whose apex is at the lowest frequency, if any, e.g.
+        when a capacitor or CPE in series explains the low-frequency tail.
+        """
+        keep = ~self.at_low_end
+        self.f_apex, self.tau = self.f_apex[keep], self.tau[keep]
+        self.R, self.p = self.R[keep], self.p[keep]
+        self.at_low_end = self.at_low_end[keep]
+
+
+def _assign_arcs(
+    features: SpectrumFeatures,
+    pieces: List["RC"]
+) -> None:
+    """
+    Sets R and C (RC) or R, T and p (RQ) of pieces from the arcs of
+    features. Pieces are matched to arcs in order of time constant, as in
+    BrickLayerModelLike.sorted: if there are more arcs than pieces, the
+    largest arcs are used; if there are fewer, arcs go to pieces spread over
+    the order of current time constants, and the others keep their values.
+    """
+    if features.n_arcs == 0 or not pieces:
+        return
+    arcs = np.arange(features.n_arcs)
+    if features.n_arcs > len(pieces):
+        arcs = np.sort(np.argsort(features.R)[::-1][:len(pieces)])
+    with np.errstate(all='ignore'):
+        taus = np.array([piece.tau for piece in pieces], dtype=float)
+    order = np.argsort(np.nan_to_num(taus, nan=np.inf), kind='stable')
+    if arcs.size > 1:
+        positions = np.round(np.linspace(0, len(pieces) - 1, arcs.size))
+        positions = positions.astype(int)
+    else:
+        positions = np.zeros(1, dtype=int)
+    for arc, position in zip(arcs, positions):
+        piece = pieces[order[position]]
+        R, tau, p = features.R[arc], features.tau[arc], features.p[arc]
+        piece.R = R
+        if isinstance(piece, RQ):
+            # tau = (R*T)**(1/p), so T = tau**p/R
+            piece.p = p
+            piece.T = tau**p/R
+        else:
+            piece.C = tau/R
+
+
+def _series_leaves(
+    circuit: Union["ElectricalElement", "Circuit"]
+) -> List["ElectricalElement"]:
+    """
+    Returns the elements directly in series in circuit (or circuit itself,
+    if it is an element).
+    """
+    if getattr(circuit, 'pieces', None) is None:
+        return [circuit]
+    top = circuit.expanded()
+    if not top.is_series_circuit:
+        return []
+    return [piece for piece in top.pieces
+            if getattr(piece, 'pieces', None) is None]
+
+
+def initial_guess(
+    circuit: Union["ElectricalElement", "Circuit"],
+    zdata: ZData,
+    inplace: bool = False,
+    min_height: float = MIN_ARC_HEIGHT
+) -> Union["ElectricalElement", "Circuit"]:
+    """
+    Returns circuit (a copy, unless inplace = True) with starting values
+    estimated from the spectrum features of zdata: RC and RQ pieces from the
+    arcs, matched by time constant; resistors in series from the high-
+    frequency intercept; an inductor in series from the high-frequency
+    Z_im; and a capacitor or CPE in series from the low-frequency tail.
+    Elements elsewhere keep their values.
+    """
+    if not inplace:
+        circuit = copy.deepcopy(circuit)
+    features = SpectrumFeatures(zdata, min_height)
+    leaves = _series_leaves(circuit)
+    if any(leaf.is_capacitor or leaf.is_cpe for leaf in leaves):
+        features.drop_low_end()
+    _assign_arcs(features, rc_pieces(circuit))
+    resistors = [leaf for leaf in leaves if leaf.is_resistor]
+    for resistor in resistors:
+        resistor.R = max(features.R_inf, 0.0)/len(resistors) or resistor.R
+    for leaf in leaves:
+        if leaf.is_inductor and features.L > 0:
+            leaf.L = features.L
+        elif leaf.is_capacitor and features.tail_height > 0:
+            # -Z_im = 1/(omega*C)
+            leaf.C = 1/(features.tail_omega*features.tail_height)
+        elif leaf.is_cpe and features.tail_height > 0:
+            # -Z_im = sin(p*pi/2)/(T*omega**p)
+            p = features.tail_p
+            leaf.p = p
+            leaf.T = np.sin(p*PI/2)/(features.tail_height *
+                                     features.tail_omega**p)
+    return circuit
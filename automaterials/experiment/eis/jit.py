@@ -0,0 +1,203 @@
+# coding: utf-8
+
+"""
+This module provides an optional JIT-compiled backend for the evaluation of
+compiled circuits on batches of parameter sets. When Numba is installed, the
+element kernels and the series/parallel combinations of a plan are fused
+into a single loop over parameter rows and frequencies, which keeps every
+intermediate value in a few scalar registers instead of full temporary
+arrays. Without Numba, the NumPy backend is always used.
+
+Only R, C, Q (CPE) and L have a fused kernel (the jit_code of their
+class). A plan with any other element (W, Ws, Wo, G, H or TLM) has no
+jit_program and always runs on the NumPy backend, with a warning the first
+time it is evaluated while 'numba' is selected.
+"""
+
+import numpy as np
+from typing import List, Optional
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+__author__ = "Rodolpho Mouta"
+__maintainer__ = "Rodolpho Mouta"
+__email__ = "mouta.rodolpho@gmail.com"
+
+"""
+Backends
+"""
+SUPPORTED_BACKENDS = ('numpy', 'numba')
+NUMBA_AVAILABLE = numba is not None
+
+"""
+Element codes
+"""
+RESISTOR = 0
+CAPACITOR = 1
+CONSTANT_PHASE = 2
+INDUCTOR = 3
+
+"""
+Instruction codes (as in compiled.py)
+"""
+LEAF = 0
+INVERT = 1
+
+_backend = 'numba' if NUMBA_AVAILABLE else 'numpy'
+_warned = set()  # element symbols already reported by warn_fallback
+
+
+def set_backend(backend: str) -> None:
+    """
+    Selects the backend used by CompiledCircuit.z on batches of parameter
+    sets: 'numba' (the default, when Numba is installed) or 'numpy'. If Numba
+    is not installed, 'numba' silently falls back to 'numpy'.
+    """
+    global _backend
+    if backend not in SUPPORTED_BACKENDS:
+        print('WARNING: backend '+backend +
+              ' not supported. Switching to numpy...')
+        backend = 'numpy'
+    _backend = backend if NUMBA_AVAILABLE else 'numpy'
+
+
+def get_backend() -> str:
+    """
+    Returns the backend in use.
+    """
+    return _backend
+
+
+def program(instructions: List[tuple]) -> Optional[np.ndarray]:
+    """
+    Returns the instructions of a CompiledCircuit encoded as an int64 array,
+    one row (op, register, first, source, start, admittance) per
+    instruction, where source is the element code of a LEAF (from the
+    jit_code of its class) and the source register of an INVERT. Returns
+    None if an element has no jit_code, in which case the plan can only run
+    on the NumPy backend.
+    """
+    rows = []
+    for op, reg, first, source, start, stop, admittance in instructions:
+        if op == LEAF:
+            code = getattr(source, 'jit_code', None)
+            if code is None:
+                return None
+            rows.append((LEAF, reg, first, code, start, admittance))
+        else:
+            rows.append((INVERT, reg, first, source, 0, 0))
+    return np.array(rows, dtype=np.int64).reshape(-1, 6)
+
+
+def unsupported(elements: list) -> List[str]:
+    """
+    Returns the symbols of the elements without a jit_code, which keep a
+    plan on the NumPy backend.
+    """
+    symbols = []
+    for element in elements:
+        if (getattr(element, 'jit_code', None) is None
+                and element.symbol not in symbols):
+            symbols.append(element.symbol)
+    return symbols
+
+
+def warn_fallback(elements: list) -> None:
+    """
+    Prints a warning, once per element symbol, that a plan with elements
+    unsupported by the numba backend is evaluated with NumPy.
+    """
+    symbols = [symbol for symbol in unsupported(elements)
+               if symbol not in _warned]
+    if symbols:
+        _warned.update(symbols)
+        print('WARNING: the numba backend does not support the elements ' +
+              ', '.join(symbols) +
+              '. Circuits with them are evaluated with numpy...')
+
+
+def _element(
+    code: int,
+    values: np.ndarray,
+    start: int,
+    omega: float,
+    admittance: bool
+) -> complex:
+    """
+    Returns the impedance (or admittance) of one element at one frequency.
+    """
+    if code == RESISTOR:
+        value = complex(values[start])
+        return 1/value if admittance else value
+    if code == CAPACITOR:
+        value = 1j*omega*values[start]
+        return value if admittance else 1/value
+    if code == CONSTANT_PHASE:
+        # (i*w)**p = w**p*exp(i*p*pi/2)
+        p = values[start + 1]
+        phase = p*np.pi/2
+        value = values[start]*omega**p*(np.cos(phase) + 1j*np.sin(phase))
+        return value if admittance else 1/value
+    value = 1j*omega*values[start]
+    return 1/value if admittance else value
+
+
+def _z_rows(
+    instructions: np.ndarray,
+    admittance_output: bool,
+    n_registers: int,
+    omega: np.ndarray,
+    params: np.ndarray,
+    out: np.ndarray
+) -> None:
+    """
+    Writes into out (N, len(omega)) the impedance for each of the N rows of
+    params, running the encoded instructions once per row and frequency.
+    """
+    for row in prange(params.shape[0]):
+        registers = np.empty(n_registers, dtype=np.complex128)
+        values = params[row]
+        for k in range(omega.size):
+            for idx in range(instructions.shape[0]):
+                reg = instructions[idx, 1]
+                if instructions[idx, 0] == LEAF:
+                    value = _element(instructions[idx, 3], values,
+                                     instructions[idx, 4], omega[k],
+                                     instructions[idx, 5] != 0)
+                else:
+                    value = 1/registers[instructions[idx, 3]]
+                if instructions[idx, 2] != 0:
+                    registers[reg] = value
+                else:
+                    registers[reg] += value
+            out[row, k] = 1/registers[0] if admittance_output else registers[0]
+
+
+if NUMBA_AVAILABLE:
+    prange = numba.prange
+    _element = numba.njit(cache=True, inline='always')(_element)
+    _z_rows = numba.njit(cache=True, parallel=True)(_z_rows)
+else:
+    prange = range
+
+
+def z_rows(
+    instructions: np.ndarray,
+    admittance_output: bool,
+    n_registers: int,
+    omega: np.ndarray,
+    params: np.ndarray,
+    out: np.ndarray
+) -> np.ndarray:
+    """
+    Returns out (N, len(omega)), complex128 or complex64, filled with the
+    impedance for each row of params (N, n_params), given the instructions
+    encoded by program(). Values are computed in double precision.
+    """
+    _z_rows(instructions, bool(admittance_output), n_registers,
+            np.ascontiguousarray(omega, dtype=float),
+            np.ascontiguousarray(params, dtype=float), out)
+    return out
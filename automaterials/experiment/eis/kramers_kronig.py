@@ -0,0 +1,277 @@
+# coding: utf-8
+
+"""
+This module provides the linear Kramers-Kronig (Lin-KK) test, used to check
+whether impedance spectra, and which of their frequency ranges, are
+consistent with a linear, causal and stable system before fitting them.
+"""
+
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional, Tuple
+
+from automaterials.experiment.eis.properties import ZData
+from automaterials.utils.constants import I, PI
+
+__author__ = "Rodolpho Mouta"
+__maintainer__ = "Rodolpho Mouta"
+__email__ = "mouta.rodolpho@gmail.com"
+
+"""
+Constants
+"""
+# the number of RC elements grows until mu falls below this
+MU_CRITERION = 0.85
+
+
+class KKResult:
+    """
+    Stores the outcome of a Lin-KK test on one spectrum: the number of Voigt
+    RC elements and their time constants and resistances, the mu figure
+    used to choose that number, the fitted spectrum, and the residuals
+    relative to |Z| at each frequency. Residuals of a Kramers-Kronig
+    consistent spectrum are small and randomly scattered around zero; drifts
+    or large values at the ends of the spectrum flag inconsistent ranges.
+    """
+    def __init__(
+        self,
+        f: np.ndarray,
+        z: np.ndarray,
+        z_fit: np.ndarray,
+        tau: np.ndarray,
+        coefficients: np.ndarray,
+        mu: float,
+        inductance: bool,
+        capacitance: bool
+    ):
+        """
+        Pending
+        """
+        self.f = f
+        self.z = z
+        self.z_fit = z_fit
+        self.tau = tau
+        self.n_elements = len(tau)
+        self.mu = float(mu)
+        self.R0 = float(coefficients[0])
+        self.R = coefficients[1:1 + self.n_elements]
+        extra = iter(coefficients[1 + self.n_elements:].tolist())
+        self.L = next(extra) if inductance else None
+        self.C = 1/next(extra) if capacitance else None
+        modulus = np.abs(z)
+        self.residuals_real = (z.real - z_fit.real)/modulus
+        self.residuals_imag = (z.imag - z_fit.imag)/modulus
+        self.chi2 = float(np.sum(self.residuals_real**2 +
+                                 self.residuals_imag**2))
+
+    def consistent(self, threshold: float = 0.01) -> np.ndarray:
+        """
+        Returns a boolean mask of the frequencies at which both residuals are
+        within threshold (relative to |Z|).
+        """
+        return ((np.abs(self.residuals_real) <= threshold) &
+                (np.abs(self.residuals_imag) <= threshold))
+
+    def as_dict(self) -> dict:
+        return {'f': self.f, 'Z_re': self.z.real, 'Z_im': self.z.imag,
+                'Z_re_fit': self.z_fit.real, 'Z_im_fit': self.z_fit.imag,
+                'residual_re': self.residuals_real,
+                'residual_im': self.residuals_imag}
+
+    def as_dataframe(self) -> pd.DataFrame:
+        """
+        Returns a pandas DataFrame with the data, the fitted spectrum and the
+        residuals at each frequency.
+        """
+        return pd.DataFrame(self.as_dict())
+
+
+def time_constants(f: np.ndarray, n_elements: int) -> np.ndarray:
+    """
+    Returns n_elements time constants, log-spaced between 1/omega_max and
+    1/omega_min, as in Schönleber et al., Electrochim. Acta 131 (2014) 20.
+    """
+    omega = 2*PI*np.asarray(f, dtype=float)
+    return np.geomspace(1/omega.max(), 1/omega.min(), n_elements)
+
+
+def _basis(
+    f: np.ndarray,
+    tau: np.ndarray,
+    inductance: bool,
+    capacitance: bool
+) -> np.ndarray:
+    """
+    Returns the complex impedance of each linear term of the model, one
+    column per term: R0, the RC elements with unit resistance, and i*omega
+    (L) and 1/(i*omega) (1/C) if requested.
+    """
+    jomega = I*2*PI*np.asarray(f, dtype=float)
+    columns = [np.ones_like(jomega), 1/(1 + np.outer(jomega, tau))]
+    if inductance:
+        columns.append(jomega)
+    if capacitance:
+        columns.append(1/jomega)
+    return np.column_stack(columns)
+
+
+def _weighted_target(z: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the weights 1/|Z| and the weighted target of _solve for each
+    row of z (N, len(f)), as (N, 2*len(f)) arrays of real and imaginary
+    parts.
+    """
+    weights = 1/np.abs(z)
+    weights = np.concatenate([weights, weights], axis=1)
+    return weights, np.concatenate([z.real, z.imag], axis=1)*weights
+
+
+def _solve(
+    basis: np.ndarray,
+    weights: np.ndarray,
+    target: np.ndarray
+) -> np.ndarray:
+    """
+    Returns the coefficients of basis fitted to each row of z (N, len(f)) by
+    linear least squares on the real and imaginary parts, weighted by 1/|Z|,
+    given the weights and target of _weighted_target(z). All rows are
+    solved together, by one stacked QR decomposition of the design
+    augmented with the target, whose R factor holds both the triangular
+    system and Q.T @ target, so that Q is never formed.
+    """
+    # columns are scaled to unit norm, as L and 1/C span many decades
+    design = np.concatenate([basis.real, basis.imag])
+    scale = np.linalg.norm(design, axis=0)
+    scale[scale == 0] = 1.0
+    design = design/scale
+    n_terms = design.shape[1]
+    augmented = np.empty((len(target), design.shape[0], n_terms + 1))
+    np.multiply(design[None, :, :], weights[:, :, None],
+                out=augmented[:, :, :n_terms])
+    augmented[:, :, n_terms] = target
+    r = np.linalg.qr(augmented, mode='r')
+    coefficients = np.linalg.solve(r[:, :n_terms, :n_terms],
+                                   r[:, :n_terms, n_terms:])
+    return coefficients[:, :, 0]/scale
+
+
+def _mu(resistances: np.ndarray) -> np.ndarray:
+    """
+    Returns mu = 1 - sum(|R_k| for R_k < 0)/sum(R_k for R_k >= 0) for each
+    row of resistances. mu drops when the RC elements start fitting noise.
+    """
+    negative = np.where(resistances < 0, -resistances, 0).sum(axis=1)
+    positive = np.where(resistances >= 0, resistances, 0).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(positive > 0, 1 - negative/positive, -np.inf)
+
+
+def _kk_test_batch(
+    f: np.ndarray,
+    z: np.ndarray,
+    c: float,
+    max_elements: Optional[int],
+    inductance: bool,
+    capacitance: bool
+) -> List[KKResult]:
+    """
+    Runs the Lin-KK test on each row of z (N, len(f)), all measured at the
+    same frequencies. The number of RC elements is increased from 1 for all
+    unfinished spectra at once, each spectrum finishing as soon as its mu
+    falls below c (or at max_elements).
+    """
+    if max_elements is None:
+        max_elements = len(f)
+    max_elements = max(1, min(max_elements, len(f)))
+    results = [None]*len(z)
+    active = np.arange(len(z))
+    weights, target = _weighted_target(z)
+    for n_elements in range(1, max_elements + 1):
+        tau = time_constants(f, n_elements)
+        basis = _basis(f, tau, inductance, capacitance)
+        coefficients = _solve(basis, weights, target)
+        mu = _mu(coefficients[:, 1:1 + n_elements])
+        done = (mu <= c) | (n_elements == max_elements)
+        z_fit = coefficients[done] @ basis.T
+        for idx, z_row, coefficient_row, mu_row in zip(
+                active[done], z_fit, coefficients[done], mu[done]):
+            results[idx] = KKResult(f, z[idx], z_row, tau, coefficient_row,
+                                    mu_row, inductance, capacitance)
+        active = active[~done]
+        weights, target = weights[~done], target[~done]
+        if active.size == 0:
+            break
+    return results
+
+
+def kk_test(
+    zdata: ZData,
+    c: float = MU_CRITERION,
+    max_elements: Optional[int] = None,
+    inductance: bool = True,
+    capacitance: bool = False
+) -> KKResult:
+    """
+    Runs the linear Kramers-Kronig test of Schönleber et al. on zdata: a
+    series of Voigt RC elements with fixed, log-spaced time constants (plus
+    a series resistance, and optionally an inductance and a capacitance) is
+    fitted by weighted linear least squares, and the residuals tell how far
+    each point is from a Kramers-Kronig consistent spectrum.
+
+    c: the number of RC elements is the smallest one for which mu (see
+    KKResult) is at most c, which avoids fitting the noise.
+    max_elements: upper limit on the number of RC elements, at most (and by
+    default) the number of frequencies.
+    inductance, capacitance: add a series inductance (e.g. from the cables)
+    or a series capacitance (e.g. blocking electrodes) to the model.
+    """
+    f = np.asarray(zdata.f, dtype=float)
+    z = np.asarray(zdata.z, dtype=complex)
+    return _kk_test_batch(f, z[None, :], c, max_elements, inductance,
+                          capacitance)[0]
+
+
+def kk_test_series(
+    series: Dict[float, ZData],
+    c: float = MU_CRITERION,
+    max_elements: Optional[int] = None,
+    inductance: bool = True,
+    capacitance: bool = False
+) -> Dict[float, KKResult]:
+    """
+    Runs kk_test on every spectrum of series (e.g. {temperature: ZData}, as
+    given by SmartFileReader.get_zdata_series) and returns the results with
+    the same keys. Spectra measured at the same frequencies are tested
+    together, as one batched linear solve per number of RC elements.
+    """
+    groups = {}
+    for key, zdata in series.items():
+        f = np.asarray(zdata.f, dtype=float)
+        groups.setdefault(f.tobytes(), (f, []))[1].append(key)
+    results = {}
+    for f, keys in groups.values():
+        z = np.array([np.asarray(series[key].z, dtype=complex)
+                      for key in keys])
+        batch = _kk_test_batch(f, z, c, max_elements, inductance, capacitance)
+        results.update(zip(keys, batch))
+    return {key: results[key] for key in series}
+
+
+def kk_summary(
+    results: Dict[float, KKResult],
+    index_name: str = 'temperature'
+) -> pd.DataFrame:
+    """
+    Returns a table with the number of RC elements, mu, chi2 and the largest
+    residuals of each result of kk_test_series, indexed by its keys.
+    """
+    rows = [{'key': key,
+             'n_elements': result.n_elements,
+             'mu': result.mu,
+             'chi2': result.chi2,
+             'max_residual_re': np.abs(result.residuals_real).max(),
+             'max_residual_im': np.abs(result.residuals_imag).max()}
+            for key, result in results.items()]
+    table = pd.DataFrame(rows).set_index('key')
+    table.index.name = index_name
+    return table
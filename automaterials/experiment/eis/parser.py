@@ -0,0 +1,160 @@
+# coding: utf-8
+
+"""
+This module provides functions used to build electrical circuits from
+circuit description code (CDC) strings, such as 'R-(R//Q)-(R//Q)//(R//Q)'.
+"""
+
+import re
+from typing import Dict, List, Optional, Tuple, Union
+
+from automaterials.experiment.eis.circuits import (
+    ElectricalElement, Circuit, R, C, Q, L, Warburg, WarburgShort, WarburgOpen,
+    Gerischer, HavriliakNegami, TransmissionLine)
+
+__author__ = "Rodolpho Mouta"
+__maintainer__ = "Rodolpho Mouta"
+__email__ = "mouta.rodolpho@gmail.com"
+
+"""
+Constants
+"""
+# element classes and default parameter values for each CDC symbol
+ELEMENTS = {'R': (R, {'R': 1.0}),
+            'C': (C, {'C': 1.0e-6}),
+            'Q': (Q, {'T': 1.0e-6, 'p': 0.9}),
+            'L': (L, {'L': 1.0e-6}),
+            'W': (Warburg, {'sigma': 1.0}),
+            'Ws': (WarburgShort, {'R': 1.0, 'tau': 1.0}),
+            'Wo': (WarburgOpen, {'R': 1.0, 'tau': 1.0}),
+            'G': (Gerischer, {'R': 1.0, 'tau': 1.0e-3}),
+            'H': (HavriliakNegami,
+                  {'R': 1.0, 'tau': 1.0e-3, 'alpha': 0.9, 'beta': 0.9}),
+            'TLM': (TransmissionLine,
+                    {'R_ion': 1.0, 'R_ct': 1.0, 'T': 1.0e-6, 'p': 0.9})}
+TOKEN_PATTERN = re.compile(r'\s*(?:(//|-|\(|\))|(RC|RQ|TLM|W[so]|[A-Z]))')
+
+
+def tokenize(cdc: str) -> List[Tuple[str, int]]:
+    """
+    Splits a CDC string into tokens (operators, parentheses, and element
+    symbols), each returned with its position in the string.
+    """
+    tokens = []
+    position = 0
+    cdc = cdc.rstrip()
+    while position < len(cdc):
+        match = TOKEN_PATTERN.match(cdc, position)
+        if match is None:
+            raise ValueError(f'Unexpected character {cdc[position]!r} at '
+                             f'position {position} of {cdc!r}.')
+        token = match.group(1) or match.group(2)
+        tokens.append((token, match.start(match.lastindex)))
+        position = match.end()
+    return tokens
+
+
+class _Parser:
+    """
+    A recursive descent parser for CDC strings, where // (parallel) takes
+    precedence over - (series), as in Python expressions:
+
+        series   := parallel ('-' parallel)*
+        parallel := factor ('//' factor)*
+        factor   := symbol | '(' series ')'
+    """
+    def __init__(self, cdc: str):
+        self.cdc = cdc
+        self.tokens = tokenize(cdc)
+        self.position = 0
+        self.counts = dict.fromkeys(ELEMENTS, 0)
+
+    def peek(self) -> Optional[str]:
+        if self.position < len(self.tokens):
+            return self.tokens[self.position][0]
+        return None
+
+    def error(self, message: str) -> ValueError:
+        if self.position < len(self.tokens):
+            where = f'at position {self.tokens[self.position][1]}'
+        else:
+            where = 'at the end'
+        return ValueError(f'{message} {where} of {self.cdc!r}.')
+
+    def parse(self) -> Union[ElectricalElement, Circuit]:
+        circuit = self.series()
+        if self.peek() is not None:
+            raise self.error(f'Unexpected {self.peek()!r}')
+        return circuit
+
+    def series(self) -> Union[ElectricalElement, Circuit]:
+        circuit = self.parallel()
+        while self.peek() == '-':
+            self.position += 1
+            circuit = circuit - self.parallel()
+        return circuit
+
+    def parallel(self) -> Union[ElectricalElement, Circuit]:
+        circuit = self.factor()
+        while self.peek() == '//':
+            self.position += 1
+            circuit = circuit // self.factor()
+        return circuit
+
+    def factor(self) -> Union[ElectricalElement, Circuit]:
+        token = self.peek()
+        if token == '(':
+            self.position += 1
+            circuit = self.series()
+            if self.peek() != ')':
+                raise self.error("Expected ')'")
+            self.position += 1
+            return circuit
+        if token in ('RC', 'RQ'):
+            self.position += 1
+            return self.element('R') // self.element(token[1])
+        if token in ELEMENTS:
+            self.position += 1
+            return self.element(token)
+        if token is None:
+            raise self.error('Expected an element or (')
+        raise self.error(f'Unknown element {token!r}')
+
+    def element(self, symbol: str) -> ElectricalElement:
+        """
+        Returns a new element with default values, labeled with its symbol
+        and a number that counts elements of the same kind (R1, R2, ...).
+        """
+        self.counts[symbol] += 1
+        element_class, values = ELEMENTS[symbol]
+        return element_class(**values, label=f'{symbol}{self.counts[symbol]}')
+
+
+def parse_circuit(
+    cdc: str,
+    params: Optional[Dict[str, float]] = None
+) -> Union[ElectricalElement, Circuit]:
+    """
+    Builds a circuit from a CDC string made of the element symbols R, C, Q
+    (CPE), L, W (semi-infinite Warburg), Ws and Wo (finite-length and
+    finite-space Warburg), G (Gerischer), H (Havriliak-Negami) and TLM
+    (transmission line), the shorthands RC and RQ (R//C and R//Q), the
+    operators - (series) and // (parallel), and parentheses. As in Python
+    expressions, // takes precedence over -, so 'R-RQ//RQ' is R-(RQ//RQ).
+    Elements are labeled R1, R2, ..., Q1, ..., in order of appearance, and
+    R//C and R//Q pairs become RC and RQ objects.
+
+    params: values by parameter name (e.g. {'R1': 10, 'Q1_p': 0.8}), as in
+    circuit.param_names. Other parameters keep default values.
+    """
+    circuit = _Parser(cdc).parse()
+    if params:
+        plan = circuit.compile()
+        values = plan.get_params().copy()
+        for name, value in params.items():
+            if name not in plan.param_index:
+                raise ValueError(f'Unknown parameter {name!r}. The parameters '
+                                 f'of {cdc!r} are {plan.param_names}.')
+            values[plan.param_index[name]] = value
+        plan.set_params(values)
+    return circuit
@@ -5,30 +5,196 @@ This module provides classes and functions used to store and convert between
 quantities relevant to EIS. 
 """
 
+import weakref
 import numpy as np
 import pandas as pd
 
 from automaterials.utils.constants import I, PI
 from automaterials.utils.constants import VACUUM_PERMITTIVITY_SI as E0
 
-from typing import Optional, Union, List
+from typing import Dict, Optional, Union, List
 
 __author__ = "Rodolpho Mouta"
 __maintainer__ = "Rodolpho Mouta"
 __email__ = "mouta.rodolpho@gmail.com"
 
+"""
+Cache sizes
+"""
+MAX_CACHED_POWERS = 16  # (i*omega)**p tables kept per frequency grid
+
+# grids returned by shared_frequency_grid, keyed by their values
+_shared_grids = weakref.WeakValueDictionary()
+
+"""
+Classes to store frequencies.
+"""
+
+
+class FrequencyGrid(np.ndarray):
+    """
+    A read-only array of linear frequencies that lazily computes and keeps
+    the quantities derived from it (omega, log(omega), i*omega) and a few
+    (i*omega)**p tables, so that repeated evaluations on the same grid, e.g.
+    during a fit, do not recompute them. It can be used wherever an f array
+    is accepted. Arithmetic on a grid returns plain arrays, and writeable
+    copies of a grid do not cache anything.
+
+    Grids are float64 by default. A float32 grid, whose tables are float32
+    and complex64, serves single precision evaluations.
+    """
+    def __new__(
+        cls,
+        f: Union[float, int, List[Union[int, float]], np.ndarray],
+        dtype: Union[type, np.dtype] = float
+    ) -> "FrequencyGrid":
+        grid = np.array(f, dtype=dtype).view(cls)
+        grid.flags.writeable = False
+        return grid
+
+    def __array_finalize__(self, obj: Optional[np.ndarray]) -> None:
+        self._cache = {}
+        self._powers = {}
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        inputs = tuple(x.view(np.ndarray) if isinstance(x, FrequencyGrid)
+                       else x for x in inputs)
+        if 'out' in kwargs:
+            kwargs['out'] = tuple(x.view(np.ndarray)
+                                  if isinstance(x, FrequencyGrid) else x
+                                  for x in kwargs['out'])
+        return getattr(ufunc, method)(*inputs, **kwargs)
+
+    def __reduce__(self):
+        return (FrequencyGrid, (self.view(np.ndarray), self.dtype))
+
+    def __deepcopy__(self, memo: dict) -> "FrequencyGrid":
+        return FrequencyGrid(self, self.dtype)
+
+    def _cached(self, name: str, compute) -> np.ndarray:
+        """
+        Returns the cached value of name, computing it if needed. Nothing is
+        cached if the grid is writeable.
+        """
+        if self.flags.writeable:
+            return compute()
+        value = self._cache.get(name)
+        if value is None:
+            value = compute()
+            value.flags.writeable = False
+            self._cache[name] = value
+        return value
+
+    @property
+    def omega(self) -> np.ndarray:
+        return self._cached('omega', lambda: 2*PI*self.view(np.ndarray))
+
+    @property
+    def log_omega(self) -> np.ndarray:
+        return self._cached('log_omega', lambda: np.log(self.omega))
+
+    @property
+    def jomega(self) -> np.ndarray:
+        return self._cached('jomega', lambda: I*self.omega)
+
+    @property
+    def log_jomega(self) -> np.ndarray:
+        """
+        log(i*omega) = log(omega) + i*pi/2.
+        """
+        return self._cached('log_jomega', lambda: self.log_omega + I*PI/2)
+
+    def jomega_power(self, p: float) -> np.ndarray:
+        """
+        Returns (i*omega)**p, computed as omega**p*exp(i*p*pi/2). The last
+        MAX_CACHED_POWERS tables are kept, keyed by p.
+        """
+        p = float(p)
+        table = self._powers.get(p)
+        if table is None:
+            # a Python complex factor keeps the precision of the grid
+            table = np.exp(p*self.log_omega)*complex(np.exp(I*PI/2*p))
+            if not self.flags.writeable:
+                if len(self._powers) >= MAX_CACHED_POWERS:
+                    del self._powers[next(iter(self._powers))]
+                table.flags.writeable = False
+                self._powers[p] = table
+        return table
+
+    def with_precision(self, dtype: Union[type, np.dtype]) -> "FrequencyGrid":
+        """
+        Returns the grid in the real precision of dtype (e.g. float32 for
+        complex64), so that its tables match outputs of that dtype. The
+        converted grid is cached.
+        """
+        real = np.finfo(dtype).dtype
+        if real == self.dtype:
+            return self
+        return self._cached(f'grid_{real}', lambda: FrequencyGrid(self, real))
+
+
+def as_frequency_grid(
+    f: Union[float, int, List[Union[int, float]], np.ndarray]
+) -> FrequencyGrid:
+    """
+    Returns f if it is already a FrequencyGrid, or a new (at least 1D)
+    FrequencyGrid with the values of f otherwise.
+    """
+    if isinstance(f, FrequencyGrid) and f.ndim > 0:
+        return f
+    return FrequencyGrid(np.atleast_1d(np.asarray(f, dtype=float)))
+
+
+def shared_frequency_grid(
+    f: Union[float, int, List[Union[int, float]], np.ndarray]
+) -> FrequencyGrid:
+    """
+    Returns a read-only FrequencyGrid with the values of f. While it is in
+    use, the same grid is returned for equal frequencies, so that spectra
+    measured at the same frequencies share one array and its cached tables.
+    """
+    f = np.asarray(f, dtype=float)
+    key = (f.shape, f.tobytes())
+    grid = _shared_grids.get(key)
+    if grid is None:
+        grid = FrequencyGrid(f)
+        _shared_grids[key] = grid
+    return grid
+
 def f_array(start: Union[float, int] = 1.0,
             stop: Union[float, int] = 1.0e6,
-            pts_per_decade: int = 30) -> np.ndarray:
+            pts_per_decade: int = 30) -> FrequencyGrid:
     decades = np.log10(stop) - np.log10(start)
     num_of_pts = int(decades * pts_per_decade) + 1
-    return np.geomspace(start, stop, num=num_of_pts)
+    return FrequencyGrid(np.geomspace(start, stop, num=num_of_pts))
 
 """
 Constants
 """
 F_DEFAULT = f_array()
 
+"""
+Metadata
+"""
+# columns always present in the metadata of a ZDataCollection
+METADATA_COLUMNS = ('temperature', 'sweep', 'sample', 'dc_level')
+
+"""
+Converted properties
+"""
+# attribute of ImpedanceConverter for each property name
+PROPERTY_NAMES = {'z': 'z', 'impedance': 'z',
+                  'y': 'y', 'admittance': 'y',
+                  'm': 'm', 'modulus': 'm',
+                  'c': 'c', 'capacitance': 'c',
+                  'rho': 'rho', 'resistivity': 'rho',
+                  'sigma': 'sigma', 'conductivity': 'sigma',
+                  'epsilon_r': 'epsilon_r', 'dielectric constant': 'epsilon_r',
+                  'loss_tan': 'loss_tan', 'loss tangent': 'loss_tan',
+                  'dielectric loss': 'loss_tan'}
+SUPPORTED_COMPONENTS = ('real', 'imag', 'imaginary', 'magnitude', 'phase',
+                        None)
+
 """
 Conversion factors
 """
@@ -45,6 +211,8 @@ def omega(
     """
     Pending
     """
+    if isinstance(f, FrequencyGrid):
+        return f.omega
     if isinstance(f, list):
         f = np.array(f)
     w = 2*PI*f
@@ -56,8 +224,7 @@ def f(
     """
     Pending
     """
-    if isinstance(omega, list):
-        w = np.array(omega)
+    w = np.array(omega) if isinstance(omega, list) else omega
     f = w/(2*PI)
     return f
 
@@ -67,38 +234,148 @@ Classes to store data.
 class ZData:
     """
     An object to store impedance data and corresponding linear frequencies. 
+
+    The impedance is held in one contiguous complex128 buffer, of which
+    z_real and z_imag are views, and the frequencies in a FrequencyGrid.
+    Both are read-only, so that slices and DataFrames can share them
+    without copies; assigning f, z, z_real or z_imag replaces the data. The
+    DataFrames of as_dataframe() are built once and kept until then.
     """
     def __init__(
         self,
         f: Union[float, int, List[Union[int, float]], np.ndarray],
-        z: Union[complex, np.ndarray]
+        z: Union[complex, np.ndarray],
+        copy: bool = True
     ):
         """
-        Pending
+        copy = False keeps z without copying it when it is already a
+        complex128 array. It must not be modified afterwards. Frequencies
+        are always stored as a shared_frequency_grid.
+        """
+        self._set(f, z, copy)
+
+    def _set(
+        self,
+        f: Union[float, int, List[Union[int, float]], np.ndarray],
+        z: Union[complex, np.ndarray],
+        copy: bool = True
+    ) -> None:
+        if not (isinstance(f, FrequencyGrid) and f.dtype == float and
+                not f.flags.writeable):
+            # a read-only grid is immutable and can be shared as is
+            f = shared_frequency_grid(f)
+        z = (np.array(z, dtype=complex) if copy
+             else np.asarray(z, dtype=complex).view())
+        z.flags.writeable = False
+        self._f = f
+        self._z = z
+        self._dataframes = {}
+
+    @classmethod
+    def _from_views(cls, f: "FrequencyGrid", z: np.ndarray) -> "ZData":
+        zdata = cls.__new__(cls)
+        zdata._f, zdata._z, zdata._dataframes = f, z, {}
+        return zdata
+
+    def __getstate__(self) -> dict:
+        # cached DataFrames are not copied
+        return {'f': self._f, 'z': self._z}
+
+    def __setstate__(self, state: dict) -> None:
+        self._set(state['f'], state['z'], copy=False)
+
+    @property
+    def f(self) -> "FrequencyGrid":
+        return self._f
+
+    @f.setter
+    def f(
+        self, f: Union[float, int, List[Union[int, float]], np.ndarray]
+    ) -> None:
+        self._set(f, self._z, copy=False)
+
+    @property
+    def z(self) -> np.ndarray:
+        return self._z
+
+    @z.setter
+    def z(self, z: Union[complex, np.ndarray]) -> None:
+        self._set(self._f, z)
+
+    @property
+    def z_real(self) -> np.ndarray:
+        return self._z.real
+
+    @z_real.setter
+    def z_real(self, z_real: Union[float, np.ndarray]) -> None:
+        self._set(self._f, np.asarray(z_real) + I*self._z.imag, copy=False)
+
+    @property
+    def z_imag(self) -> np.ndarray:
+        return self._z.imag
+
+    @z_imag.setter
+    def z_imag(self, z_imag: Union[float, np.ndarray]) -> None:
+        self._set(self._f, self._z.real + I*np.asarray(z_imag), copy=False)
+
+    def __len__(self) -> int:
+        return np.size(self._f)
+
+    def __getitem__(self, key: Union[int, slice, np.ndarray]) -> "ZData":
+        """
+        Returns the data at the selected frequencies, as views if key is a
+        slice.
+        """
+        if isinstance(key, slice):
+            return self._from_views(self._f[key], self._z[key])
+        key = np.atleast_1d(key)
+        return ZData(self._f.view(np.ndarray)[key], self._z[key], copy=False)
+
+    def between(
+        self,
+        f_min: Optional[float] = None,
+        f_max: Optional[float] = None
+    ) -> "ZData":
+        """
+        Returns the data with f_min <= f <= f_max. If the frequencies are
+        sorted (in either order), the result is a view of this data.
         """
-        self.f = np.array(f)
-        self.z = np.array(z)
-        self.z_real = np.array(z.real)
-        self.z_imag = np.array(z.imag)
+        f = self._f.view(np.ndarray)
+        f_min = -np.inf if f_min is None else f_min
+        f_max = np.inf if f_max is None else f_max
+        inside = (f >= f_min) & (f <= f_max)
+        steps = np.diff(f)
+        if np.all(steps >= 0) or np.all(steps <= 0):
+            selected = np.flatnonzero(inside)
+            if selected.size == 0:
+                return self[0:0]
+            return self[selected[0]:selected[-1] + 1]
+        return self[inside]
     
     def as_dict(self, minus_imag: bool = False) -> dict:
         """
         Returns a dict representation of impedance data, with keys f, Z_re, 
         and Z_im.
         """ 
-        sign = -1 if minus_imag else 1
-        z_im_key = '-Z_im' if minus_imag else 'Z_im'
-        return {'f':self.f, 'Z_re':self.z_real, z_im_key:sign*self.z_imag}
+        if minus_imag:
+            return {'f': self._f.view(np.ndarray), 'Z_re': self.z_real,
+                    '-Z_im': -self.z_imag}
+        return {'f': self._f.view(np.ndarray), 'Z_re': self.z_real,
+                'Z_im': self.z_imag}
     
     def as_dataframe(self, minus_imag: bool = False) -> pd.DataFrame:
         """
         Returns a pandas DataFrame with columns f, Z_re, and Z_im. If this is 
         the last command in a Jupyter or Google Colab notebook, the dataframe 
-        will be displayed.  
+        will be displayed. The columns share memory with the data, and the
+        DataFrame is built only once (changes to the returned one do not
+        affect the next calls).
         """
-        df = pd.DataFrame(self.as_dict(minus_imag))
-        df
-        return df
+        df = self._dataframes.get(minus_imag)
+        if df is None:
+            df = pd.DataFrame(self.as_dict(minus_imag), copy=False)
+            self._dataframes[minus_imag] = df
+        return df.copy(deep=False)
 
     @classmethod
     def from_f_zreal_zimag(
@@ -111,12 +388,10 @@ class ZData:
         Allows initialization from real and imaginary parts, instead of 
         full (complex) impedance. 
         """
-        i = complex(0,1)
-        f_array = np.array(f)
-        z_real_array = np.array(z_real)
-        z_imag_array = np.array(z_imag)
-        z_array = z_real_array + i*z_imag_array 
-        return cls(f_array,z_array)
+        z_array = np.empty(np.shape(z_real), dtype=complex)
+        z_array.real = z_real
+        z_array.imag = z_imag
+        return cls(f, z_array, copy=False)
 
     def to_zview(self, filename: str, minus_imag: bool = False) -> None:
         """
@@ -150,52 +425,483 @@ class ZData:
                **kwargs) -> None:
         """
         Writes records stored in a DataFrame with columns f, Z_re, and Z_im 
-        to a SQL database.
+        to a SQL database. To keep many spectra in one indexed, queryable
+        database, use store.ExperimentStore instead.
         """
         df = self.as_dataframe(minus_imag)
         df.to_sql(name, con, schema=schema, if_exists=if_exists, **kwargs)
 
+    def to_npz(self, filename: str, compressed: bool = False) -> None:
+        """
+        Writes impedance data to a NumPy .npz archive that
+        ZDataCollection.from_npz() reads back memory-mapped. See
+        archive.write_npz.
+        """
+        from automaterials.experiment.eis.archive import write_npz
+        write_npz(self, filename, compressed)
+
+    def to_arrow(self, filename: str) -> None:
+        """
+        Writes impedance data to an Arrow IPC file (requires pyarrow). See
+        archive.write_arrow.
+        """
+        from automaterials.experiment.eis.archive import write_arrow
+        write_arrow(self, filename)
+
+    def to_parquet(self, filename: str, **kwargs) -> None:
+        """
+        Writes impedance data to a Parquet file (requires pyarrow).
+        **kwargs: parameters passed through to archive.write_parquet().
+        """
+        from automaterials.experiment.eis.archive import write_parquet
+        write_parquet(self, filename, **kwargs)
+
+
+class ZDataCollection:
+    """
+    A collection of N impedance spectra with a metadata table (one row per
+    spectrum, with columns temperature, sweep, sample and dc_level, plus any
+    others given).
+
+    If all spectra share the same frequencies, z is an (N, n_f) complex128
+    array and f is one FrequencyGrid, so that operations on the whole
+    collection broadcast over the spectra. Otherwise the spectra are stored
+    one after the other in flat f and z arrays, with spectrum k at
+    offsets[k]:offsets[k + 1] (ragged layout), and elementwise operations
+    still run on all spectra at once. As in ZData, the arrays are read-only
+    and the spectra returned by indexing are views.
+    """
+    def __init__(
+        self,
+        spectra: List["ZData"],
+        metadata: Optional[
+            Union[pd.DataFrame, Dict[str, list], List[dict]]] = None
+    ):
+        """
+        Pending
+        """
+        spectra = list(spectra)
+        lengths = [len(zdata) for zdata in spectra]
+        if spectra and all(zdata.f is spectra[0].f
+                           or np.array_equal(zdata.f, spectra[0].f)
+                           for zdata in spectra):
+            f = spectra[0].f
+            z = np.array([zdata.z for zdata in spectra], dtype=complex)
+            z = z.reshape(len(spectra), -1)
+        elif spectra:
+            f = np.concatenate([np.atleast_1d(zdata.f) for zdata in spectra])
+            z = np.concatenate([np.atleast_1d(zdata.z) for zdata in spectra])
+        else:
+            f = np.empty(0)
+            z = np.empty(0, dtype=complex)
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(int)
+        self._set(f, z, offsets, metadata)
+
+    def _set(
+        self,
+        f: np.ndarray,
+        z: np.ndarray,
+        offsets: np.ndarray,
+        metadata: Optional[Union[pd.DataFrame, Dict[str, list], List[dict]]]
+    ) -> None:
+        self.is_uniform = z.ndim == 2
+        if isinstance(f, FrequencyGrid) and not f.flags.writeable:
+            self._f = f
+        elif self.is_uniform:
+            self._f = shared_frequency_grid(f)
+        else:
+            self._f = FrequencyGrid(f)
+        self._z = z
+        self._z.flags.writeable = False
+        self.offsets = offsets
+        self.offsets.flags.writeable = False
+        n_spectra = len(offsets) - 1
+        if isinstance(metadata, pd.DataFrame):
+            metadata = metadata.reset_index(drop=True)
+        elif metadata:
+            # no index, so that lists of the wrong length are not broadcast
+            metadata = pd.DataFrame(metadata)
+        else:
+            metadata = pd.DataFrame(index=range(n_spectra))
+        if len(metadata) != n_spectra:
+            raise ValueError(f'metadata must have one row per spectrum '
+                             f'({n_spectra}), not {len(metadata)}.')
+        for column in METADATA_COLUMNS:
+            if column not in metadata.columns:
+                metadata[column] = np.nan
+        metadata.index.name = 'spectrum'
+        self.metadata = metadata
+
+    @classmethod
+    def _from_parts(
+        cls,
+        f: np.ndarray,
+        z: np.ndarray,
+        offsets: np.ndarray,
+        metadata: pd.DataFrame
+    ) -> "ZDataCollection":
+        collection = cls.__new__(cls)
+        collection._set(f, z, offsets, metadata)
+        return collection
+
+    @classmethod
+    def from_array(
+        cls,
+        f: Union[List[Union[int, float]], np.ndarray],
+        z: np.ndarray,
+        metadata: Optional[
+            Union[pd.DataFrame, Dict[str, list], List[dict]]] = None,
+        copy: bool = True
+    ) -> "ZDataCollection":
+        """
+        Returns a collection of the rows of z (N, len(f)), all measured at
+        frequencies f. copy = False keeps z without copying it when it is a
+        complex128 array, which must not be modified afterwards.
+        """
+        z = (np.array(z, dtype=complex) if copy
+             else np.asarray(z, dtype=complex).view())
+        z = z.reshape(-1, np.size(f))
+        offsets = np.arange(z.shape[0] + 1)*z.shape[1]
+        return cls._from_parts(shared_frequency_grid(f), z, offsets, metadata)
+
+    @classmethod
+    def from_series(
+        cls,
+        series: Dict[Union[int, float], Union["ZData", np.ndarray]],
+        key_name: str = 'temperature'
+    ) -> "ZDataCollection":
+        """
+        Returns a collection of the spectra of series (e.g. {temperature:
+        ZData}, as given by SmartFileReader.get_zdata_series, or {temperature:
+        array with columns f, Z_re and Z_im}), with the keys in the metadata
+        column key_name.
+        """
+        spectra = [value if isinstance(value, ZData) else
+                   ZData.from_f_zreal_zimag(
+                       *np.asarray(value, dtype=float).T[:3])
+                   for value in series.values()]
+        return cls(spectra, {key_name: list(series)})
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    @property
+    def f(self) -> "FrequencyGrid":
+        """
+        The frequencies: one grid shared by all spectra, or all of them one
+        after the other in the ragged layout.
+        """
+        return self._f
+
+    @property
+    def z(self) -> np.ndarray:
+        """
+        The impedance: (N, n_f), or flat in the ragged layout.
+        """
+        return self._z
+
+    @property
+    def z_real(self) -> np.ndarray:
+        return self._z.real
+
+    @property
+    def z_imag(self) -> np.ndarray:
+        return self._z.imag
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    @property
+    def spectrum_index(self) -> np.ndarray:
+        """
+        The index of the spectrum of each point, shaped as z.
+        """
+        index = np.repeat(np.arange(len(self)), self.lengths)
+        return index.reshape(self._z.shape)
+
+    def _point_frequencies(self) -> np.ndarray:
+        """
+        The frequency of each point, shaped as z.
+        """
+        f = self._f.view(np.ndarray)
+        return np.broadcast_to(f, self._z.shape) if self.is_uniform else f
+
+    def __getitem__(
+        self,
+        key: Union[int, slice, List[int], np.ndarray]
+    ) -> Union["ZData", "ZDataCollection"]:
+        """
+        Returns spectrum key as a ZData view, or a new collection with the
+        spectra selected by a slice, a list of positions or a boolean mask.
+        """
+        if np.ndim(key) == 0 and not isinstance(key, slice):
+            key = range(len(self))[key]
+            if self.is_uniform:
+                return ZData._from_views(self._f, self._z[key])
+            start, stop = self.offsets[key], self.offsets[key + 1]
+            return ZData._from_views(self._f[start:stop], self._z[start:stop])
+        positions = np.arange(len(self))[key]
+        metadata = self.metadata.iloc[positions]
+        if self.is_uniform:
+            z = self._z[key] if isinstance(key, slice) else self._z[positions]
+            offsets = np.arange(len(positions) + 1)*self._z.shape[1]
+            return self._from_parts(self._f, z, offsets, metadata)
+        lengths = self.lengths[positions]
+        starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        points = (np.repeat(self.offsets[positions] - starts, lengths) +
+                  np.arange(lengths.sum()))
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(int)
+        return self._from_parts(self._f.view(np.ndarray)[points],
+                                self._z[points], offsets, metadata)
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def select(self, **values) -> "ZDataCollection":
+        """
+        Returns the spectra whose metadata match all values, e.g.
+        select(sample='A', sweep=1).
+        """
+        mask = np.ones(len(self), dtype=bool)
+        for column, value in values.items():
+            mask &= (self.metadata[column] == value).to_numpy()
+        return self[mask]
+
+    def sort_by(self, *columns: str) -> "ZDataCollection":
+        """
+        Returns the collection sorted by the given metadata columns.
+        """
+        ordered = self.metadata.sort_values(list(columns), kind='stable')
+        return self[ordered.index.to_numpy()]
+
+    def crop(
+        self,
+        f_min: Optional[float] = None,
+        f_max: Optional[float] = None
+    ) -> "ZDataCollection":
+        """
+        Returns the collection with only the points with f_min <= f <=
+        f_max, cropped in a single vectorized step.
+        """
+        f = self._f.view(np.ndarray)
+        f_min = -np.inf if f_min is None else f_min
+        f_max = np.inf if f_max is None else f_max
+        inside = (f >= f_min) & (f <= f_max)
+        if self.is_uniform:
+            z = self._z[:, inside]
+            offsets = np.arange(len(self) + 1)*z.shape[1]
+            return self._from_parts(f[inside], z, offsets, self.metadata)
+        lengths = np.bincount(self.spectrum_index[inside], minlength=len(self))
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(int)
+        return self._from_parts(f[inside], self._z[inside], offsets,
+                                self.metadata)
+
+    def as_series(
+        self, key: Optional[str] = None
+    ) -> Dict[Union[int, float], "ZData"]:
+        """
+        Returns the spectra as a dict of ZData views, keyed by the metadata
+        column key (whose values must be unique) or by position if key is
+        None, as accepted by fit_series, kk_test_series and drt_series.
+        """
+        keys = range(len(self)) if key is None else self.metadata[key].tolist()
+        if len(set(keys)) != len(self):
+            raise ValueError(f'The values of {key!r} are not unique.')
+        return {value: self[idx] for idx, value in enumerate(keys)}
+
+    def converter(
+        self,
+        form_factor: Union[int, float] = 1.0,
+        form_factor_unit: str = 'cm'
+    ) -> "ImpedanceConverter":
+        """
+        Returns an ImpedanceConverter of all spectra at once, whose
+        properties have the shape of z.
+        """
+        return ImpedanceConverter(self, form_factor, form_factor_unit)
+
+    def as_dataframe(self, minus_imag: bool = False) -> pd.DataFrame:
+        """
+        Returns a pandas DataFrame in long format, with one row per point,
+        the metadata of its spectrum and the columns f, Z_re and Z_im.
+        """
+        index = self.spectrum_index.ravel()
+        df = self.metadata.iloc[index].reset_index()
+        z = self._z.ravel()
+        df['f'] = self._point_frequencies().ravel()
+        df['Z_re'] = z.real
+        if minus_imag:
+            df['-Z_im'] = -z.imag
+        else:
+            df['Z_im'] = z.imag
+        return df
+
+    def to_csv(
+        self,
+        filename: str,
+        sep: str = ',',
+        index: bool = False,
+        decimal: str = '.',
+        minus_imag: bool = False,
+        **kwargs
+    ) -> None:
+        """
+        Writes the collection in long format (see as_dataframe) to a
+        comma-separated values (csv) file.
+        **kwargs: parameters passed through to pd.DataFrame.to_csv().
+        """
+        df = self.as_dataframe(minus_imag)
+        df.to_csv(filename, sep=sep, index=index, decimal=decimal, **kwargs)
+
+    def to_npz(self, filename: str, compressed: bool = False) -> None:
+        """
+        Writes the collection and its metadata to a NumPy .npz archive. See
+        archive.write_npz.
+        """
+        from automaterials.experiment.eis.archive import write_npz
+        write_npz(self, filename, compressed)
+
+    def to_arrow(self, filename: str) -> None:
+        """
+        Writes the collection and its metadata to an Arrow IPC file, one row
+        per spectrum (requires pyarrow). See archive.write_arrow.
+        """
+        from automaterials.experiment.eis.archive import write_arrow
+        write_arrow(self, filename)
+
+    def to_parquet(self, filename: str, **kwargs) -> None:
+        """
+        Writes the collection and its metadata to a Parquet file, one row
+        per spectrum (requires pyarrow).
+        **kwargs: parameters passed through to archive.write_parquet().
+        """
+        from automaterials.experiment.eis.archive import write_parquet
+        write_parquet(self, filename, **kwargs)
+
+    @classmethod
+    def from_npz(
+        cls, filename: str, mmap: bool = True, **values
+    ) -> "ZDataCollection":
+        """
+        Returns the collection in a .npz archive written by to_npz,
+        memory-mapped unless mmap = False or the archive is compressed.
+        values select spectra by metadata, as in select(), e.g.
+        from_npz('campaign.npz', sample='A').
+        """
+        from automaterials.experiment.eis.archive import read_npz
+        return read_npz(filename, mmap, **values)
+
+    @classmethod
+    def from_arrow(cls, filename: str, **values) -> "ZDataCollection":
+        """
+        Returns the collection in an Arrow IPC file written by to_arrow,
+        memory-mapped. values select spectra by metadata, as in select().
+        """
+        from automaterials.experiment.eis.archive import read_arrow
+        return read_arrow(filename, **values)
+
+    @classmethod
+    def from_parquet(cls, filename: str, **values) -> "ZDataCollection":
+        """
+        Returns the collection in a Parquet file written by to_parquet,
+        decoding only the row groups whose spectra match the metadata
+        values, as in select().
+        """
+        from automaterials.experiment.eis.archive import read_parquet
+        return read_parquet(filename, **values)
+
 
 """
 Conversion classes
 """
 class ImpedanceConverter():
     """
-    A class to convert impedance into related properties. 
+    A class to convert impedance into related properties. Each property is
+    computed on first access, from those already computed when possible,
+    and kept until form_factor or form_factor_unit changes.
+
+    zdata may be a ZData, a ZDataCollection or a list of ZData (a stack of
+    spectra, e.g. a temperature series), in which case every property has
+    the shape of the collection z and the whole stack converts at once.
     """
     def __init__(
         self,
-        zdata: "ZData",
+        zdata: Union["ZData", "ZDataCollection", List["ZData"]],
         form_factor: Union[int, float] = 1.0,
         form_factor_unit: str = 'cm'     
     ):
         """
         Pending
         """
+        if isinstance(zdata, (list, tuple)):
+            zdata = ZDataCollection(zdata)
+        self.zdata = zdata
+        self._cache = {}
         self.form_factor_unit = form_factor_unit
         self.form_factor = form_factor
         self.f = zdata.f
-        f = self.f
-        w = omega(f) # angular frequency
-        u = I*w*E0
-        s = form_factor*TO_METER_FROM[form_factor_unit] # form_factor in m
-        z = zdata.z
-        self.z = z
-        self.y = 1/z
-        self.m = u*s*z
-        self.c = 1/(I*w*z)
-        self.rho = s*z
-        self.sigma = 1/(s*z)
-        self.epsilon_r = 1/(u*s*z)
-        self.loss_tan = -self.epsilon_r.imag/self.epsilon_r.real
-        self.output = {'z': self.z, 'impedance': self.z,
-                       'y': self.y, 'admittance': self.y,
-                       'm': self.m, 'modulus': self.m,
-                       'c': self.c, 'capacitance': self.c,
-                       'rho': self.rho, 'resistivity': self.rho,
-                       'sigma': self.sigma, 'conductivity': self.sigma,
-                       'epsilon_r': self.epsilon_r, 'dielectric constant': self.epsilon_r,
-                       'loss tangent': self.loss_tan, 'dielectric loss': self.loss_tan}
+        self.z = zdata.z
+
+    def _cached(self, name: str, compute) -> np.ndarray:
+        value = self._cache.get(name)
+        if value is None:
+            value = compute()
+            self._cache[name] = value
+        return value
+
+    @property
+    def _omega(self) -> np.ndarray:
+        return omega(self.f)
+
+    @property
+    def _form_factor_si(self) -> float:
+        # form_factor in m
+        return self.form_factor*TO_METER_FROM[self.form_factor_unit]
+
+    @property
+    def y(self) -> np.ndarray:
+        return self._cached('y', lambda: 1/self.z)
+
+    @property
+    def rho(self) -> np.ndarray:
+        return self._cached('rho', lambda: self._form_factor_si*self.z)
+
+    @property
+    def sigma(self) -> np.ndarray:
+        return self._cached('sigma', lambda: self.y/self._form_factor_si)
+
+    @property
+    def m(self) -> np.ndarray:
+        # M = i*omega*E0*s*Z
+        return self._cached('m', lambda: self.rho*(I*E0*self._omega))
+
+    @property
+    def c(self) -> np.ndarray:
+        # C = 1/(i*omega*Z)
+        return self._cached('c', lambda: self.y/(I*self._omega))
+
+    @property
+    def epsilon_r(self) -> np.ndarray:
+        # epsilon_r = 1/(i*omega*E0*s*Z)
+        return self._cached('epsilon_r', lambda: self.sigma/(I*E0*self._omega))
+
+    @property
+    def loss_tan(self) -> np.ndarray:
+        def compute():
+            epsilon_r = self.epsilon_r
+            return -epsilon_r.imag/epsilon_r.real
+        return self._cached('loss_tan', compute)
+
+    @property
+    def output(self) -> Dict[str, np.ndarray]:
+        """
+        All properties, keyed by each of their names. Accessing it computes
+        all of them.
+        """
+        return {name: getattr(self, attribute)
+                for name, attribute in PROPERTY_NAMES.items()}
 
     def to_property(self, 
                     property: str, 
@@ -203,7 +909,9 @@ class ImpedanceConverter():
                     component: Optional[str] = None
     ) -> Union[float, complex, np.ndarray]:
         """
-        ...
+        Returns the property (one of the keys of PROPERTY_NAMES), or one of
+        its components ('real', 'imag', 'magnitude' or 'phase', in degrees),
+        in SI units.
 
         unit_type = 'auto' has the same effect as unit = 'SI', except for the
         length unit in resistivities and conductivities, which are output in 
@@ -212,17 +920,18 @@ class ImpedanceConverter():
         if unit_type not in ('SI', 'auto'):
             print('WARNING: unit_type '+unit_type+' not supported. Switching to auto...')
             unit_type = 'auto'
-        output_property = self.output[property.lower()]
+        attribute = PROPERTY_NAMES[property.lower()]
+        output_property = getattr(self, attribute)
         if unit_type == 'auto':
-            if output_property == self.rho:
+            if attribute == 'rho':
                 output_property = output_property*FROM_METER_TO['cm'] # convert Ω•m into Ω•cm
-            elif output_property == self.sigma:
-                output_property = output_property/FROM_METER_TO['cm'] # convert Ω/m into Ω/cm
-        supported_components = ('real', 'imag', 'imaginary', 'magnitude', 'phase', None)  
-        if component not in supported_components:
+            elif attribute == 'sigma':
+                # convert S/m into S/cm
+                output_property = output_property/FROM_METER_TO['cm']
+        if component not in SUPPORTED_COMPONENTS:
             print('WARNING: component '+component+' not supported. Switching to None...')
             component = None
-        elif component is not None and output_property == self.loss_tan:
+        elif component is not None and attribute == 'loss_tan':
             print('WARNING: loss tangent does not support components. Switching to None...')
             component = None
         if component is None:
@@ -232,9 +941,51 @@ class ImpedanceConverter():
         elif component in ('imag','imaginary'):
             return output_property.imag
         elif component == 'magnitude':
-            return output_property.absolute
+            return np.abs(output_property)
         elif component == 'phase':
-            return output_property.angle(deg=True)
+            return np.angle(output_property, deg=True)
+
+    def to_dataframe(
+        self,
+        properties: Optional[List[str]] = None,
+        components: List[str] = ('real', 'imag'),
+        unit_type: str = 'auto'
+    ) -> pd.DataFrame:
+        """
+        Returns a pandas DataFrame with one row per point, with column f
+        (and, for a stack of spectra, the spectrum and its metadata) and one
+        column per property and component, e.g. 'rho_real' or 'c_phase'
+        (loss_tan has a single column). properties: names as in
+        to_property, by default all of them. All columns are gathered in one
+        pass and the DataFrame is built once.
+        """
+        if properties is None:
+            properties = list(dict.fromkeys(PROPERTY_NAMES.values()))
+        columns = {}
+        for property in properties:
+            attribute = PROPERTY_NAMES[property.lower()]
+            if attribute == 'loss_tan':
+                columns[attribute] = \
+                    self.to_property(attribute, unit_type).ravel()
+                continue
+            for component in components:
+                columns[f'{attribute}_{component}'] = \
+                    np.ravel(self.to_property(attribute, unit_type, component))
+        if isinstance(self.zdata, ZDataCollection):
+            index = self.zdata.spectrum_index.ravel()
+            df = self.zdata.metadata.iloc[index].reset_index()
+            df['f'] = self.zdata._point_frequencies().ravel()
+            return pd.concat([df, pd.DataFrame(columns)], axis=1)
+        return pd.DataFrame({'f': np.ravel(self.f), **columns})
+
+    @property
+    def form_factor(self) -> float:
+        return self._form_factor
+
+    @form_factor.setter
+    def form_factor(self, form_factor: Union[int, float]):
+        self._form_factor = form_factor
+        self._cache.clear()
     
     @property
     def form_factor_unit(self) -> str:
@@ -246,4 +997,5 @@ class ImpedanceConverter():
             print('WARNING: the unit '+unit+' is currently unavailable. Assuming cm...')
             self._form_factor_unit = 'cm'
         else:
-            self._form_factor_unit = unit
\ No newline at end of file
+            self._form_factor_unit = unit
+        self._cache.clear()
@@ -3,10 +3,11 @@
 import numpy as np
 import pandas as pd
 
-from automaterials.experiment.eis.properties import ZData, omega
+from automaterials.experiment.eis.properties import (
+    ZData, ZDataCollection, omega)
 from automaterials.utils.constants import I
 
-from typing import List, Optional
+from typing import Dict, Optional, Tuple, Union
 
 __author__ = "Rodolpho Mouta"
 __maintainer__ = "Rodolpho Mouta"
@@ -121,6 +122,80 @@ class SmartFileReader:
             z_imag = z_abs*np.sin(z_phase_rad)
         return ZData.from_f_zreal_zimag(f, z_real, z_imag)
     
+    def get_zdata_series(
+        self
+    ) -> Dict[Union[int, float, Tuple[float, int]], ZData]:
+        """
+        Returns the spectra in the file as a dict of ZData objects, one per
+        sweep, keyed by set-point temperature when available or by sweep
+        number otherwise. Sweep numbers are those of the file, as in
+        get_zdata_collection(), and a single sweep is always keyed by its
+        number (1 if the file has none). If a set point is repeated (e.g. on
+        heating and cooling), every spectrum is keyed by (temperature, sweep
+        number) instead, so that none is lost.
+        """
+        temperature_labels = ["Set Point ('C)", "Set Point (K)",
+                              "Set Temperature"]
+        temperature_label = None
+        df = self.to_dataframe()
+        for label in temperature_labels:
+            if label in df.columns:
+                temperature_label = label
+        if (temperature_label
+                and df[temperature_label].dtypes in ('int64', 'float64')):
+            temperature_data_exists = True
+        else:
+            temperature_data_exists = False
+        if 'Sweep Number' not in df.columns:
+            return {1: self.get_zdata(df)}
+        sweep_numbers, slices = zip(*df.groupby('Sweep Number', sort=True))
+        if len(slices) == 1:
+            return {sweep_numbers[0]: self.get_zdata(df)}
+        if temperature_data_exists:
+            temperatures = [df_slice[temperature_label].iat[-1]
+                            for df_slice in slices]
+            if len(set(temperatures)) == len(temperatures):
+                keys = temperatures
+            else:
+                print('WARNING: repeated set-point temperatures in ' +
+                      self.filename + '. Keying the spectra by '
+                      '(temperature, sweep number)...')
+                keys = list(zip(temperatures, sweep_numbers))
+        else:
+            keys = sweep_numbers
+        return {index: self.get_zdata(df_slice)
+                for index, df_slice in zip(keys, slices)}
+
+    def get_zdata_collection(self) -> ZDataCollection:
+        """
+        Returns the spectra in the file as a ZDataCollection, one per sweep,
+        with the set-point temperature, sweep number, sample (the file name
+        without extension), source file and DC level of each one in the
+        metadata, when available.
+        """
+        temperature_labels = ["Set Point ('C)", "Set Point (K)",
+                              "Set Temperature"]
+        df = self.to_dataframe()
+        if 'Sweep Number' in df.columns:
+            sweeps, groups = zip(*df.groupby('Sweep Number', sort=True))
+            sweeps, groups = list(sweeps), list(groups)
+        else:
+            sweeps, groups = [1], [df]
+        metadata = {'sweep': sweeps,
+                    'sample':
+                        [self.without_extension(self.filename)]*len(groups),
+                    'source': [self.filename]*len(groups)}
+        for label in temperature_labels:
+            if (label in df.columns
+                    and df[label].dtypes in ('int64', 'float64')):
+                metadata['temperature'] = [group[label].iat[-1]
+                                           for group in groups]
+        if 'DC Level (V)' in df.columns:
+            metadata['dc_level'] = [group['DC Level (V)'].iat[-1]
+                                    for group in groups]
+        return ZDataCollection([self.get_zdata(group) for group in groups],
+                               metadata)
+
     def to_zview(
         self, 
         minus_imag: bool = False,
@@ -150,33 +225,12 @@ class SmartFileReader:
             else:
                 extension = 'txt'
         filename_wo_extension = self.without_extension(filename)
-        temperature_labels = ["Set Point ('C)", "Set Point (K)", "Set Temperature"]
-        temperature_label = None
-        df = self.to_dataframe()
-        for label in temperature_labels:
-            if label in df.columns:
-                temperature_label = label
-        if df[temperature_label].dtypes in ('int64', 'float64'):
-            temperature_data_exists = True
-        else:
-            temperature_data_exists = False
-        if 'Sweep Number' in df.columns:
-            sweeps = df['Sweep Number'].iat[-1]
-        else:
-            sweeps = 1
-        if sweeps > 1:
-            for sweep in range(1,sweeps+1):
-                df_slice = df.loc[(df['Sweep Number'] == sweep)]
-                zdata = self.get_zdata(df_slice)
-                if temperature_data_exists:
-                    temperature = df_slice[temperature_label].iat[-1]
-                    index = temperature
-                else:
-                    sweep = df_slice['Sweep Number'].iat[-1] 
-                    index = sweep
+        series = self.get_zdata_series()
+        if len(series) > 1:
+            for index, zdata in series.items():
                 output_filename = f'{filename_wo_extension}_[{index}].{extension}'
                 zdata.to_zview(output_filename, minus_imag)
         else:
-            zdata = self.get_zdata(df)
+            zdata = list(series.values())[0]
             output_filename = f'{filename_wo_extension}.{extension}'
             zdata.to_zview(output_filename, minus_imag)
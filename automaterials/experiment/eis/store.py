@@ -0,0 +1,433 @@
+# coding: utf-8
+
+"""
+This module provides an experiment store on SQLite: samples, measurements,
+spectrum points and fit results in one normalized, indexed database, with
+bulk inserts and queries that return ZDataCollection objects.
+"""
+
+import sqlite3
+import numpy as np
+import pandas as pd
+from itertools import repeat
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple, Union
+
+from automaterials.experiment.eis.properties import (FrequencyGrid, ZData,
+                                                     ZDataCollection)
+from automaterials.experiment.eis.smart import SmartFileReader
+
+if TYPE_CHECKING:
+    from automaterials.experiment.eis.fitting import FitResult
+
+__author__ = "Rodolpho Mouta"
+__maintainer__ = "Rodolpho Mouta"
+__email__ = "mouta.rodolpho@gmail.com"
+
+"""
+Schema
+"""
+SCHEMA_VERSION = 1
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    sample_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS measurements (
+    measurement_id INTEGER PRIMARY KEY,
+    sample_id INTEGER REFERENCES samples(sample_id),
+    temperature REAL,
+    sweep INTEGER,
+    dc_level REAL,
+    timestamp REAL,
+    source TEXT,
+    n_points INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS points (
+    measurement_id INTEGER NOT NULL
+        REFERENCES measurements(measurement_id) ON DELETE CASCADE,
+    idx INTEGER NOT NULL,
+    f REAL NOT NULL,
+    z_real REAL NOT NULL,
+    z_imag REAL NOT NULL,
+    PRIMARY KEY (measurement_id, idx)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS fits (
+    fit_id INTEGER PRIMARY KEY,
+    measurement_id INTEGER NOT NULL
+        REFERENCES measurements(measurement_id) ON DELETE CASCADE,
+    circuit TEXT NOT NULL,
+    chi2 REAL,
+    chi2_reduced REAL,
+    nfev INTEGER,
+    success INTEGER
+);
+CREATE TABLE IF NOT EXISTS fit_params (
+    fit_id INTEGER NOT NULL REFERENCES fits(fit_id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    value REAL,
+    stderr REAL,
+    PRIMARY KEY (fit_id, name)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS measurements_sample
+    ON measurements(sample_id, temperature);
+CREATE INDEX IF NOT EXISTS measurements_temperature
+    ON measurements(temperature);
+CREATE INDEX IF NOT EXISTS measurements_timestamp ON measurements(timestamp);
+CREATE INDEX IF NOT EXISTS fits_measurement ON fits(measurement_id);
+"""
+MEASUREMENT_COLUMNS = ('temperature', 'sweep', 'dc_level', 'timestamp',
+                       'source')
+
+
+def _timestamp(value) -> Optional[float]:
+    """
+    Returns a timestamp (datetime, string or number of seconds since the
+    epoch) as seconds since the epoch, or None if it is missing.
+    """
+    if value is None or (np.ndim(value) == 0 and pd.isna(value)):
+        return None
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return float(value)
+    return pd.Timestamp(value).timestamp()
+
+
+def _scalar(value):
+    """
+    Returns a metadata value as a Python scalar accepted by sqlite3, with
+    NaN as None.
+    """
+    if value is None or (np.ndim(value) == 0 and pd.isna(value)):
+        return None
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _range(
+    column: str,
+    value: Union[None, float, str, Tuple, List]
+) -> Tuple[str, list]:
+    """
+    Returns an SQL condition on column and its parameters: equality for a
+    single value, inclusive bounds for a (low, high) tuple (either may be
+    None), membership for a list.
+    """
+    if isinstance(value, tuple):
+        low, high = value
+        conditions, params = [], []
+        if low is not None:
+            conditions.append(f'{column} >= ?')
+            params.append(low)
+        if high is not None:
+            conditions.append(f'{column} <= ?')
+            params.append(high)
+        return ' AND '.join(conditions), params
+    if isinstance(value, list):
+        return f'{column} IN ({", ".join("?"*len(value))})', list(value)
+    return f'{column} = ?', [value]
+
+
+class ExperimentStore:
+    """
+    A database of impedance measurements on SQLite, with the schema:
+
+    - samples: one row per sample name;
+    - measurements: one row per spectrum, with its sample, temperature,
+      sweep, DC level, timestamp (seconds since the epoch) and source file,
+      indexed by sample and temperature, by temperature and by timestamp;
+    - points: the f, Z_re and Z_im of every point, clustered by measurement
+      so that a spectrum is read from contiguous pages;
+    - fits and fit_params: the circuit, chi2 and parameters (with standard
+      errors) of the fits of each measurement.
+
+    Every add_* call writes in a single transaction, with executemany, and
+    the database runs in WAL mode, so that readers are not blocked by a
+    bulk ingest. Queries select measurements by sample, temperature and
+    timestamp and return a ZDataCollection with their metadata, e.g.
+    store.query(sample='X', temperature=(300, 500)).
+    """
+    def __init__(self, filename: str = ':memory:'):
+        """
+        Opens (or creates) the store in filename, an SQLite database file.
+        """
+        self.filename = filename
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        self.connection.execute('PRAGMA synchronous = NORMAL')
+        with self.connection:
+            self.connection.executescript(SCHEMA)
+            self.connection.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __enter__(self) -> "ExperimentStore":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def _sample_id(self, name: Optional[str]) -> Optional[int]:
+        """
+        Returns the id of sample name, adding it if needed.
+        """
+        if name is None:
+            return None
+        self.connection.execute(
+            'INSERT OR IGNORE INTO samples (name) VALUES (?)', (name,))
+        row = self.connection.execute(
+            'SELECT sample_id FROM samples WHERE name = ?', (name,)).fetchone()
+        return row[0]
+
+    def add(
+        self,
+        data: Union["ZData", "ZDataCollection"],
+        **metadata
+    ) -> List[int]:
+        """
+        Adds a spectrum or a collection, in one transaction, and returns the
+        ids of the new measurements. The sample, temperature, sweep,
+        dc_level, timestamp and source of each spectrum come from the
+        metadata of the collection, or from metadata (e.g. sample='X',
+        temperature=300), which takes precedence.
+        """
+        unknown = set(metadata) - {'sample', *MEASUREMENT_COLUMNS}
+        if unknown:
+            raise ValueError(f'Unknown metadata {sorted(unknown)}; the '
+                             f'measurement columns are '
+                             f'{("sample",) + MEASUREMENT_COLUMNS}.')
+        if isinstance(data, ZData):
+            data = ZDataCollection.from_array(data.f, data.z, copy=False)
+        table = data.metadata.copy()
+        for column, value in metadata.items():
+            table[column] = [value]*len(data)
+        for column in ('sample',) + MEASUREMENT_COLUMNS:
+            if column not in table.columns:
+                table[column] = None
+        with self.connection:
+            samples = {name: self._sample_id(name) for name in
+                       {_scalar(name) for name in table['sample']}}
+            ids = []
+            rows = table[['sample', *MEASUREMENT_COLUMNS]]
+            for row, n_points in zip(rows.itertuples(index=False),
+                                     data.lengths.tolist()):
+                cursor = self.connection.execute(
+                    'INSERT INTO measurements (sample_id, temperature, sweep, '
+                    'dc_level, timestamp, source, n_points) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (samples[_scalar(row.sample)], _scalar(row.temperature),
+                     _scalar(row.sweep), _scalar(row.dc_level),
+                     _timestamp(row.timestamp), _scalar(row.source),
+                     n_points))
+                ids.append(cursor.lastrowid)
+            spectrum = data.spectrum_index.ravel()
+            z = data.z.ravel()
+            idx = np.arange(spectrum.size) - data.offsets[spectrum]
+            self.connection.executemany(
+                'INSERT INTO points (measurement_id, idx, f, z_real, z_imag) '
+                'VALUES (?, ?, ?, ?, ?)',
+                zip(np.asarray(ids, dtype=np.int64)[spectrum].tolist(),
+                    idx.tolist(),
+                    data._point_frequencies().ravel().tolist(),
+                    z.real.tolist(), z.imag.tolist()))
+        return ids
+
+    def add_file(self, filename: str, **metadata) -> List[int]:
+        """
+        Adds all spectra of a Smart output file (see
+        SmartFileReader.get_zdata_collection) in one transaction, and
+        returns the ids of the new measurements. metadata is as in add().
+        """
+        collection = SmartFileReader(filename).get_zdata_collection()
+        return self.add(collection, **metadata)
+
+    def add_fits(self, results: Dict[int, "FitResult"]) -> List[int]:
+        """
+        Adds fit results, keyed by the id of the measurement fitted, in one
+        transaction, and returns the ids of the new fits.
+        """
+        ids = []
+        params = []
+        with self.connection:
+            for measurement_id, result in results.items():
+                cursor = self.connection.execute(
+                    'INSERT INTO fits (measurement_id, circuit, chi2, '
+                    'chi2_reduced, nfev, success) VALUES (?, ?, ?, ?, ?, ?)',
+                    (int(measurement_id), result.circuit.topology,
+                     float(result.chi2), float(result.chi2_reduced),
+                     int(result.nfev), int(bool(result.success))))
+                ids.append(cursor.lastrowid)
+                names = result.param_names
+                params.extend(zip(
+                    repeat(cursor.lastrowid), names, range(len(names)),
+                    np.asarray(result.params, dtype=float).tolist(),
+                    [float(result.stderr[name]) for name in names]))
+            self.connection.executemany(
+                'INSERT INTO fit_params (fit_id, name, position, value, '
+                'stderr) VALUES (?, ?, ?, ?, ?)',
+                params)
+        return ids
+
+    def add_fit(self, measurement_id: int, result: "FitResult") -> int:
+        """
+        Adds the result of a fit of measurement measurement_id and returns
+        the id of the new fit.
+        """
+        return self.add_fits({measurement_id: result})[0]
+
+    def _where(
+        self,
+        sample: Optional[Union[str, List[str]]],
+        temperature: Optional[Union[float, Tuple, List]],
+        timestamp: Optional[Union[float, str, Tuple, List]],
+        sweep: Optional[Union[int, Tuple, List]]
+    ) -> Tuple[str, list]:
+        """
+        Returns the WHERE clause (possibly empty) on the joined measurements
+        m and samples s, and its parameters.
+        """
+        if isinstance(timestamp, tuple):
+            timestamp = tuple(_timestamp(value) for value in timestamp)
+        elif isinstance(timestamp, list):
+            timestamp = [_timestamp(value) for value in timestamp]
+        elif timestamp is not None:
+            timestamp = _timestamp(timestamp)
+        conditions, params = [], []
+        for column, value in (('s.name', sample),
+                              ('m.temperature', temperature),
+                              ('m.timestamp', timestamp),
+                              ('m.sweep', sweep)):
+            if value is None:
+                continue
+            condition, values = _range(column, value)
+            if condition:
+                conditions.append(condition)
+                params.extend(values)
+        if not conditions:
+            return '', params
+        return ' WHERE ' + ' AND '.join(conditions), params
+
+    @staticmethod
+    def _typed(table: pd.DataFrame) -> pd.DataFrame:
+        """
+        Returns table with numeric metadata as floats (missing values as NaN,
+        as in ZDataCollection) and timestamps as datetimes.
+        """
+        for column in ('temperature', 'sweep', 'dc_level'):
+            table[column] = table[column].astype(float)
+        table['timestamp'] = pd.to_datetime(table['timestamp'], unit='s')
+        return table
+
+    def measurements(
+        self,
+        sample: Optional[Union[str, List[str]]] = None,
+        temperature: Optional[Union[float, Tuple, List]] = None,
+        timestamp: Optional[Union[float, str, Tuple, List]] = None,
+        sweep: Optional[Union[int, Tuple, List]] = None
+    ) -> pd.DataFrame:
+        """
+        Returns a pandas DataFrame, indexed by measurement_id, with the
+        metadata of the selected measurements, sorted by sample, temperature
+        and timestamp. Each selector is a value, a list of values or an
+        inclusive (low, high) range whose ends may be None, e.g.
+        temperature=(300, 500) or timestamp=('2024-01-01', None).
+        """
+        where, params = self._where(sample, temperature, timestamp, sweep)
+        query = ('SELECT m.measurement_id, s.name AS sample, m.temperature, '
+                 'm.sweep, m.dc_level, m.timestamp, m.source, m.n_points '
+                 'FROM measurements m LEFT JOIN samples s USING (sample_id)' +
+                 where + ' ORDER BY s.name, m.temperature, m.timestamp, '
+                 'm.measurement_id')
+        table = pd.read_sql_query(query, self.connection, params=params,
+                                  index_col='measurement_id')
+        return self._typed(table)
+
+    def query(
+        self,
+        sample: Optional[Union[str, List[str]]] = None,
+        temperature: Optional[Union[float, Tuple, List]] = None,
+        timestamp: Optional[Union[float, str, Tuple, List]] = None,
+        sweep: Optional[Union[int, Tuple, List]] = None
+    ) -> "ZDataCollection":
+        """
+        Returns the spectra of the measurements selected as in
+        measurements(), in its order, as a ZDataCollection whose metadata
+        has their measurement_id, sample, temperature, sweep, dc_level,
+        timestamp and source. All points are read with one query.
+        """
+        table = self.measurements(sample, temperature, timestamp, sweep)
+        ids = table.index.to_numpy()
+        self.connection.execute(
+            'CREATE TEMP TABLE IF NOT EXISTS selected '
+            '(position INTEGER PRIMARY KEY, measurement_id INTEGER)')
+        with self.connection:
+            self.connection.execute('DELETE FROM selected')
+            self.connection.executemany('INSERT INTO selected VALUES (?, ?)',
+                                        enumerate(ids.tolist()))
+            rows = self.connection.execute(
+                'SELECT p.f, p.z_real, p.z_imag FROM selected JOIN points p '
+                'USING (measurement_id) ORDER BY selected.position, p.idx'
+            ).fetchall()
+        values = np.array(rows, dtype=float).reshape(-1, 3)
+        f = values[:, 0].copy()
+        z = np.empty(len(values), dtype=complex)
+        z.real, z.imag = values[:, 1], values[:, 2]
+        lengths = table['n_points'].to_numpy(dtype=int)
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(int)
+        metadata = table.drop(columns='n_points').reset_index()
+        metadata = metadata[['measurement_id', 'sample', 'temperature',
+                             'sweep', 'dc_level', 'timestamp', 'source']]
+        if len(lengths) and (lengths == lengths[0]).all():
+            n_f = lengths[0]
+            grid = f[:n_f]
+            if (f.reshape(-1, n_f) == grid).all():
+                return ZDataCollection.from_array(grid, z.reshape(-1, n_f),
+                                                  metadata, copy=False)
+        return ZDataCollection._from_parts(FrequencyGrid(f), z, offsets,
+                                           metadata)
+
+    def fits(
+        self,
+        sample: Optional[Union[str, List[str]]] = None,
+        temperature: Optional[Union[float, Tuple, List]] = None,
+        timestamp: Optional[Union[float, str, Tuple, List]] = None,
+        sweep: Optional[Union[int, Tuple, List]] = None,
+        circuit: Optional[str] = None
+    ) -> pd.DataFrame:
+        """
+        Returns a pandas DataFrame, indexed by fit_id, with one row per fit
+        of the measurements selected as in measurements() (and of circuit,
+        a CDC string in canonical form, if given): the measurement metadata,
+        the fit figures and, as in fit_series, one column per parameter
+        value and one <name>_stderr per standard error.
+        """
+        where, params = self._where(sample, temperature, timestamp, sweep)
+        if circuit is not None:
+            where += (' AND ' if where else ' WHERE ') + 'fits.circuit = ?'
+            params.append(circuit)
+        joins = ('FROM fits JOIN measurements m USING (measurement_id) '
+                 'LEFT JOIN samples s USING (sample_id)' + where)
+        query = ('SELECT fits.fit_id, fits.measurement_id, s.name AS sample, '
+                 'm.temperature, m.sweep, m.dc_level, m.timestamp, '
+                 'fits.circuit, fits.chi2, fits.chi2_reduced, fits.nfev, '
+                 'fits.success ' + joins +
+                 ' ORDER BY s.name, m.temperature, m.timestamp, fits.fit_id')
+        table = self._typed(pd.read_sql_query(
+            query, self.connection, params=params, index_col='fit_id'))
+        table['success'] = table['success'].astype(bool)
+        if table.empty:
+            return table
+        values = pd.read_sql_query(
+            'SELECT fp.fit_id, fp.name, fp.value, fp.stderr '
+            'FROM fit_params fp JOIN fits USING (fit_id) '
+            'JOIN measurements m USING (measurement_id) '
+            'LEFT JOIN samples s USING (sample_id)' + where +
+            ' ORDER BY fp.fit_id, fp.position',
+            self.connection, params=params)
+        wide = values.pivot(index='fit_id', columns='name',
+                            values=['value', 'stderr'])
+        names = list(dict.fromkeys(values['name']))
+        columns = {name: wide[('value', name)] for name in names}
+        columns.update({f'{name}_stderr': wide[('stderr', name)]
+                        for name in names})
+        return table.join(pd.DataFrame(columns))
@@ -0,0 +1,181 @@
+# coding: utf-8
+
+"""
+This module provides parameter sweeps of circuits and the normalized
+sensitivities of the impedance to every parameter, used to design
+experiments and to check which parameters a spectrum can identify.
+"""
+
+import numpy as np
+import pandas as pd
+from typing import TYPE_CHECKING, Dict, List, Union
+
+from automaterials.experiment.eis.properties import (
+    as_frequency_grid, F_DEFAULT)
+
+if TYPE_CHECKING:
+    from automaterials.experiment.eis.circuits import (
+        Circuit, ElectricalElement)
+
+__author__ = "Rodolpho Mouta"
+__maintainer__ = "Rodolpho Mouta"
+__email__ = "mouta.rodolpho@gmail.com"
+
+
+class SweepResult:
+    """
+    Stores the impedance of a circuit over a grid of values of one or two of
+    its parameters, with shape (*grid_shape, len(f)), and the normalized
+    sensitivities of log|Z| and of the phase to all the parameters,
+    d log|Z|/d log(theta) and d phase/d log(theta), with shape (*grid_shape,
+    n_params, len(f)). A sensitivity of s means that a 1% change in theta
+    changes |Z| by about s% (or the phase by s/100 rad).
+    """
+    def __init__(
+        self,
+        f: np.ndarray,
+        swept: List[str],
+        values: List[np.ndarray],
+        param_names: List[str],
+        params: np.ndarray,
+        z: np.ndarray,
+        jacobian: np.ndarray
+    ):
+        """
+        Pending
+        """
+        self.f = f
+        self.swept = swept
+        self.values = values
+        self.param_names = list(param_names)
+        shape = tuple(len(value) for value in values)
+        self.params = params.reshape(*shape, len(self.param_names))
+        self.z = z.reshape(*shape, f.size)
+        # d log(Z)/d log(theta) = theta*(dZ/dtheta)/Z, whose real part is the
+        # sensitivity of log|Z| and imaginary part that of the phase
+        relative = jacobian*params[:, :, None]/z[:, None, :]
+        relative = relative.reshape(*shape, len(self.param_names), f.size)
+        self.sensitivities = relative.real
+        self.phase_sensitivities = relative.imag
+
+    def collinearity(self) -> np.ndarray:
+        """
+        Returns, at each point of the sweep grid, the collinearity index of
+        all parameters (Brun et al., Water Res. 35 (2001) 2849),
+        1/sqrt(smallest eigenvalue of S.T @ S) for the sensitivities S of
+        log|Z| and phase with columns scaled to unit norm. Values above
+        about 10-20 flag parameters that the spectrum cannot tell apart.
+        """
+        stacked = np.concatenate(
+            [self.sensitivities, self.phase_sensitivities], axis=-1)
+        norms = np.linalg.norm(stacked, axis=-1, keepdims=True)
+        unit = np.divide(stacked, norms, out=np.zeros_like(stacked),
+                         where=norms > 0)
+        gram = unit @ np.swapaxes(unit, -1, -2)
+        smallest = np.linalg.eigvalsh(gram)[..., 0]
+        with np.errstate(divide='ignore'):
+            return 1/np.sqrt(np.clip(smallest, 0, None))
+
+    def identifiability(self) -> pd.DataFrame:
+        """
+        Returns a pandas DataFrame indexed by parameter with, over the whole
+        sweep, the root-mean-square and largest absolute sensitivities of
+        log|Z|, the frequency where the largest one occurs, and the largest
+        absolute correlation between the sensitivities of the parameter and
+        those of any other one. Parameters with small sensitivities or
+        correlations close to 1 are poorly identifiable.
+        """
+        n_params = len(self.param_names)
+        sensitivities = np.moveaxis(self.sensitivities, -2, 0)
+        sensitivities = sensitivities.reshape(n_params, -1, self.f.size)
+        absolute = np.abs(sensitivities)
+        flat = absolute.reshape(n_params, -1)
+        stacked = np.concatenate(
+            [self.sensitivities, self.phase_sensitivities], axis=-1)
+        stacked = np.moveaxis(stacked, -2, 0).reshape(n_params, -1)
+        norms = np.linalg.norm(stacked, axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            correlation = np.abs(stacked @ stacked.T)/np.outer(norms, norms)
+        np.fill_diagonal(correlation, 0)
+        correlation = np.nan_to_num(correlation)
+        report = pd.DataFrame({
+            'rms_sensitivity': np.sqrt(np.mean(flat**2, axis=1)),
+            'max_sensitivity': flat.max(axis=1),
+            'f_at_max': self.f[np.argmax(absolute.max(axis=1), axis=1)],
+            'max_correlation': (correlation.max(axis=1) if n_params > 1
+                                else np.zeros(n_params)),
+            'correlated_with': [self.param_names[idx] if n_params > 1 else None
+                                for idx in correlation.argmax(axis=1)]},
+                              index=pd.Index(self.param_names, name='param'))
+        return report
+
+    def as_dataframe(self) -> pd.DataFrame:
+        """
+        Returns a pandas DataFrame with one row per swept value(s) and
+        frequency, with columns for the swept parameters, f, Z_re and Z_im.
+        """
+        grids = np.meshgrid(*self.values, self.f, indexing='ij')
+        columns = {name: grid.ravel() for name, grid in zip(self.swept, grids)}
+        columns.update({'f': grids[-1].ravel(),
+                        'Z_re': self.z.real.ravel(),
+                        'Z_im': self.z.imag.ravel()})
+        return pd.DataFrame(columns)
+
+
+def _sweep(
+    circuit: Union["ElectricalElement", "Circuit"],
+    swept: Dict[str, np.ndarray],
+    f: Union[float, int, List[Union[int, float]], np.ndarray]
+) -> SweepResult:
+    """
+    Evaluates circuit, with its other parameters at their current values,
+    over the grid of values of the parameters in swept, all in one batched
+    pass of the compiled plan that also gives the derivatives.
+    """
+    plan = circuit.compile()
+    values = [np.atleast_1d(np.asarray(value, dtype=float))
+              for value in swept.values()]
+    for name in swept:
+        if name not in plan.param_index:
+            raise ValueError(f'Unknown parameter {name!r}; the parameters are '
+                             f'{plan.param_names}.')
+    grids = np.meshgrid(*values, indexing='ij')
+    params = np.tile(plan.get_params(), (grids[0].size, 1))
+    for name, column in zip(swept, grids):
+        params[:, plan.param_index[name]] = column.ravel()
+    grid = as_frequency_grid(np.atleast_1d(f))
+    z, jacobian = plan.z_and_jacobian(grid, params)
+    return SweepResult(np.asarray(grid, dtype=float), list(swept), values,
+                       plan.param_names, params, z, jacobian)
+
+
+def sweep(
+    circuit: Union["ElectricalElement", "Circuit"],
+    param_name: str,
+    values: np.ndarray,
+    f: Union[float, int, List[Union[int, float]], np.ndarray] = F_DEFAULT
+) -> SweepResult:
+    """
+    Returns the impedance of circuit at frequencies f for each value of the
+    parameter param_name (as in circuit.param_names), with the others fixed
+    at their current values, and the sensitivities to all parameters.
+    """
+    return _sweep(circuit, {param_name: values}, f)
+
+
+def sweep2d(
+    circuit: Union["ElectricalElement", "Circuit"],
+    param_x: str,
+    values_x: np.ndarray,
+    param_y: str,
+    values_y: np.ndarray,
+    f: Union[float, int, List[Union[int, float]], np.ndarray] = F_DEFAULT
+) -> SweepResult:
+    """
+    As sweep, over the grid of values_x of param_x by values_y of param_y.
+    The impedance has shape (len(values_x), len(values_y), len(f)).
+    """
+    if param_x == param_y:
+        raise ValueError(
+            f'param_x and param_y must differ, not both {param_x!r}.')
+    return _sweep(circuit, {param_x: values_x, param_y: values_y}, f)
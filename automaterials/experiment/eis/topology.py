@@ -0,0 +1,305 @@
+# coding: utf-8
+
+"""
+This module provides a search over equivalent-circuit topologies: candidate
+circuits are grown one element at a time from the basic elements,
+deduplicated by canonical form, fitted to a spectrum in a process pool and
+ranked by information criteria.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple, Union
+
+from automaterials.experiment.eis.circuits import Circuit, ElectricalElement
+from automaterials.experiment.eis.fitting import fit
+from automaterials.experiment.eis.guess import initial_guess
+from automaterials.experiment.eis.parser import parse_circuit
+from automaterials.experiment.eis.properties import ZData
+
+__author__ = "Rodolpho Mouta"
+__maintainer__ = "Rodolpho Mouta"
+__email__ = "mouta.rodolpho@gmail.com"
+
+"""
+Constants
+"""
+SUPPORTED_CRITERIA = ('aic', 'bic')
+DEFAULT_SYMBOLS = ('R', 'C', 'Q', 'L')
+
+
+def _tree(piece: Union["ElectricalElement", "Circuit"]) -> Union[str, tuple]:
+    """
+    Returns the structure of piece as nested tuples (association symbol,
+    [subtrees]), with element symbols at the leaves.
+    """
+    if getattr(piece, 'pieces', None) is None:
+        return piece.symbol
+    piece = piece.expanded()
+    return (piece.association_symbol,
+            [_tree(subpiece) for subpiece in piece.pieces])
+
+
+def _cdc(tree: Union[str, tuple]) -> str:
+    """
+    Returns the CDC string of a tree built by _tree.
+    """
+    if isinstance(tree, str):
+        return tree
+    symbol, subtrees = tree
+    return symbol.join(subtree if isinstance(subtree, str)
+                       else f'({_cdc(subtree)})'
+                       for subtree in subtrees)
+
+
+def _grow(tree: Union[str, tuple], symbol: str) -> List[Union[str, tuple]]:
+    """
+    Returns every tree obtained by putting a new element in series or in
+    parallel with one node of tree (the whole tree, a subcircuit or an
+    element).
+    """
+    grown = [('-', [tree, symbol]), ('//', [tree, symbol])]
+    if not isinstance(tree, str):
+        association, subtrees = tree
+        for idx, subtree in enumerate(subtrees):
+            for new in _grow(subtree, symbol):
+                grown.append((association,
+                              subtrees[:idx] + [new] + subtrees[idx + 1:]))
+    return grown
+
+
+def _is_irreducible(circuit: Union["ElectricalElement", "Circuit"]) -> bool:
+    """
+    Returns False for circuits equivalent to one with fewer elements, such
+    as R-R or C//C.
+    """
+    if getattr(circuit, 'pieces', None) is None:
+        return True
+    return not circuit.simplify().reduces
+
+
+def _children(
+    cdc: str,
+    symbols: Tuple[str, ...],
+    seen: set
+) -> Dict[str, str]:
+    """
+    Returns {topology: cdc} for the irreducible circuits one element larger
+    than cdc whose topology is not in seen, which is updated. Each cdc is
+    the circuit as grown from cdc, and its topology the canonical form.
+    """
+    tree = _tree(parse_circuit(cdc))
+    children = {}
+    for symbol in symbols:
+        for new in _grow(tree, symbol):
+            grown = _cdc(new)
+            circuit = parse_circuit(grown)
+            topology = circuit.topology
+            if topology in seen:
+                continue
+            seen.add(topology)
+            if _is_irreducible(circuit):
+                children[topology] = grown
+    return children
+
+
+def enumerate_topologies(
+    max_elements: int,
+    symbols: Tuple[str, ...] = DEFAULT_SYMBOLS
+) -> List[str]:
+    """
+    Returns the CDC strings, in canonical form, of all distinct irreducible
+    circuits with up to max_elements elements built from symbols (e.g. 'R',
+    'C', 'Q', 'L') by series and parallel associations, from the smallest.
+    """
+    seen = set(symbols)
+    level = list(symbols)
+    topologies = list(symbols)
+    for _ in range(1, max_elements):
+        children = {}
+        for cdc in level:
+            children.update(_children(cdc, symbols, seen))
+        level = list(children)
+        topologies.extend(level)
+    return topologies
+
+
+def _information_criteria(
+    chi2: float, n_points: int, n_params: int
+) -> Tuple[float, float]:
+    """
+    Returns AIC and BIC for a weighted least-squares fit with sum of squared
+    residuals chi2 over n_points (real and imaginary parts counted apart).
+    """
+    fit_term = n_points*np.log(max(chi2, np.finfo(float).tiny)/n_points)
+    return fit_term + 2*n_params, fit_term + n_params*np.log(n_points)
+
+
+def _fit_candidates(
+    candidates: List[Tuple[str, Optional[np.ndarray]]],
+    zdata: ZData,
+    weighting: Union[str, np.ndarray],
+    max_nfev: Optional[int]
+) -> List[dict]:
+    """
+    Fits each (cdc, params) candidate to zdata, starting from params when
+    given or from initial_guess otherwise, and returns one row per candidate.
+    """
+    rows = []
+    n_points = 2*np.size(zdata.f)
+    for cdc, params in candidates:
+        circuit = parse_circuit(cdc)
+        row = {'topology': cdc, 'n_params': len(circuit.compile().param_names)}
+        if params is not None and len(params) == row['n_params']:
+            circuit.compile().set_params(params)
+        else:
+            initial_guess(circuit, zdata, inplace=True)
+        try:
+            # most candidates do not describe the data, and their fits may
+            # wander through overflowing parameters
+            with np.errstate(all='ignore'):
+                result = fit(circuit, zdata, weighting, max_nfev=max_nfev)
+        except (ArithmeticError, ValueError, np.linalg.LinAlgError):
+            result = None
+        if result is None or not np.isfinite(result.params).all():
+            row.update(chi2=np.inf, aic=np.inf, bic=np.inf, nfev=0,
+                       success=False, params=None)
+        else:
+            aic, bic = _information_criteria(result.chi2, n_points,
+                                             result.n_free)
+            row.update(chi2=result.chi2, aic=aic, bic=bic, nfev=result.nfev,
+                       success=bool(result.success), params=result.params)
+        rows.append(row)
+    return rows
+
+
+class TopologySearch:
+    """
+    A search for the equivalent circuit that best describes a spectrum.
+    Starting from the single elements in symbols, each level fits all new
+    circuits one element larger than the survivors of the previous level,
+    in a process pool. Only the beam best candidates of a level (by
+    criterion) whose chi2 is lower than that of the circuit they grew from
+    survive, so dominated branches are not grown further. Circuits with the
+    same canonical form, or reducible to a smaller one, are fitted only once.
+
+    The search keeps, per topology, the parameters of its last fit, and
+    later fits of that topology start from them. This makes repeated
+    searches over a temperature series, whose neighbouring spectra are
+    similar, much cheaper; fits to the same spectrum are not repeated.
+    """
+    def __init__(
+        self,
+        max_elements: int = 6,
+        symbols: Tuple[str, ...] = DEFAULT_SYMBOLS,
+        criterion: str = 'aic',
+        beam: int = 8,
+        weighting: Union[str, np.ndarray] = 'modulus',
+        max_nfev: Optional[int] = None,
+        processes: Optional[int] = None
+    ):
+        """
+        Pending
+        """
+        if criterion not in SUPPORTED_CRITERIA:
+            print('WARNING: criterion '+criterion +
+                  ' not supported. Switching to aic...')
+            criterion = 'aic'
+        self.max_elements = max_elements
+        self.symbols = tuple(symbols)
+        self.criterion = criterion
+        self.beam = beam
+        self.weighting = weighting
+        self.max_nfev = max_nfev
+        self.processes = processes
+        self.cache = {}
+        self._results = {}
+
+    def _fit_level(self, cdcs: List[str], zdata: ZData) -> List[dict]:
+        """
+        Fits the circuits in cdcs to zdata, in a process pool if more than
+        one process is available, reusing earlier results for the same data.
+        """
+        key = (np.asarray(zdata.f, dtype=float).tobytes(),
+               np.asarray(zdata.z, dtype=complex).tobytes())
+        pending = [cdc for cdc in cdcs if (key, cdc) not in self._results]
+        candidates = [(cdc, self.cache.get(cdc)) for cdc in pending]
+        processes = self.processes or os.cpu_count() or 1
+        processes = max(1, min(processes, len(candidates)))
+        args = (zdata, self.weighting, self.max_nfev)
+        if processes == 1:
+            rows = _fit_candidates(candidates, *args)
+        else:
+            indices = np.array_split(np.arange(len(candidates)), processes)
+            chunks = [[candidates[idx] for idx in chunk] for chunk in indices]
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                futures = [executor.submit(_fit_candidates, chunk, *args)
+                           for chunk in chunks]
+                rows = [row for future in futures for row in future.result()]
+        for row in rows:
+            self._results[(key, row['topology'])] = row
+            if row['params'] is not None:
+                self.cache[row['topology']] = row['params']
+        return [self._results[(key, cdc)] for cdc in cdcs]
+
+    def run(self, zdata: ZData) -> pd.DataFrame:
+        """
+        Searches the topologies for zdata and returns a table of the fitted
+        candidates (topology, number of parameters, chi2, AIC, BIC, nfev,
+        success and parameters), ranked by the criterion.
+        """
+        seen = set(self.symbols)
+        level = {symbol: None for symbol in self.symbols}
+        parents_chi2 = dict.fromkeys(self.symbols, np.inf)
+        rows = []
+        for size in range(1, self.max_elements + 1):
+            if not level:
+                break
+            level_rows = self._fit_level(list(level), zdata)
+            for row in level_rows:
+                row['n_elements'] = size
+            rows.extend(level_rows)
+            improving = [row for row in level_rows
+                         if np.isfinite(row[self.criterion]) and
+                         row['chi2'] < parents_chi2[row['topology']]]
+            survivors = sorted(improving,
+                               key=lambda row: row[self.criterion])[:self.beam]
+            level = {}
+            parents_chi2 = {}
+            if size == self.max_elements:
+                break
+            for row in survivors:
+                for topology in _children(row['topology'], self.symbols, seen):
+                    level[topology] = row['topology']
+                    parents_chi2[topology] = row['chi2']
+        table = pd.DataFrame(rows).sort_values(self.criterion)
+        table = table.reset_index(drop=True)
+        return table[['topology', 'n_elements', 'n_params', 'chi2', 'aic',
+                      'bic', 'nfev', 'success', 'params']]
+
+    def run_series(
+        self, series: Dict[float, ZData]
+    ) -> Dict[float, pd.DataFrame]:
+        """
+        Runs the search on every spectrum of series (e.g. {temperature:
+        ZData}), in order of key, and returns the tables with the same keys.
+        Each spectrum warm-starts the fits of the topologies already fitted.
+        """
+        return {key: self.run(series[key]) for key in sorted(series)}
+
+
+def search_topologies(
+    zdata: ZData,
+    max_elements: int = 6,
+    symbols: Tuple[str, ...] = DEFAULT_SYMBOLS,
+    criterion: str = 'aic',
+    beam: int = 8,
+    processes: Optional[int] = None
+) -> pd.DataFrame:
+    """
+    Returns the ranked table of TopologySearch(...).run(zdata).
+    """
+    return TopologySearch(max_elements, symbols, criterion, beam,
+                          processes=processes).run(zdata)
@@ -0,0 +1,226 @@
+# coding: utf-8
+
+"""
+This module provides bootstrap and Monte Carlo estimates of the uncertainty
+of fitted circuit parameters and of quantities derived from them, such as
+the pseudo-capacitance and relaxation frequency of RQ circuits.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple, Union
+
+from automaterials.experiment.eis.circuits import (
+    RQ, Circuit, ElectricalElement, rc_pieces)
+from automaterials.experiment.eis.fitting import FitResult, fit
+from automaterials.experiment.eis.properties import ZData, as_frequency_grid
+from automaterials.utils.constants import PI
+
+__author__ = "Rodolpho Mouta"
+__maintainer__ = "Rodolpho Mouta"
+__email__ = "mouta.rodolpho@gmail.com"
+
+"""
+Constants
+"""
+SUPPORTED_METHODS = ('residuals', 'noise')
+PERCENTILES = (2.5, 50.0, 97.5)
+
+
+def derived_quantities(
+    circuit: Union["ElectricalElement", "Circuit"],
+    params: np.ndarray
+) -> Dict[str, np.ndarray]:
+    """
+    Returns the pseudo-capacitance (RQ.C) and the relaxation frequency in Hz
+    (RC.relax_freq) of every RC and RQ circuit inside circuit, for each row
+    of params (N, n_params, ordered as circuit.param_names), keyed as
+    'R1//Q1_C' and 'R1//Q1_relax_freq'. All rows are computed at once.
+    """
+    plan = circuit.compile()
+    params = np.atleast_2d(params)
+    columns = {}
+    for pair in rc_pieces(circuit):
+        start = plan.offsets[id(pair.res)]
+        R = params[:, start]
+        other = pair.cpe if isinstance(pair, RQ) else pair.cap
+        offset = plan.offsets[id(other)]
+        other_label = plan.param_names[offset].rsplit('_', 1)[0]
+        name = f'{plan.param_names[start]}//{other_label}'
+        if isinstance(pair, RQ):
+            T, p = params[:, offset], params[:, offset + 1]
+            with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+                tau = (R*T)**(1/p)
+            columns[f'{name}_C'] = tau/R
+        else:
+            tau = R*params[:, offset]
+        columns[f'{name}_relax_freq'] = 1/(2*PI*tau)
+    return columns
+
+
+def _synthetic_z(
+    z_fit: np.ndarray,
+    relative: np.ndarray,
+    method: str,
+    noise: float,
+    seed: np.random.SeedSequence
+) -> np.ndarray:
+    """
+    Returns one synthetic spectrum: z_fit plus relative residuals resampled
+    with replacement (method = 'residuals') or Gaussian noise with standard
+    deviation noise*|z_fit| in each part (method = 'noise').
+    """
+    rng = np.random.default_rng(seed)
+    modulus = np.abs(z_fit)
+    if method == 'residuals':
+        picks = rng.integers(0, relative.size, relative.size)
+        return z_fit + modulus*relative[picks]
+    return z_fit + modulus*noise*(rng.standard_normal(z_fit.size) +
+                                  1j*rng.standard_normal(z_fit.size))
+
+
+def _refit_chunk(
+    circuit: Union["ElectricalElement", "Circuit"],
+    f: np.ndarray,
+    z_fit: np.ndarray,
+    relative: np.ndarray,
+    method: str,
+    noise: float,
+    seeds: List[np.random.SeedSequence],
+    weighting: Union[str, np.ndarray],
+    bounds: Optional[Dict[str, Tuple[Optional[float], Optional[float]]]],
+    fixed: Optional[List[str]],
+    max_nfev: Optional[int]
+) -> np.ndarray:
+    """
+    Fits circuit, starting from its current parameters, to the synthetic
+    spectrum of each seed, and returns one row of parameters per seed (NaN
+    for failed fits). Each spectrum depends only on its own seed.
+    """
+    grid = as_frequency_grid(f)
+    n_params = len(circuit.compile().param_names)
+    rows = np.full((len(seeds), n_params), np.nan)
+    for idx, seed in enumerate(seeds):
+        zdata = ZData(grid, _synthetic_z(z_fit, relative, method, noise, seed))
+        try:
+            result = fit(circuit, zdata, weighting, bounds, fixed, max_nfev)
+        except (ArithmeticError, ValueError, np.linalg.LinAlgError):
+            continue
+        if result.success:
+            rows[idx] = result.params
+    return rows
+
+
+class UncertaintyResult:
+    """
+    Stores the parameter sets refitted to resampled or noisy synthetic data
+    (one row per sample, NaN rows for failed fits) and the derived
+    quantities computed from them, with their percentiles.
+    """
+    def __init__(
+        self,
+        param_names: List[str],
+        samples: np.ndarray,
+        derived: Dict[str, np.ndarray],
+        best: Dict[str, float]
+    ):
+        """
+        Pending
+        """
+        self.param_names = list(param_names)
+        self.samples = samples
+        self.derived = derived
+        self.best = best
+        self.success = np.isfinite(samples).all(axis=1)
+        self.n_samples = len(samples)
+        self.n_failed = int(np.sum(~self.success))
+
+    def as_dataframe(self) -> pd.DataFrame:
+        """
+        Returns a pandas DataFrame with one row per successful sample and one
+        column per parameter and derived quantity.
+        """
+        table = pd.DataFrame(self.samples, columns=self.param_names)
+        for name, values in self.derived.items():
+            table[name] = values
+        return table[self.success].reset_index(drop=True)
+
+    def percentiles(self, q: Tuple[float, ...] = PERCENTILES) -> pd.DataFrame:
+        """
+        Returns a pandas DataFrame indexed by parameter and derived quantity,
+        with the best-fit value, the standard deviation of the samples and
+        the requested percentiles (by default, the median and the 95%
+        interval).
+        """
+        table = self.as_dataframe()
+        summary = pd.DataFrame({'value': pd.Series(self.best),
+                                'std': table.std()})
+        for percentile in q:
+            values = np.nanpercentile(table.to_numpy(), percentile, axis=0)
+            summary[f'{percentile:g}%'] = pd.Series(values,
+                                                    index=table.columns)
+        return summary
+
+
+def bootstrap(
+    result: FitResult,
+    zdata: ZData,
+    n_samples: int = 200,
+    method: str = 'residuals',
+    noise: Optional[float] = None,
+    weighting: Union[str, np.ndarray] = 'modulus',
+    bounds: Optional[
+        Dict[str, Tuple[Optional[float], Optional[float]]]] = None,
+    fixed: Optional[List[str]] = None,
+    max_nfev: Optional[int] = None,
+    processes: Optional[int] = None,
+    seed: Optional[int] = None
+) -> UncertaintyResult:
+    """
+    Estimates the uncertainty of result, a fit to zdata, by refitting the
+    circuit to n_samples synthetic spectra built around the fitted one.
+
+    method: 'residuals' resamples the residuals of the fit, relative to the
+    fitted |Z|, with replacement (bootstrap); 'noise' adds Gaussian noise of
+    relative standard deviation noise, by default that of the residuals
+    (Monte Carlo).
+    weighting, bounds, fixed, max_nfev: as in fit, used in every refit.
+    processes: the refits run in a process pool, split into one chunk of
+    samples per process; 1 refits everything in the current process and None
+    uses all available CPUs.
+    seed: each sample draws its spectrum from its own stream, spawned from
+    seed, so the results do not depend on the number of processes.
+    """
+    if method not in SUPPORTED_METHODS:
+        print('WARNING: method '+method +
+              ' not supported. Switching to residuals...')
+        method = 'residuals'
+    circuit = result.circuit
+    f = np.asarray(zdata.f, dtype=float)
+    z_fit = circuit.z(as_frequency_grid(f))
+    relative = (np.asarray(zdata.z, dtype=complex) - z_fit)/np.abs(z_fit)
+    if noise is None:
+        noise = float(np.sqrt(np.mean(relative.real**2 + relative.imag**2)/2))
+    seeds = np.random.SeedSequence(seed).spawn(n_samples)
+    if processes is None:
+        processes = os.cpu_count() or 1
+    processes = max(1, min(processes, n_samples))
+    chunks = [[seeds[idx] for idx in chunk]
+              for chunk in np.array_split(np.arange(n_samples), processes)]
+    args = (weighting, bounds, fixed, max_nfev)
+    if processes == 1:
+        samples = _refit_chunk(circuit, f, z_fit, relative, method, noise,
+                               seeds, *args)
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = [executor.submit(_refit_chunk, circuit, f, z_fit,
+                                       relative, method, noise, chunk, *args)
+                       for chunk in chunks]
+            samples = np.concatenate([future.result() for future in futures])
+    derived = derived_quantities(circuit, samples)
+    best = result.as_dict()
+    best.update({name: float(values[0]) for name, values in
+                 derived_quantities(circuit, result.params).items()})
+    return UncertaintyResult(result.param_names, samples, derived, best)
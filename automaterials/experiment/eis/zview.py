@@ -17,6 +17,8 @@ class ZViewResistor(Resistor):
     A Resistor subclass to represent resistors used in equivalent circuit 
     models in ZView.
     """
+    __slots__ = ('R_isfixed',)
+
     def __init__(self, R: float, label: str, R_isfixed: bool = False):
         """
         Pending
@@ -30,6 +32,8 @@ class ZViewCapacitor(Capacitor):
     A Capacitor subclass to represent capacitors used in equivalent circuit 
     models in ZView.
     """
+    __slots__ = ('C_isfixed',)
+
     def __init__(self,label: str, C: float, C_isfixed: bool = False):
         """
         Pending
@@ -45,6 +49,8 @@ class ZViewCPE(CPE):
     for the existence of both naming conventions in the literature. Which one
     to choose is just a matter of personal preference.
     """
+    __slots__ = ('T_isfixed', 'p_isfixed')
+
     def __init__(
         self,
         label: str,
@@ -65,6 +71,8 @@ class ZViewQ(ZViewCPE):
     A CPE subclass to represent constant phase elements (CPEs) used in 
     equivalent circuit models in ZView.
     """
+    __slots__ = ()
+
     def __init__(
         self,
         label: str,
@@ -87,6 +95,8 @@ class ZViewInductor(Inductor):
     An Inductor subclass to represent inductors used in equivalent circuit 
     models in ZView.
     """
+    __slots__ = ('L_isfixed',)
+
     def __init__(self, L: float, label: str, L_isfixed: bool = False):
         """
         Pending
@@ -207,7 +217,7 @@ class MdlReader:
             C = R_C_T_or_L
             C_label = label
             C_isfixed = R_C_T_or_L_isfixed
-            return ZViewCapacitor(C, C_label, C_isfixed)
+            return ZViewCapacitor(C=C, label=C_label, C_isfixed=C_isfixed)
         elif id_ == '3':
             L = R_C_T_or_L
             L_label = label
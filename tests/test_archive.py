@@ -0,0 +1,97 @@
+# coding: utf-8
+
+"""
+Checks the round trip of spectra through NPZ, Arrow and Parquet archives.
+"""
+
+import numpy as np
+import pytest
+
+from automaterials.experiment.eis.properties import ZData, ZDataCollection
+
+__author__ = "Rodolpho Mouta"
+__maintainer__ = "Rodolpho Mouta"
+__email__ = "mouta.rodolpho@gmail.com"
+
+"""
+Constants
+"""
+F = np.logspace(-2, 6, 25)
+Z = (1 + np.arange(F.size)) - 1j*np.arange(F.size)[::-1]
+METADATA = {'temperature': [300.0, 350.0, 400.0],
+            'sample': ['A', 'B', 'A'],
+            'sweep': [1, 1, 2]}
+
+
+def _uniform() -> ZDataCollection:
+    return ZDataCollection.from_array(F, [Z, 2*Z, 3*Z], METADATA)
+
+
+def _ragged() -> ZDataCollection:
+    spectra = [ZData(F, Z), ZData(F[:10], Z[:10]), ZData(F[5:], 2*Z[5:])]
+    return ZDataCollection(spectra, METADATA)
+
+
+def _assert_same(read: ZDataCollection, written: ZDataCollection) -> None:
+    assert read.is_uniform == written.is_uniform
+    np.testing.assert_array_equal(read.offsets, written.offsets)
+    np.testing.assert_array_equal(read.f, written.f)
+    np.testing.assert_array_equal(read.z, written.z)
+    for column in METADATA:
+        assert read.metadata[column].tolist() == \
+            written.metadata[column].tolist()
+    for spectrum, expected in zip(read, written):
+        np.testing.assert_array_equal(spectrum.z, expected.z)
+
+
+@pytest.mark.parametrize('build', [_uniform, _ragged])
+@pytest.mark.parametrize('compressed, mmap', [(False, True), (False, False),
+                                              (True, True)])
+def test_npz_round_trip(tmp_path, build, compressed, mmap):
+    filename = tmp_path/'spectra.npz'
+    collection = build()
+    collection.to_npz(filename, compressed=compressed)
+    read = ZDataCollection.from_npz(filename, mmap=mmap)
+    _assert_same(read, collection)
+    assert not read.z.flags.writeable
+
+
+def test_npz_is_memory_mapped(tmp_path):
+    filename = tmp_path/'spectra.npz'
+    _uniform().to_npz(filename)
+    read = ZDataCollection.from_npz(filename)
+    base = read.z
+    while base.base is not None and not isinstance(base, np.memmap):
+        base = base.base
+    assert isinstance(base, np.memmap)
+
+
+@pytest.mark.parametrize('build', [_uniform, _ragged])
+def test_npz_select(tmp_path, build):
+    filename = tmp_path/'spectra.npz'
+    collection = build()
+    collection.to_npz(filename)
+    read = ZDataCollection.from_npz(filename, sample='A')
+    _assert_same(read, collection.select(sample='A'))
+
+
+def test_single_spectrum_npz(tmp_path):
+    filename = tmp_path/'spectrum.npz'
+    ZData(F, Z).to_npz(filename)
+    read = ZDataCollection.from_npz(filename)
+    assert len(read) == 1
+    np.testing.assert_array_equal(read[0].f, F)
+    np.testing.assert_array_equal(read[0].z, Z)
+
+
+@pytest.mark.parametrize('fmt', ['arrow', 'parquet'])
+@pytest.mark.parametrize('build', [_uniform, _ragged])
+def test_arrow_and_parquet_round_trip(tmp_path, fmt, build):
+    pytest.importorskip('pyarrow')
+    filename = tmp_path/f'spectra.{fmt}'
+    collection = build()
+    getattr(collection, f'to_{fmt}')(filename)
+    read = getattr(ZDataCollection, f'from_{fmt}')(filename)
+    _assert_same(read, collection)
+    selected = getattr(ZDataCollection, f'from_{fmt}')(filename, sample='A')
+    _assert_same(selected, collection.select(sample='A'))
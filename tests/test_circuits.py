@@ -0,0 +1,217 @@
+# coding: utf-8
+
+"""
+Checks the parameter storage, simplification and impedance caches of the
+circuits.
+"""
+
+import copy
+import pickle
+
+import numpy as np
+import pytest
+
+from automaterials.experiment.eis.parser import parse_circuit
+from automaterials.experiment.eis.properties import FrequencyGrid
+
+__author__ = "Rodolpho Mouta"
+__maintainer__ = "Rodolpho Mouta"
+__email__ = "mouta.rodolpho@gmail.com"
+
+"""
+Constants
+"""
+F = np.logspace(-2, 6, 25)
+
+
+def test_elements_are_views_of_the_parameter_vector():
+    circuit = parse_circuit('R-RQ')
+    plan = circuit.compile()
+    assert circuit.compile() is plan
+    params = plan.get_params()
+    assert not params.flags.writeable
+    for element in plan.elements:
+        assert np.shares_memory(element._values, params)
+    plan.elements[1].R = 5.0
+    assert params[1] == 5.0
+    plan.set_params(np.array([1.0, 2.0, 3e-6, 0.5]))
+    assert plan.elements[1].R == 2.0 and plan.elements[2].p == 0.5
+    np.testing.assert_array_equal(circuit.get_params(), plan.get_params())
+    with pytest.raises(ValueError):
+        params[0] = 0.0
+
+
+def test_copies_have_their_own_parameters():
+    circuit = parse_circuit('R-RQ', {'R2': 2.0})
+    for other in (copy.deepcopy(circuit), pickle.loads(pickle.dumps(circuit))):
+        np.testing.assert_array_equal(other.get_params(), circuit.get_params())
+        other.compile().set_params(np.ones(4))
+        assert circuit.get_params()[1] == 2.0
+        np.testing.assert_allclose(other.z(F), other.compile().z(F),
+                                   rtol=1e-12)
+
+
+def test_shared_elements_follow_the_last_compiled_plan():
+    inner = parse_circuit('RQ')
+    outer = parse_circuit('R') - inner
+    inner_plan, outer_plan = inner.compile(), outer.compile()
+    outer_plan.set_params(np.array([1.0, 7.0, 2e-6, 0.7]))
+    np.testing.assert_array_equal(inner_plan.get_params(), [7.0, 2e-6, 0.7])
+    inner_plan.set_params(np.array([8.0, 2e-6, 0.7]))
+    assert outer_plan.get_params()[1] == 8.0
+
+
+def _reducible():
+    return parse_circuit('R-R-RC-C//C', {'R1': 4.0, 'R2': 8.0, 'C2': 1e-6,
+                                         'C3': 2e-6})
+
+
+def test_simplification_merges_elements():
+    circuit = _reducible()
+    simplification = circuit.simplify()
+    assert simplification.reduces
+    assert simplification.compiled.param_names == ['R1-R2', 'R3', 'C1',
+                                                   'C2//C3']
+    assert simplification.simplified_names() == {'R3': 'R3', 'C1': 'C1'}
+    params = circuit.get_params()
+    simplified = simplification.transform(params)
+    np.testing.assert_allclose(simplified, [12.0, 1.0, 1e-6, 3e-6])
+    np.testing.assert_allclose(simplification.compiled.z(F, simplified),
+                               circuit.z(F), rtol=1e-12)
+    batch = np.vstack([params, 2*params])
+    np.testing.assert_allclose(simplification.transform(batch),
+                               [simplified, 2*simplified])
+
+
+def test_simplification_expand_keeps_ratios():
+    circuit = _reducible()
+    simplification = circuit.simplify()
+    params = circuit.get_params()
+    expanded = simplification.expand([24.0, 2.0, 2e-6, 6e-6])
+    np.testing.assert_allclose(expanded, 2*params)
+    np.testing.assert_allclose(simplification.transform(expanded),
+                               [24.0, 2.0, 2e-6, 6e-6])
+
+
+def test_simplification_respects_fixed_and_keep():
+    circuit = _reducible()
+    for simplification in (circuit.simplify(fixed=['R1']),
+                           circuit.simplify(keep=['R1'])):
+        assert 'R1' in simplification.compiled.param_names
+        assert 'R1-R2' not in simplification.compiled.param_names
+    assert circuit.simplify(fixed=['R1']).fixed_names == ['R1']
+    # both fixed: merged, and still fixed
+    both = circuit.simplify(fixed=['R1', 'R2'])
+    assert both.fixed_names == ['R1-R2']
+
+
+def test_unit_power_cpe_becomes_capacitor():
+    circuit = parse_circuit('R-RQ', {'Q1_p': 1.0})
+    simplification = circuit.simplify(['Q1_p'])
+    assert simplification.circuit.canonical_form() == '(C//R)-R'
+    assert simplification.is_valid(circuit.get_params())
+    params = np.vstack([circuit.get_params()]*2)
+    params[1, 3] = 0.9
+    assert not simplification.is_valid(params)
+    # a free p is never replaced
+    assert not parse_circuit('RQ', {'Q1_p': 1.0}).simplify().reduces
+
+
+def test_repeated_elements_are_not_simplified():
+    resistor = parse_circuit('R')
+    assert not (resistor - resistor).simplify().reduces
+
+
+def test_batches_run_on_the_simplified_plan():
+    circuit = _reducible()
+    plan = circuit.compile()
+    assert plan.simplification is not None
+    params = circuit.get_params()*np.array([[1.0], [2.0], [0.5]])
+    expected = [plan.z(F, row) for row in params]
+    np.testing.assert_allclose(plan.z(F, params), expected, rtol=1e-12)
+
+
+def test_sorted_orders_pieces_and_keeps_impedance():
+    circuit = (parse_circuit('R', {'R1': 10.0}) -
+               parse_circuit('RC', {'R1': 1000.0, 'C1': 1e-3}) -
+               parse_circuit('L') -
+               parse_circuit('RQ', {'R1': 100.0, 'Q1_T': 1e-6}))
+    pieces = circuit.sorted_pieces
+    assert [len(pieces[kind]) for kind in ('R', 'L', 'RC', 'RQ')] == [1] * 4
+    # fastest relaxation first
+    fastest = pieces['RC U RQ'][0]
+    assert [piece.symbol for piece in fastest.pieces] == ['R', 'Q']
+    expected = circuit.z(F)
+    result = circuit.sorted()
+    kinds = [type(piece).__name__ for piece in result.pieces]
+    assert kinds == ['L', 'R', 'RQ', 'RC']
+    np.testing.assert_allclose(result.z(F), expected, rtol=1e-12)
+    circuit.sorted(inplace=True)
+    np.testing.assert_allclose(circuit.z(F), expected, rtol=1e-12)
+
+
+def _nested():
+    """
+    Returns R-((R-RQ)//C)-RC, its subtrees and the deepest resistor.
+    """
+    circuit = parse_circuit('R-(R-RQ)//C-RC')
+    branch = circuit.pieces[1]
+    inner = branch.pieces[0]
+    sibling = circuit.pieces[2]
+    deep = inner.pieces[1].pieces[0]
+    return circuit, branch, inner, sibling, deep
+
+
+def test_subtree_caches_follow_changed_elements():
+    circuit, branch, inner, sibling, deep = _nested()
+    grid = FrequencyGrid(F)
+    circuit.z(grid)
+    cached = sibling._z_cache[3]
+    assert branch._z_cache is not None and inner._z_cache is not None
+    deep.R = 5.0
+    # the path to the changed element is dropped, the rest is kept
+    assert branch._z_cache is None and inner._z_cache is None
+    assert sibling._z_cache[3] is cached
+    np.testing.assert_allclose(circuit.z(grid), circuit.compile().z(F),
+                               rtol=1e-12)
+    assert sibling._z_cache[3] is cached
+
+
+def test_subtree_caches_follow_set_params():
+    circuit, branch, inner, sibling, deep = _nested()
+    grid = FrequencyGrid(F)
+    plan = circuit.compile()
+    before = circuit.z(grid).copy()
+    params = plan.get_params().copy()
+    plan.set_params(params)
+    assert sibling._z_cache is not None
+    params[plan.param_index[deep.label]] *= 2
+    plan.set_params(params)
+    assert branch._z_cache is None and sibling._z_cache is not None
+    after = circuit.z(grid)
+    assert not np.allclose(before, after)
+    np.testing.assert_allclose(after, plan.z(F), rtol=1e-12)
+
+
+def test_caches_follow_grids_and_pieces():
+    circuit, branch, inner, sibling, deep = _nested()
+    grid = FrequencyGrid(F)
+    circuit.z(grid)
+    # a new grid, or writeable frequencies, are evaluated anew
+    other = FrequencyGrid(F[::2])
+    np.testing.assert_allclose(circuit.z(other), circuit.z(grid)[::2],
+                               rtol=1e-12)
+    np.testing.assert_allclose(circuit.z(F), circuit.z(grid), rtol=1e-12)
+    # replacing the pieces of a subcircuit drops the caches above it
+    circuit.z(grid)
+    plan = circuit.compile()
+    inner.pieces = inner.pieces[:1]
+    assert circuit.compile() is not plan
+    assert branch._z_cache is None and circuit._z_cache is None
+    np.testing.assert_allclose(circuit.z(grid), circuit.compile().z(F),
+                               rtol=1e-12)
+    # a copy evaluates the same and keeps tracking its own pieces
+    clone = copy.deepcopy(circuit)
+    np.testing.assert_allclose(clone.z(grid), circuit.z(grid), rtol=1e-12)
+    clone.pieces[1].pieces[0].pieces[0].R = 7.0
+    assert not np.allclose(clone.z(grid), circuit.z(grid))
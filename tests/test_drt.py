@@ -0,0 +1,63 @@
+# coding: utf-8
+
+"""
+Checks the distribution of relaxation times of synthetic spectra.
+"""
+
+import numpy as np
+import pytest
+
+from automaterials.experiment.eis.drt import drt, drt_series
+from automaterials.experiment.eis.parser import parse_circuit
+from automaterials.experiment.eis.properties import ZData
+
+__author__ = "Rodolpho Mouta"
+__maintainer__ = "Rodolpho Mouta"
+__email__ = "mouta.rodolpho@gmail.com"
+
+"""
+Constants
+"""
+F = np.logspace(-2, 6, 71)
+TRUE = {'R1': 10.0, 'R2': 100.0, 'C1': 1e-6, 'R3': 1000.0, 'C2': 1e-3}
+
+
+def _spectrum(scale: float = 1.0) -> ZData:
+    return ZData(F, scale*parse_circuit('R-RC-RC', TRUE).z(F))
+
+
+@pytest.mark.parametrize('lambda_', ['gcv', 'lcurve', 1e-8])
+def test_drt_recovers_processes(lambda_):
+    result = drt(_spectrum(), lambda_)
+    assert result.R_inf == pytest.approx(TRUE['R1'], rel=0.01)
+    assert result.R_pol == pytest.approx(TRUE['R2'] + TRUE['R3'], rel=0.01)
+    np.testing.assert_allclose(np.log10(result.peaks()), [-4, 0], atol=0.1)
+    assert np.abs(result.residuals_real).max() < 0.01
+    assert (result.gamma >= 0).all()
+
+
+def test_drt_does_not_depend_on_scale():
+    result = drt(_spectrum())
+    scaled = drt(_spectrum(1e6))
+    assert scaled.lambda_ == result.lambda_
+    np.testing.assert_allclose(scaled.gamma, 1e6*result.gamma, rtol=1e-6,
+                               atol=1e-9*scaled.gamma.max())
+
+
+def test_drt_series_matches_single_spectra():
+    series = {300: _spectrum(), 400: _spectrum(0.5), 500: _spectrum(2.0)}
+    results = drt_series(series)
+    assert list(results) == [300, 400, 500]
+    for key, zdata in series.items():
+        np.testing.assert_allclose(results[key].gamma, drt(zdata).gamma,
+                                   rtol=1e-9, atol=1e-9)
+
+
+def test_drt_of_zero_spectrum():
+    zero = ZData(F, np.zeros(F.size, dtype=complex))
+    with np.errstate(all='raise'):
+        result = drt(zero)
+    assert not result.gamma.any()
+    assert result.R_inf == 0 and result.R_pol == 0
+    series = drt_series({1: zero, 2: _spectrum()})
+    assert series[2].R_pol == pytest.approx(drt(_spectrum()).R_pol)
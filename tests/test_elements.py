@@ -0,0 +1,115 @@
+# coding: utf-8
+
+"""
+Checks the distributed elements against their closed forms and limits.
+"""
+
+import numpy as np
+import pytest
+
+from automaterials.experiment.eis.circuits import (
+    Gerischer, HavriliakNegami, TransmissionLine, Warburg, WarburgOpen,
+    WarburgShort)
+from automaterials.experiment.eis.parser import parse_circuit
+
+__author__ = "Rodolpho Mouta"
+__maintainer__ = "Rodolpho Mouta"
+__email__ = "mouta.rodolpho@gmail.com"
+
+"""
+Constants
+"""
+F = np.logspace(-3, 6, 37)
+OMEGA = 2*np.pi*F
+LOW = 1e-9   # Hz, far below every relaxation frequency
+HIGH = 1e9   # Hz, far above every relaxation frequency
+
+
+def test_warburg():
+    z = Warburg(sigma=5.0).z(F)
+    np.testing.assert_allclose(z, 5.0*(1 - 1j)/np.sqrt(OMEGA), rtol=1e-12)
+
+
+@pytest.mark.parametrize('element', [WarburgShort, WarburgOpen])
+def test_finite_warburg_tends_to_warburg(element):
+    # at high frequencies the diffusion layer looks semi-infinite
+    z = element(R=10.0, tau=2.0).z(HIGH)
+    warburg = Warburg(sigma=10.0/np.sqrt(2*2.0)).z(HIGH)
+    assert z == pytest.approx(warburg, rel=1e-9)
+
+
+def test_warburg_short_low_frequency_limit():
+    assert WarburgShort(R=10.0, tau=2.0).z(LOW) == pytest.approx(10.0)
+    s = np.sqrt(1j*OMEGA*2.0)
+    np.testing.assert_allclose(WarburgShort(R=10.0, tau=2.0).z(F),
+                               10.0*np.tanh(s)/s, rtol=1e-9)
+
+
+def test_warburg_open_low_frequency_limit():
+    # R/3 in series with a capacitance tau/R
+    z = WarburgOpen(R=10.0, tau=2.0).z(LOW)
+    capacitor = 1/(1j*2*np.pi*LOW*2.0/10.0)
+    assert z.real == pytest.approx(10.0/3, rel=1e-6)
+    assert z.imag == pytest.approx(capacitor.imag, rel=1e-9)
+
+
+def test_gerischer():
+    z = Gerischer(R=10.0, tau=1e-3).z(F)
+    np.testing.assert_allclose(z, 10.0/np.sqrt(1 + 1j*OMEGA*1e-3),
+                               rtol=1e-12)
+    assert Gerischer(R=10.0, tau=1e-3).z(LOW) == pytest.approx(10.0)
+
+
+def test_havriliak_negami_limits():
+    rc = parse_circuit('RC', {'R1': 10.0, 'C1': 1e-4})
+    debye = HavriliakNegami(R=10.0, tau=1e-3, alpha=1.0, beta=1.0)
+    np.testing.assert_allclose(debye.z(F), rc.z(F), rtol=1e-12)
+    # beta = 1 is an RQ with tau = (R*T)**(1/p)
+    rq = parse_circuit('RQ', {'R1': 10.0, 'Q1_T': 1e-3**0.8/10.0,
+                              'Q1_p': 0.8})
+    cole_cole = HavriliakNegami(R=10.0, tau=1e-3, alpha=0.8, beta=1.0)
+    np.testing.assert_allclose(cole_cole.z(F), rq.z(F), rtol=1e-12)
+    cole_davidson = HavriliakNegami(R=10.0, tau=1e-3, alpha=1.0, beta=0.6)
+    np.testing.assert_allclose(cole_davidson.z(F),
+                               10.0/(1 + 1j*OMEGA*1e-3)**0.6, rtol=1e-12)
+
+
+def test_transmission_line_matches_ladder():
+    line = TransmissionLine(R_ion=10.0, R_ct=100.0, T=1e-4, p=0.9)
+    # the ladder needs more segments as the penetration depth shrinks at
+    # high frequencies
+    f = np.logspace(-3, 4, 15)
+    z = line.z(f)
+    interface = 1/(1/100.0 + 1e-4*(2j*np.pi*f)**0.9)
+    errors = []
+    for n in (100, 200):
+        # n segments, each with a rung at its middle
+        rung, segment = n*interface, 10.0/n
+        ladder = rung.copy()
+        for _ in range(n - 1):
+            ladder = 1/(1/rung + 1/(segment + ladder))
+        errors.append(np.abs((segment/2 + ladder)/z - 1).max())
+    assert errors[1] < 0.01
+    # second order in the segment length
+    assert errors[0]/errors[1] == pytest.approx(4, rel=0.05)
+
+
+def test_transmission_line_limits():
+    line = TransmissionLine(R_ion=10.0, R_ct=100.0, T=1e-4, p=0.9)
+    ratio = np.sqrt(10.0/100.0)
+    assert line.z(LOW) == pytest.approx(np.sqrt(10.0*100.0)/np.tanh(ratio))
+    # the blocking electrode tends to R_ion/3 in series with the CPE
+    blocking = TransmissionLine(R_ion=10.0, R_ct=1e20, T=1e-4, p=1.0)
+    z = blocking.z(1e-3)
+    assert z.real == pytest.approx(10.0/3, rel=1e-3)
+    assert z.imag == pytest.approx(-1/(2*np.pi*1e-3*1e-4), rel=1e-3)
+
+
+def test_distributed_elements_compose():
+    circuit = parse_circuit('R-H//TLM-Ws')
+    z = circuit.z(F)
+    np.testing.assert_allclose(circuit.compile().z(F), z, rtol=1e-12)
+    h, tlm = circuit.pieces[1].pieces
+    expected = (circuit.pieces[0].z(F) + 1/(1/h.z(F) + 1/tlm.z(F)) +
+                circuit.pieces[2].z(F))
+    np.testing.assert_allclose(z, expected, rtol=1e-12)
@@ -0,0 +1,101 @@
+# coding: utf-8
+
+"""
+Checks that the compiled plan (single parameter sets and batches) and the
+circuit tree give the same impedance.
+"""
+
+import numpy as np
+import pytest
+
+from automaterials.experiment.eis.circuits import (
+    BrickLayerModelLike, C, Q, R, RC, RQ)
+from automaterials.experiment.eis.parser import parse_circuit
+from automaterials.experiment.eis.properties import FrequencyGrid
+
+__author__ = "Rodolpho Mouta"
+__maintainer__ = "Rodolpho Mouta"
+__email__ = "mouta.rodolpho@gmail.com"
+
+"""
+Constants
+"""
+F = np.logspace(-2, 6, 41)
+CIRCUITS = ['R', 'RC', 'R-RQ-RQ', 'L-R-(RC//RQ)-Wo', 'R-(R-W)//Q-G',
+            'R-H//TLM-Ws', 'RQ//(R-C)', '(R-Q)//(R-C)//L']
+N_ROWS = 5
+
+
+def _params(plan, n_rows: int, seed: int = 0) -> np.ndarray:
+    """
+    Returns n_rows random parameter sets around the current ones, with the
+    exponents (CPE p, HN alpha and beta) kept in (0, 1].
+    """
+    rng = np.random.default_rng(seed)
+    params = plan.get_params()*np.exp(
+        rng.normal(0, 0.3, size=(n_rows, plan.n_params)))
+    for idx, name in enumerate(plan.param_names):
+        if name.endswith(('_p', '_alpha', '_beta')):
+            params[:, idx] = rng.uniform(0.5, 1.0, size=n_rows)
+    return params
+
+
+@pytest.mark.parametrize('cdc', CIRCUITS)
+def test_compiled_matches_tree(cdc: str):
+    circuit = parse_circuit(cdc)
+    plan = circuit.compile()
+    for params in _params(plan, N_ROWS):
+        plan.set_params(params)
+        expected = circuit.z(F)
+        np.testing.assert_allclose(plan.z(F), expected, rtol=1e-12)
+        np.testing.assert_allclose(plan.z(F, params), expected, rtol=1e-12)
+
+
+@pytest.mark.parametrize('cdc', CIRCUITS)
+def test_batch_matches_single(cdc: str):
+    plan = parse_circuit(cdc).compile()
+    params = _params(plan, N_ROWS)
+    z = plan.z_batch(F, params)
+    assert z.shape == (N_ROWS, len(F))
+    for row, z_row in zip(params, z):
+        np.testing.assert_allclose(z_row, plan.z(F, row), rtol=1e-12)
+    np.testing.assert_allclose(plan.z(F, params), z, rtol=1e-12)
+
+
+@pytest.mark.parametrize('cdc', CIRCUITS)
+def test_single_precision(cdc: str):
+    plan = parse_circuit(cdc).compile()
+    params = _params(plan, N_ROWS)
+    z = plan.z_batch(F, params, dtype=np.complex64)
+    assert z.dtype == np.complex64
+    np.testing.assert_allclose(z, plan.z_batch(F, params), rtol=1e-4)
+
+
+def test_grid_and_scalar_frequencies():
+    circuit = parse_circuit('R-RQ-RQ')
+    plan = circuit.compile()
+    grid = FrequencyGrid(F)
+    np.testing.assert_allclose(plan.z(grid), plan.z(F), rtol=0)
+    np.testing.assert_allclose(circuit.z(grid), circuit.z(F), rtol=0)
+    assert isinstance(plan.z(1e3), complex)
+    assert plan.z(1e3) == pytest.approx(complex(plan.z(np.array([1e3]))[0]))
+
+
+def test_tree_cache_follows_parameters():
+    circuit = R(10.0) - RC(R(100.0), C(1e-6)) - RQ(R(1000.0), Q(1e-5, 0.8))
+    grid = FrequencyGrid(F)
+    before = circuit.z(grid)
+    circuit.pieces[1].pieces[0].R = 200.0
+    after = circuit.z(grid)
+    assert not np.allclose(before, after)
+    np.testing.assert_allclose(after, circuit.compile().z(F), rtol=1e-12)
+
+
+def test_brick_layer_model_like():
+    circuit = BrickLayerModelLike(RC(R(100.0), C(1e-9)),
+                                  RQ(R(1000.0), Q(1e-7, 0.8)),
+                                  RC(R(50.0), C(1e-5)))
+    plan = circuit.compile()
+    np.testing.assert_allclose(plan.z(F), circuit.z(F), rtol=1e-12)
+    np.testing.assert_allclose(plan.z_batch(F, plan.get_params()[None, :])[0],
+                               circuit.z(F), rtol=1e-12)
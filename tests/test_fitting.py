@@ -0,0 +1,185 @@
+# coding: utf-8
+
+"""
+Checks that the fitting functions recover the parameters of synthetic
+spectra.
+"""
+
+import numpy as np
+import pytest
+
+from automaterials.experiment.eis.fitting import fit, fit_series, global_fit
+from automaterials.experiment.eis.parser import parse_circuit
+from automaterials.experiment.eis.properties import ZData, ZDataCollection
+
+__author__ = "Rodolpho Mouta"
+__maintainer__ = "Rodolpho Mouta"
+__email__ = "mouta.rodolpho@gmail.com"
+
+"""
+Constants
+"""
+F = np.logspace(-2, 6, 50)
+TRUE = {'R1': 10.0, 'R2': 100.0, 'Q1_T': 1e-6, 'Q1_p': 0.9,
+        'R3': 1000.0, 'Q2_T': 1e-4, 'Q2_p': 0.8}
+START = {'R1': 13.0, 'R2': 70.0, 'Q1_T': 3e-6, 'Q1_p': 0.8,
+         'R3': 1500.0, 'Q2_T': 5e-5, 'Q2_p': 0.7}
+
+
+def _spectrum(
+    cdc: str,
+    params: dict,
+    noise: float = 0.0,
+    seed: int = 0
+) -> ZData:
+    """
+    Returns the spectrum of cdc with params, with relative Gaussian noise
+    on both parts.
+    """
+    rng = np.random.default_rng(seed)
+    z = parse_circuit(cdc, params).z(F)
+    deviation = rng.normal(size=F.size) + 1j*rng.normal(size=F.size)
+    z = z + noise*np.abs(z)*deviation
+    return ZData(F, z)
+
+
+def test_fit_recovers_parameters():
+    zdata = _spectrum('R-RQ-RQ', TRUE)
+    circuit = parse_circuit('R-RQ-RQ', START)
+    result = fit(circuit, zdata)
+    assert result.success
+    for name, value in TRUE.items():
+        assert result.as_dict()[name] == pytest.approx(value, rel=1e-6)
+    assert result.chi2 < 1e-12
+    # the circuit passed in is left unchanged, the result holds the fit
+    assert circuit.compile().get_params()[0] == START['R1']
+    np.testing.assert_allclose(result.circuit.z(F), zdata.z, rtol=1e-6)
+
+
+def test_fit_errors_cover_the_truth():
+    zdata = _spectrum('R-RQ-RQ', TRUE, noise=0.002)
+    result = fit(parse_circuit('R-RQ-RQ', START), zdata)
+    assert result.n_free == len(TRUE) == len(result.free_names)
+    assert result.covariance.shape == (len(TRUE), len(TRUE))
+    for name, value in TRUE.items():
+        stderr = result.stderr[name]
+        assert 0 < stderr < 0.1*value
+        assert abs(result.as_dict()[name] - value) < 5*stderr
+
+
+def test_fit_fixed_and_bounds():
+    zdata = _spectrum('R-RQ-RQ', TRUE)
+    start = dict(START, Q2_p=TRUE['Q2_p'])
+    result = fit(parse_circuit('R-RQ-RQ', start), zdata, fixed=['Q2_p'],
+                 bounds={'R1': (5.0, 20.0)})
+    assert result.as_dict()['Q2_p'] == TRUE['Q2_p']
+    assert result.stderr['Q2_p'] == 0.0
+    assert 'Q2_p' not in result.free_names
+    assert result.as_dict()['R3'] == pytest.approx(TRUE['R3'], rel=1e-6)
+
+
+def test_fit_merged_parameters_are_not_identifiable():
+    """
+    R1-R2 is fitted as one resistor: the sum is recovered, and each of R1
+    and R2 is reported with an infinite error.
+    """
+    true = {'R1': 4.0, 'R2': 8.0, 'R3': 100.0, 'C1': 1e-6}
+    zdata = _spectrum('R-R-RC', true, noise=0.001)
+    start = {'R1': 1.0, 'R2': 1.0, 'R3': 50.0}
+    result = fit(parse_circuit('R-R-RC', start), zdata)
+    assert result.simplification is not None
+    assert result.n_free == 3
+    values = result.as_dict()
+    assert values['R1'] + values['R2'] == pytest.approx(12.0, rel=0.01)
+    assert np.isinf(result.stderr['R1']) and np.isinf(result.stderr['R2'])
+    assert np.isfinite(result.stderr['R3'])
+    assert np.isfinite(result.stderr['C1'])
+    assert result.free_names == ['R1', 'R2', 'R3', 'C1']
+    idx = result.free_names.index('R3')
+    variance = result.covariance[idx, idx]
+    assert variance == pytest.approx(result.stderr['R3']**2)
+    assert np.isnan(result.covariance[0, idx])
+    assert result.simplified_stderr['R1-R2'] < 0.1
+    # the same fit without simplification has the original free parameters
+    plain = fit(parse_circuit('R-R-RC', start), zdata, simplify=False)
+    assert plain.simplification is None and plain.n_free == 4
+
+
+def test_fit_survives_a_zero_resistance():
+    zdata = _spectrum('R-RQ-RQ', TRUE)
+    result = fit(parse_circuit('R-RQ-RQ', dict(START, R2=0.0)), zdata)
+    assert np.isfinite(result.chi2)
+
+
+def test_global_fit_recovers_parameters_from_far_away():
+    zdata = _spectrum('R-RQ-RQ', TRUE)
+    far = {name: value*(30.0 if name.endswith(('R2', 'T')) else 1.0)
+           for name, value in START.items()}
+    result = global_fit(parse_circuit('R-RQ-RQ', far), zdata, popsize=40,
+                        generations=100, seed=0)
+    assert result.success
+    # the two RQ elements may come out in either order
+    values = result.as_dict()
+    assert values['R1'] == pytest.approx(TRUE['R1'], rel=1e-4)
+    resistances = sorted([values['R2'], values['R3']])
+    np.testing.assert_allclose(resistances, [100.0, 1000.0], rtol=1e-4)
+    np.testing.assert_allclose(result.circuit.z(F), zdata.z, rtol=1e-6)
+
+
+def test_global_fit_is_reproducible():
+    zdata = _spectrum('R-RC', {'R1': 10.0, 'R2': 100.0, 'C1': 1e-6})
+    circuit = parse_circuit('R-RC')
+    first = global_fit(circuit, zdata, popsize=10, generations=5, seed=1)
+    second = global_fit(circuit, zdata, popsize=10, generations=5, seed=1)
+    np.testing.assert_array_equal(first.params, second.params)
+
+
+@pytest.mark.parametrize('popsize', [0, 1, 2])
+def test_global_fit_rejects_small_populations(popsize: int):
+    zdata = _spectrum('R-RC', {'R1': 10.0, 'R2': 100.0, 'C1': 1e-6})
+    with pytest.raises(ValueError, match='popsize'):
+        global_fit(parse_circuit('R-RC'), zdata, popsize=popsize)
+
+
+def _series() -> dict:
+    """
+    Returns {temperature: ZData} with resistances falling with temperature.
+    """
+    series = {}
+    for temperature in (300.0, 350.0, 400.0, 450.0):
+        factor = np.exp(2000.0*(1/temperature - 1/300.0))
+        params = dict(TRUE, R2=TRUE['R2']*factor, R3=TRUE['R3']*factor)
+        series[temperature] = _spectrum('R-RQ-RQ', params, noise=0.001)
+    return series
+
+
+def test_fit_series_recovers_every_spectrum():
+    series = _series()
+    table = fit_series(parse_circuit('R-RQ-RQ', START), series, processes=1)
+    assert list(table.index) == list(series)
+    assert table.index.name == 'temperature'
+    assert table['success'].all()
+    for temperature, zdata in series.items():
+        expected = fit(parse_circuit('R-RQ-RQ', START), zdata).as_dict()
+        row = table.loc[temperature]
+        for name, value in expected.items():
+            assert row[name] == pytest.approx(value, rel=1e-4)
+            assert row[f'{name}_stderr'] > 0
+
+
+def test_fit_series_in_processes_matches_one_process():
+    series = _series()
+    circuit = parse_circuit('R-RQ-RQ', START)
+    serial = fit_series(circuit, series, processes=1)
+    parallel = fit_series(circuit, series, processes=2)
+    names = circuit.compile().param_names
+    np.testing.assert_allclose(parallel[names], serial[names], rtol=1e-4)
+
+
+def test_fit_series_of_collection_keeps_metadata():
+    series = _series()
+    collection = ZDataCollection.from_series(series)
+    table = fit_series(parse_circuit('R-RQ-RQ', START), collection,
+                       processes=1)
+    assert list(table['temperature']) == list(series)
+    assert table['success'].all()
@@ -0,0 +1,104 @@
+# coding: utf-8
+
+"""
+Checks the starting parameters estimated from synthetic spectra.
+"""
+
+import numpy as np
+import pytest
+
+from automaterials.experiment.eis.fitting import fit
+from automaterials.experiment.eis.guess import SpectrumFeatures, initial_guess
+from automaterials.experiment.eis.parser import parse_circuit
+from automaterials.experiment.eis.properties import ZData
+
+__author__ = "Rodolpho Mouta"
+__maintainer__ = "Rodolpho Mouta"
+__email__ = "mouta.rodolpho@gmail.com"
+
+"""
+Constants
+"""
+F = np.logspace(-2, 6, 81)
+TWO_RC = {'R1': 10.0, 'R2': 100.0, 'C1': 1e-7, 'R3': 1000.0, 'C2': 1e-4}
+TWO_RQ = {'R1': 10.0, 'R2': 100.0, 'Q1_T': 1e-7, 'Q1_p': 0.9,
+          'R3': 1000.0, 'Q2_T': 1e-4, 'Q2_p': 0.8}
+
+
+def _spectrum(cdc: str, params: dict, noise: float = 0.0) -> ZData:
+    rng = np.random.default_rng(0)
+    z = parse_circuit(cdc, params).z(F)
+    z = z + noise*np.abs(z)*(rng.normal(size=F.size) +
+                             1j*rng.normal(size=F.size))
+    return ZData(F, z)
+
+
+def _params(circuit) -> dict:
+    return dict(zip(circuit.param_names, circuit.compile().get_params()))
+
+
+@pytest.mark.parametrize('cdc, true, rel', [
+    ('R-RC-RC', TWO_RC, 0.01),
+    ('R-RC-C', {'R1': 10.0, 'R2': 100.0, 'C1': 1e-7, 'C2': 1e-2}, 0.01),
+    ('R-RC-Q', {'R1': 10.0, 'R2': 100.0, 'C1': 1e-7,
+                'Q1_T': 1e-3, 'Q1_p': 0.7}, 0.01),
+    ('L-R-RC', {'L1': 1e-6, 'R1': 10.0, 'R2': 100.0, 'C1': 1e-7}, 0.3),
+])
+def test_initial_guess_recovers_parameters(cdc, true, rel):
+    guess = _params(initial_guess(parse_circuit(cdc), _spectrum(cdc, true)))
+    for name, value in true.items():
+        assert guess[name] == pytest.approx(value, rel=rel)
+
+
+def test_initial_guess_of_noisy_spectrum():
+    guess = initial_guess(parse_circuit('R-RC-RC'),
+                          _spectrum('R-RC-RC', TWO_RC, noise=0.01))
+    for name, value in _params(guess).items():
+        assert value == pytest.approx(TWO_RC[name], rel=0.1)
+
+
+def test_fit_from_initial_guess_recovers_rq():
+    zdata = _spectrum('R-RQ-RQ', TWO_RQ)
+    guess = initial_guess(parse_circuit('R-RQ-RQ'), zdata)
+    start = _params(guess)
+    # depressed arcs give rougher, but same order of magnitude, guesses
+    for name, value in TWO_RQ.items():
+        assert 0.3 < start[name]/value < 3
+    result = fit(guess, zdata)
+    for name, value in TWO_RQ.items():
+        assert result.as_dict()[name] == pytest.approx(value, rel=1e-6)
+
+
+def test_initial_guess_copy_and_inplace():
+    zdata = _spectrum('R-RC-RC', TWO_RC)
+    circuit = parse_circuit('R-RC-RC')
+    before = _params(circuit)
+    guess = initial_guess(circuit, zdata)
+    assert guess is not circuit
+    assert _params(circuit) == before
+    assert initial_guess(circuit, zdata, inplace=True) is circuit
+    assert _params(circuit) == _params(guess)
+
+
+def test_initial_guess_uses_largest_arcs():
+    guess = _params(initial_guess(parse_circuit('R-RC'),
+                                  _spectrum('R-RC-RC', TWO_RC)))
+    assert guess['R2'] == pytest.approx(TWO_RC['R3'], rel=0.01)
+    assert guess['C1'] == pytest.approx(TWO_RC['C2'], rel=0.01)
+
+
+def test_spectrum_features():
+    features = SpectrumFeatures(_spectrum('R-RC-RC', TWO_RC))
+    assert features.n_arcs == 2
+    np.testing.assert_allclose(features.tau, [1e-5, 1e-1], rtol=0.01)
+    np.testing.assert_allclose(features.R, [100.0, 1000.0], rtol=0.01)
+    np.testing.assert_allclose(features.p, [1.0, 1.0], atol=0.01)
+    assert features.R_inf == pytest.approx(10.0, rel=0.01)
+    assert features.L == 0.0
+    # a capacitive tail does not hide the arcs, and can be dropped
+    tail = SpectrumFeatures(_spectrum('R-RC-C', {'R1': 10.0, 'R2': 100.0,
+                                                 'C1': 1e-7, 'C2': 1e-2}))
+    assert tail.n_arcs == 2 and tail.at_low_end.tolist() == [False, True]
+    tail.drop_low_end()
+    assert tail.n_arcs == 1
+    assert tail.R[0] == pytest.approx(100.0, rel=0.01)
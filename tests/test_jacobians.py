@@ -0,0 +1,101 @@
+# coding: utf-8
+
+"""
+Checks the analytic derivatives of every element kernel, in impedance and
+in admittance form, and of the circuits built from them, against central
+finite differences of the impedance.
+"""
+
+import numpy as np
+import pytest
+
+from automaterials.experiment.eis.parser import ELEMENTS, parse_circuit
+
+__author__ = "Rodolpho Mouta"
+__maintainer__ = "Rodolpho Mouta"
+__email__ = "mouta.rodolpho@gmail.com"
+
+"""
+Constants
+"""
+F = np.logspace(-2, 6, 41)
+STEP = 1e-5  # relative to each parameter value
+RTOL = 1e-5  # roundoff in the differences dominates below this
+# parameter values away from the defaults, so that every term matters
+VALUES = {'R': 120.0, 'C': 3.0e-6, 'T': 2.0e-5, 'p': 0.8, 'L': 4.0e-7,
+          'sigma': 35.0, 'tau': 2.0e-3, 'alpha': 0.7, 'beta': 0.6,
+          'R_ion': 80.0, 'R_ct': 250.0}
+
+
+def _circuit(cdc: str):
+    """
+    Returns the circuit of cdc and its compiled plan, with each parameter
+    set from VALUES by name (e.g. the p of every CPE takes VALUES['p']).
+    """
+    circuit = parse_circuit(cdc)
+    plan = circuit.compile()
+    for element in plan.elements:
+        for name in element.param_names:
+            setattr(element, name, VALUES[name])
+    return circuit, plan
+
+
+def _finite_differences(plan, params: np.ndarray) -> np.ndarray:
+    """
+    Returns the (n_params, len(F)) central finite differences of the
+    impedance.
+    """
+    columns = []
+    for idx, value in enumerate(params):
+        h = STEP*abs(value)
+        upper, lower = params.copy(), params.copy()
+        upper[idx] += h
+        lower[idx] -= h
+        columns.append((plan.z(F, upper) - plan.z(F, lower))/(2*h))
+    return np.array(columns)
+
+
+def _assert_close(jacobian: np.ndarray, expected: np.ndarray) -> None:
+    # each row is compared relative to its own scale, as the parameters
+    # span many decades
+    for row, expected_row in zip(jacobian, expected):
+        scale = np.abs(expected_row).max()
+        np.testing.assert_allclose(row, expected_row, rtol=0, atol=RTOL*scale)
+
+
+@pytest.mark.parametrize('symbol', list(ELEMENTS))
+@pytest.mark.parametrize('template', ['{}', 'R-{}', 'R//{}', '(R-{})//C'])
+def test_compiled_jacobian(symbol: str, template: str):
+    """
+    The templates put the element in series (impedance kernels) and in
+    parallel (admittance kernels).
+    """
+    _, plan = _circuit(template.format(symbol))
+    params = plan.get_params().copy()
+    z, jacobian = plan.z_and_jacobian(F, params)
+    np.testing.assert_allclose(z, plan.z(F, params), rtol=1e-12)
+    _assert_close(jacobian, _finite_differences(plan, params))
+
+
+@pytest.mark.parametrize('symbol', list(ELEMENTS))
+def test_batched_jacobian(symbol: str):
+    _, plan = _circuit(f'R-({symbol}//Q)')
+    params = plan.get_params()*np.array([[1.0], [1.1], [0.9]])
+    params[:, plan.param_index['Q1_p']] = [0.8, 0.9, 0.7]
+    jacobians = plan.jacobian(F, params)
+    for row, jacobian in zip(params, jacobians):
+        np.testing.assert_allclose(jacobian, plan.jacobian(F, row), rtol=1e-12)
+
+
+@pytest.mark.parametrize('cdc', ['R-RQ-RQ', 'L-R-(RC//RQ)-Wo', 'R-(R-W)//Q-G',
+                                 'R-H//TLM-Ws', 'RQ//(R-C)'])
+def test_circuit_jacobian(cdc: str):
+    """
+    The derivatives chained through the circuit tree match those of the
+    compiled plan and the finite differences.
+    """
+    circuit, plan = _circuit(cdc)
+    params = plan.get_params().copy()
+    expected = _finite_differences(plan, params)
+    _assert_close(plan.jacobian(F, params), expected)
+    _assert_close(circuit.dz_dparams(F), expected)
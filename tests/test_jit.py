@@ -0,0 +1,88 @@
+# coding: utf-8
+
+"""
+Checks the fused backend of jit.py against the NumPy evaluation of the
+compiled plans.
+"""
+
+import numpy as np
+import pytest
+
+from automaterials.experiment.eis import jit
+from automaterials.experiment.eis.parser import parse_circuit
+
+__author__ = "Rodolpho Mouta"
+__maintainer__ = "Rodolpho Mouta"
+__email__ = "mouta.rodolpho@gmail.com"
+
+"""
+Constants
+"""
+F = np.logspace(-2, 6, 21)
+SUPPORTED = ['R', 'C', 'RQ', 'L-R-RQ-RQ', 'R-(RC//RQ)-C', '(R-Q)//(R-C)//L']
+UNSUPPORTED = ['R-W', 'R-RQ-Wo', 'G//R', 'L-H-TLM']
+
+
+def _params(plan, n_rows: int = 4) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    params = plan.get_params()*np.exp(
+        rng.normal(0, 0.3, size=(n_rows, plan.n_params)))
+    for idx, name in enumerate(plan.param_names):
+        if name.endswith('_p'):
+            params[:, idx] = rng.uniform(0.5, 1.0, size=n_rows)
+    return params
+
+
+@pytest.fixture
+def backend():
+    previous = jit.get_backend()
+    yield jit.set_backend
+    jit.set_backend(previous)
+
+
+@pytest.mark.parametrize('cdc', SUPPORTED)
+def test_program_matches_numpy(cdc: str, backend):
+    """
+    Runs the encoded program directly, compiled by Numba or not, so that
+    the encoding is checked even without Numba.
+    """
+    backend('numpy')
+    plan = parse_circuit(cdc).compile()
+    assert plan.jit_program is not None
+    params = _params(plan)
+    out = np.empty((len(params), len(F)), dtype=complex)
+    jit.z_rows(plan.jit_program, plan.admittance_output, plan.n_registers,
+               2*np.pi*F, params, out)
+    np.testing.assert_allclose(out, plan.z_batch(F, params), rtol=1e-12)
+
+
+@pytest.mark.parametrize('cdc', SUPPORTED + UNSUPPORTED)
+def test_backends_match(cdc: str, backend):
+    pytest.importorskip('numba')
+    plan = parse_circuit(cdc).compile()
+    params = _params(plan)
+    backend('numpy')
+    expected = plan.z_batch(F, params)
+    backend('numba')
+    assert jit.get_backend() == 'numba'
+    np.testing.assert_allclose(plan.z_batch(F, params), expected, rtol=1e-12)
+    np.testing.assert_allclose(plan.z_batch(F, params, dtype=np.complex64),
+                               expected, rtol=1e-5)
+
+
+@pytest.mark.parametrize('cdc', UNSUPPORTED)
+def test_unsupported_elements_fall_back(cdc: str, backend, monkeypatch,
+                                        capsys):
+    plan = parse_circuit(cdc).compile()
+    assert plan.jit_program is None
+    symbols = jit.unsupported(plan.elements)
+    assert symbols and not set(symbols) & {'R', 'C', 'Q', 'L'}
+    params = _params(plan)
+    backend('numpy')
+    expected = plan.z_batch(F, params)
+    monkeypatch.setattr(jit, '_backend', 'numba')
+    monkeypatch.setattr(jit, '_warned', set())
+    np.testing.assert_allclose(plan.z_batch(F, params), expected, rtol=0)
+    assert 'WARNING' in capsys.readouterr().out
+    plan.z_batch(F, params)
+    assert capsys.readouterr().out == ''
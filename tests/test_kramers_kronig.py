@@ -0,0 +1,117 @@
+# coding: utf-8
+
+"""
+Checks the linear Kramers-Kronig test on synthetic spectra.
+"""
+
+import numpy as np
+import pytest
+
+from automaterials.experiment.eis.kramers_kronig import (
+    MU_CRITERION, kk_summary, kk_test, kk_test_series, time_constants)
+from automaterials.experiment.eis.parser import parse_circuit
+from automaterials.experiment.eis.properties import ZData
+
+__author__ = "Rodolpho Mouta"
+__maintainer__ = "Rodolpho Mouta"
+__email__ = "mouta.rodolpho@gmail.com"
+
+"""
+Constants
+"""
+F = np.logspace(-2, 6, 71)
+R0 = 20.0
+R = np.array([50.0, 200.0, 10.0, 400.0, 30.0])
+L = 1e-7
+C = 1e-3
+
+
+def _voigt(f: np.ndarray = F, scale: float = 1.0, inductance: bool = True,
+           capacitance: bool = False) -> ZData:
+    """
+    Returns the spectrum of R0 in series with Voigt elements R with the
+    time constants used by the test for len(R) elements, so that it is
+    exactly recovered.
+    """
+    jomega = 2j*np.pi*f
+    tau = time_constants(f, R.size)
+    z = R0 + (R/(1 + np.outer(jomega, tau))).sum(axis=1)
+    if inductance:
+        z = z + jomega*L
+    if capacitance:
+        z = z + 1/(jomega*C)
+    return ZData(f, scale*z)
+
+
+@pytest.mark.parametrize('capacitance', [False, True])
+def test_kk_test_recovers_voigt_spectrum(capacitance):
+    result = kk_test(_voigt(capacitance=capacitance), max_elements=R.size,
+                     capacitance=capacitance)
+    assert result.n_elements == R.size
+    assert result.R0 == pytest.approx(R0, rel=1e-9)
+    np.testing.assert_allclose(result.R, R, rtol=1e-9)
+    assert result.L == pytest.approx(L, rel=1e-6)
+    if capacitance:
+        assert result.C == pytest.approx(C, rel=1e-9)
+    else:
+        assert result.C is None
+    assert result.mu == 1.0
+    assert np.abs(result.residuals_real).max() < 1e-9
+    assert np.abs(result.residuals_imag).max() < 1e-9
+    assert result.consistent().all()
+
+
+def test_kk_test_without_inductance():
+    result = kk_test(_voigt(inductance=False), max_elements=R.size,
+                     inductance=False)
+    assert result.L is None
+    np.testing.assert_allclose(result.R, R, rtol=1e-9)
+
+
+def test_kk_test_flags_inconsistent_range():
+    zdata = _voigt()
+    z = zdata.z.copy()
+    z.imag[:10] *= 1.5
+    result = kk_test(ZData(F, z), max_elements=R.size)
+    residuals = np.maximum(np.abs(result.residuals_real),
+                           np.abs(result.residuals_imag))
+    assert residuals.max() > 0.01
+    assert residuals.argmax() < 10
+    assert not result.consistent(0.01).all()
+
+
+def test_kk_test_stops_at_mu_criterion():
+    spectrum = ZData(F, parse_circuit('R-RC-RC').z(F))
+    result = kk_test(spectrum)
+    assert result.mu <= MU_CRITERION
+    assert result.n_elements == len(result.tau) == result.R.size
+    fewer = kk_test(spectrum, max_elements=result.n_elements - 1)
+    assert fewer.mu > MU_CRITERION
+    capped = kk_test(spectrum, max_elements=2)
+    assert capped.n_elements == 2
+
+
+def test_kk_test_series_matches_single_spectra():
+    other = np.logspace(-1, 5, 41)
+    series = {300: _voigt(), 400: _voigt(scale=0.5),
+              500: _voigt(other), 600: _voigt(scale=2.0)}
+    results = kk_test_series(series)
+    assert list(results) == [300, 400, 500, 600]
+    for key, zdata in series.items():
+        single = kk_test(zdata)
+        assert results[key].n_elements == single.n_elements
+        np.testing.assert_allclose(results[key].z_fit, single.z_fit,
+                                   rtol=1e-9)
+    table = kk_summary(results)
+    assert table.index.name == 'temperature'
+    assert list(table.index) == [300, 400, 500, 600]
+    assert (table['n_elements'] == [results[key].n_elements
+                                    for key in results]).all()
+
+
+def test_kk_result_as_dataframe():
+    result = kk_test(_voigt(), max_elements=R.size)
+    df = result.as_dataframe()
+    assert len(df) == F.size
+    np.testing.assert_allclose(df['Z_re_fit'], result.z_fit.real)
+    np.testing.assert_allclose(df['residual_im'], result.residuals_imag)
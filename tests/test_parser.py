@@ -0,0 +1,78 @@
+# coding: utf-8
+
+"""
+Checks the CDC parser, the canonical forms of circuits and their equality
+and hashing.
+"""
+
+import numpy as np
+import pytest
+
+from automaterials.experiment.eis.circuits import (
+    RQ, C, Gerischer, Q, R, Resistor, SeriesCircuit, WarburgShort)
+from automaterials.experiment.eis.parser import parse_circuit
+
+__author__ = "Rodolpho Mouta"
+__maintainer__ = "Rodolpho Mouta"
+__email__ = "mouta.rodolpho@gmail.com"
+
+"""
+Constants
+"""
+F = np.logspace(-2, 6, 21)
+CIRCUITS = ['R', 'W', 'R-RQ-RQ', 'L-R-(RC//RQ)-Wo', 'R-(R-W)//Q-G',
+            'R-H//TLM-Ws', 'RQ//(R-C)', '(R-Q)//(R-C)//L',
+            'R-(R-(R-Q)//C)//Q']
+
+
+@pytest.mark.parametrize('cdc', CIRCUITS)
+def test_canonical_form_round_trip(cdc: str):
+    circuit = parse_circuit(cdc)
+    canonical = circuit.canonical_form()
+    again = parse_circuit(canonical)
+    assert again.canonical_form() == canonical
+    assert again == circuit
+    assert hash(again) == hash(circuit)
+    np.testing.assert_allclose(again.z(F), circuit.z(F), rtol=1e-12)
+
+
+def test_parse_structure_and_params():
+    circuit = parse_circuit('R-RQ', {'Q1_p': 0.7})
+    assert isinstance(circuit, SeriesCircuit)
+    assert isinstance(circuit.pieces[1], RQ)
+    plan = circuit.compile()
+    assert plan.param_names == ['R1', 'R2', 'Q1_T', 'Q1_p']
+    assert plan.get_params()[3] == 0.7
+    # // takes precedence over -
+    assert parse_circuit('R-RQ//RQ') == parse_circuit('R-(RQ//RQ)')
+
+
+@pytest.mark.parametrize('cdc', ['R-', 'R//(C', 'X', 'R1', ''])
+def test_parse_errors(cdc: str):
+    with pytest.raises(ValueError):
+        parse_circuit(cdc)
+
+
+def test_unknown_parameter():
+    with pytest.raises(ValueError):
+        parse_circuit('R', {'X': 1.0})
+
+
+def test_equality_ignores_order_and_labels():
+    first = R(10.0, label='a') - (R(100.0) // Q(1e-6, 0.8))
+    second = (Q(1e-6, 0.8) // R(100.0, label='b')) - R(10.0)
+    assert first == second
+    assert hash(first) == hash(second)
+    assert first != R(10.0) - (R(100.0) // Q(1e-6, 0.9))
+    # the hash follows the topology, so it survives changes in the values
+    key = hash(first)
+    first.pieces[0].R = 20.0
+    assert hash(first) == key and first != second
+
+
+def test_element_equality_and_hash_agree():
+    assert Gerischer(R=1.0, tau=2.0) != WarburgShort(R=1.0, tau=2.0)
+    assert R(1.0) == Resistor(1.0)
+    assert hash(R(1.0)) == hash(Resistor(1.0))
+    assert R(1.0) != C(1.0)
+    assert len({R(1.0), Resistor(1.0), C(1.0)}) == 2
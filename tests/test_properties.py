@@ -0,0 +1,328 @@
+# coding: utf-8
+
+"""
+Checks the frequency grids, spectra and collections of properties.py.
+"""
+
+import pickle
+
+import numpy as np
+import pytest
+
+from automaterials.experiment.eis.properties import (
+    MAX_CACHED_POWERS, FrequencyGrid, ImpedanceConverter, ZData,
+    ZDataCollection, as_frequency_grid, shared_frequency_grid)
+from automaterials.utils.constants import VACUUM_PERMITTIVITY_SI as E0
+
+__author__ = "Rodolpho Mouta"
+__maintainer__ = "Rodolpho Mouta"
+__email__ = "mouta.rodolpho@gmail.com"
+
+"""
+Constants
+"""
+F = np.logspace(-2, 6, 25)
+Z = (1 + np.arange(F.size)) - 1j*np.arange(F.size)[::-1]
+
+
+def test_grid_tables_are_cached_and_read_only():
+    grid = FrequencyGrid(F)
+    assert not grid.flags.writeable
+    np.testing.assert_allclose(grid.omega, 2*np.pi*F, rtol=1e-15)
+    np.testing.assert_allclose(grid.jomega, 2j*np.pi*F, rtol=1e-15)
+    np.testing.assert_allclose(grid.log_jomega, np.log(2j*np.pi*F),
+                               rtol=1e-14)
+    assert grid.omega is grid.omega
+    assert grid.jomega is grid.jomega
+    with pytest.raises(ValueError):
+        grid.omega[0] = 0.0
+
+
+def test_grid_powers():
+    grid = FrequencyGrid(F)
+    table = grid.jomega_power(0.8)
+    np.testing.assert_allclose(table, (2j*np.pi*F)**0.8, rtol=1e-13)
+    assert grid.jomega_power(0.8) is table
+    for p in np.linspace(0.1, 0.9, MAX_CACHED_POWERS):
+        grid.jomega_power(p)
+    # the oldest table was dropped, and is recomputed
+    assert grid.jomega_power(0.8) is not table
+    np.testing.assert_array_equal(grid.jomega_power(0.8), table)
+
+
+def test_writeable_grids_do_not_cache():
+    grid = FrequencyGrid(F)
+    copy = np.array(grid).view(FrequencyGrid)
+    assert copy.flags.writeable
+    assert copy.omega is not copy.omega
+    # arithmetic gives plain arrays
+    assert type(grid*2) is np.ndarray
+
+
+def test_single_precision_grid():
+    grid = FrequencyGrid(F)
+    single = grid.with_precision(np.complex64)
+    assert single.dtype == np.float32
+    assert single.jomega.dtype == np.complex64
+    assert single.jomega_power(0.5).dtype == np.complex64
+    assert grid.with_precision(np.complex64) is single
+    assert grid.with_precision(complex) is grid
+
+
+def test_as_and_shared_frequency_grids():
+    grid = FrequencyGrid(F)
+    assert as_frequency_grid(grid) is grid
+    assert as_frequency_grid(1e3).shape == (1,)
+    shared = shared_frequency_grid(F)
+    assert shared_frequency_grid(F.copy()) is shared
+    assert shared_frequency_grid(F[:-1]) is not shared
+
+
+def test_zdata_is_read_only():
+    z = Z.copy()
+    zdata = ZData(F, z)
+    z[0] = 0
+    assert zdata.z[0] == Z[0]
+    for array in (zdata.f, zdata.z, zdata.z_real, zdata.z_imag):
+        with pytest.raises(ValueError):
+            array[0] = 1.0
+    assert np.shares_memory(zdata.z_real, zdata.z)
+    assert zdata.f is shared_frequency_grid(F)
+    # copy = False keeps a complex128 array as is
+    assert np.shares_memory(ZData(F, z, copy=False).z, z)
+
+
+def test_zdata_setters_replace_data():
+    zdata = ZData(F, Z)
+    df = zdata.as_dataframe()
+    old = zdata.z
+    zdata.z_real = np.zeros(F.size)
+    np.testing.assert_array_equal(zdata.z_real, 0.0)
+    np.testing.assert_array_equal(zdata.z_imag, Z.imag)
+    np.testing.assert_array_equal(old, Z)
+    zdata.z_imag = np.ones(F.size)
+    np.testing.assert_array_equal(zdata.z, 1j)
+    assert not zdata.z.flags.writeable
+    # the cached DataFrame is dropped with the old data
+    np.testing.assert_array_equal(df['Z_re'], Z.real)
+    np.testing.assert_array_equal(zdata.as_dataframe()['Z_im'], 1.0)
+    zdata.f = 2*F
+    np.testing.assert_array_equal(zdata.f, 2*F)
+    assert zdata.f.omega is zdata.f.omega
+
+
+def test_zdata_slices_are_views():
+    zdata = ZData(F, Z)
+    part = zdata[2:10]
+    assert len(part) == 8
+    assert np.shares_memory(part.z, zdata.z)
+    assert isinstance(part.f, FrequencyGrid)
+    np.testing.assert_array_equal(part.z, Z[2:10])
+    picked = zdata[[0, 3]]
+    np.testing.assert_array_equal(picked.f, F[[0, 3]])
+    np.testing.assert_array_equal(picked.z, Z[[0, 3]])
+
+
+@pytest.mark.parametrize('f', [F, F[::-1]])
+def test_zdata_between(f):
+    zdata = ZData(f, Z)
+    part = zdata.between(1.0, 1e3)
+    inside = (f >= 1.0) & (f <= 1e3)
+    np.testing.assert_array_equal(part.f, f[inside])
+    np.testing.assert_array_equal(part.z, Z[inside])
+    # sorted frequencies give views
+    assert np.shares_memory(part.z, zdata.z)
+    assert len(zdata.between(f_min=1e7)) == 0
+    assert len(zdata.between()) == F.size
+    np.testing.assert_array_equal(zdata.between(f_max=1.0).f,
+                                  f[f <= 1.0])
+
+
+def test_zdata_between_unsorted():
+    order = np.random.default_rng(0).permutation(F.size)
+    zdata = ZData(F[order], Z[order])
+    part = zdata.between(1.0, 1e3)
+    inside = (F[order] >= 1.0) & (F[order] <= 1e3)
+    np.testing.assert_array_equal(part.f, F[order][inside])
+    np.testing.assert_array_equal(part.z, Z[order][inside])
+
+
+def test_zdata_dataframe_is_cached():
+    zdata = ZData(F, Z)
+    df = zdata.as_dataframe()
+    assert list(df.columns) == ['f', 'Z_re', 'Z_im']
+    assert list(zdata.as_dataframe(minus_imag=True).columns) == [
+        'f', 'Z_re', '-Z_im']
+    np.testing.assert_array_equal(
+        zdata.as_dataframe(minus_imag=True)['-Z_im'], -Z.imag)
+    # changes to the returned DataFrame do not reach the next ones
+    df['extra'] = 1
+    assert 'extra' not in zdata.as_dataframe()
+    assert np.shares_memory(zdata.as_dataframe()['Z_re'].to_numpy(),
+                            zdata.z)
+
+
+def test_zdata_pickles():
+    zdata = ZData(F, Z)
+    zdata.as_dataframe()
+    clone = pickle.loads(pickle.dumps(zdata))
+    np.testing.assert_array_equal(clone.z, Z)
+    assert not clone.z.flags.writeable
+    assert isinstance(clone.f, FrequencyGrid)
+    assert not clone.f.flags.writeable
+
+
+def _collection() -> ZDataCollection:
+    """
+    Returns four spectra on F, of samples A and B at two temperatures.
+    """
+    z = np.array([k*Z for k in range(1, 5)])
+    metadata = {'temperature': [400, 300, 400, 300],
+                'sample': ['A', 'A', 'B', 'B']}
+    return ZDataCollection.from_array(F, z, metadata)
+
+
+def _ragged() -> ZDataCollection:
+    spectra = [ZData(F, Z), ZData(F[:10], Z[:10]), ZData(F[5:], 2*Z[5:])]
+    return ZDataCollection(spectra, {'temperature': [300, 400, 500]})
+
+
+def test_collection_uniform_layout():
+    collection = _collection()
+    assert collection.is_uniform and len(collection) == 4
+    assert collection.z.shape == (4, F.size)
+    assert collection.f is shared_frequency_grid(F)
+    assert not collection.z.flags.writeable
+    assert list(collection.metadata.columns[:2]) == ['temperature', 'sample']
+    assert {'sweep', 'dc_level'} <= set(collection.metadata.columns)
+    spectrum = collection[2]
+    assert np.shares_memory(spectrum.z, collection.z)
+    np.testing.assert_array_equal(spectrum.z, 3*Z)
+    np.testing.assert_array_equal(collection.spectrum_index[:, 0],
+                                  [0, 1, 2, 3])
+    # the same spectra, given one by one, get the same layout
+    again = ZDataCollection(list(collection), collection.metadata)
+    assert again.is_uniform
+    np.testing.assert_array_equal(again.z, collection.z)
+    with pytest.raises(ValueError):
+        ZDataCollection.from_array(F, collection.z, {'sample': ['A']})
+
+
+def test_collection_ragged_layout():
+    collection = _ragged()
+    assert not collection.is_uniform
+    np.testing.assert_array_equal(collection.lengths, [F.size, 10,
+                                                       F.size - 5])
+    assert collection.z.shape == (2*F.size + 5,)
+    for spectrum, (f, z) in zip(collection, [(F, Z), (F[:10], Z[:10]),
+                                             (F[5:], 2*Z[5:])]):
+        np.testing.assert_array_equal(spectrum.f, f)
+        np.testing.assert_array_equal(spectrum.z, z)
+    picked = collection[[2, 0]]
+    np.testing.assert_array_equal(picked.lengths, [F.size - 5, F.size])
+    np.testing.assert_array_equal(picked[0].z, 2*Z[5:])
+    assert picked.metadata['temperature'].tolist() == [500, 300]
+
+
+def test_collection_select_and_sort():
+    collection = _collection()
+    selected = collection.select(sample='B')
+    assert len(selected) == 2
+    np.testing.assert_array_equal(selected.z, collection.z[2:])
+    assert len(collection.select(sample='A', temperature=300)) == 1
+    ordered = collection.sort_by('temperature', 'sample')
+    assert ordered.metadata['temperature'].tolist() == [300, 300, 400, 400]
+    assert ordered.metadata['sample'].tolist() == ['A', 'B', 'A', 'B']
+    np.testing.assert_array_equal(ordered[0].z, 2*Z)
+    assert len(collection[1:3]) == 2
+
+
+@pytest.mark.parametrize('build', [_collection, _ragged])
+def test_collection_crop(build):
+    collection = build()
+    cropped = collection.crop(1.0, 1e3)
+    assert len(cropped) == len(collection)
+    for spectrum, whole in zip(cropped, collection):
+        np.testing.assert_array_equal(spectrum.z,
+                                      whole.between(1.0, 1e3).z)
+
+
+def test_collection_from_series_and_back():
+    series = {300: ZData(F, Z), 400: np.column_stack([F, 2*Z.real,
+                                                      2*Z.imag])}
+    collection = ZDataCollection.from_series(series)
+    assert collection.is_uniform
+    assert collection.metadata['temperature'].tolist() == [300, 400]
+    back = collection.as_series('temperature')
+    assert list(back) == [300, 400]
+    np.testing.assert_array_equal(back[400].z, 2*Z)
+    assert list(collection.as_series()) == [0, 1]
+    with pytest.raises(ValueError):
+        _collection().as_series('sample')
+
+
+def test_collection_as_dataframe():
+    collection = _ragged()
+    df = collection.as_dataframe(minus_imag=True)
+    assert len(df) == collection.z.size
+    assert {'spectrum', 'temperature', 'f', 'Z_re', '-Z_im'} <= set(df)
+    rows = df[df['spectrum'] == 1]
+    np.testing.assert_array_equal(rows['f'], F[:10])
+    np.testing.assert_array_equal(rows['-Z_im'], -Z[:10].imag)
+    assert (rows['temperature'] == 400).all()
+
+
+def _rc(R: float = 1e6, C: float = 1e-9) -> ZData:
+    """
+    Returns the spectrum of a resistor R in parallel with a capacitor C.
+    """
+    return ZData(F, 1/(1/R + 2j*np.pi*F*C))
+
+
+def test_converter_values():
+    converter = ImpedanceConverter(_rc(), form_factor=2.0,
+                                   form_factor_unit='mm')
+    s = 2e-3
+    omega = 2*np.pi*F
+    np.testing.assert_allclose(converter.y, 1e-6 + 1j*omega*1e-9)
+    np.testing.assert_allclose(converter.c.real, 1e-9)
+    np.testing.assert_allclose(converter.rho, s*converter.z)
+    np.testing.assert_allclose(converter.epsilon_r.real, 1e-9/(s*E0))
+    np.testing.assert_allclose(converter.loss_tan, 1/(omega*1e6*1e-9))
+    np.testing.assert_allclose(converter.m, 1j*omega*E0*s*converter.z)
+    # resistivity and conductivity are given per cm by default
+    np.testing.assert_allclose(converter.to_property('resistivity'),
+                               100*converter.rho)
+    np.testing.assert_allclose(
+        converter.to_property('rho', unit_type='SI', component='phase'),
+        np.angle(converter.rho, deg=True))
+
+
+def test_converter_is_lazy():
+    converter = ImpedanceConverter(_rc())
+    assert converter._cache == {}
+    sigma = converter.sigma
+    assert set(converter._cache) == {'y', 'sigma'}
+    assert converter.sigma is sigma
+    converter.form_factor = 2.0
+    assert converter._cache == {}
+    np.testing.assert_allclose(converter.sigma, sigma/2)
+    converter.form_factor_unit = 'm'
+    np.testing.assert_allclose(converter.sigma, sigma/200)
+    assert set(converter.output) >= {'impedance', 'loss tangent'}
+
+
+def test_converter_of_collection():
+    collection = ZDataCollection([_rc(), _rc(C=2e-9)],
+                                 {'temperature': [300, 400]})
+    converter = collection.converter()
+    assert converter.c.shape == (2, F.size)
+    np.testing.assert_allclose(converter.c.real[1], 2e-9)
+    stacked = ImpedanceConverter([_rc(), _rc(C=2e-9)])
+    np.testing.assert_allclose(stacked.c, converter.c)
+    df = converter.to_dataframe(['c', 'loss_tan'])
+    assert len(df) == 2*F.size
+    assert {'temperature', 'f', 'c_real', 'c_imag', 'loss_tan'} <= set(df)
+    np.testing.assert_allclose(df['c_real'], converter.c.real.ravel())
+    single = ImpedanceConverter(_rc()).to_dataframe(['rho'], ['magnitude'])
+    assert list(single.columns) == ['f', 'rho_magnitude']
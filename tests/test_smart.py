@@ -0,0 +1,65 @@
+# coding: utf-8
+
+"""
+Checks the keys of the series read from Smart files.
+"""
+
+import numpy as np
+
+from automaterials.experiment.eis.smart import SmartFileReader
+
+__author__ = "Rodolpho Mouta"
+__maintainer__ = "Rodolpho Mouta"
+__email__ = "mouta.rodolpho@gmail.com"
+
+"""
+Constants
+"""
+HEADER = ("Set Ac Level,Sweep Number,Set Point ('C),Frequency (Hz),"
+          "Impedance Real (Ohms),Impedance Imaginary (Ohms)\n")
+
+
+def _reader(tmp_path, set_points, sweeps=None) -> SmartFileReader:
+    """
+    Returns a reader of a file with one two-point sweep per set point,
+    numbered from 1 unless sweeps are given.
+    """
+    lines = [HEADER]
+    sweeps = sweeps or range(1, len(set_points) + 1)
+    for sweep, temperature in zip(sweeps, set_points):
+        lines += [f'0.1,{sweep},{temperature},1000,{10*sweep},-1\n',
+                  f'0.1,{sweep},{temperature},100,{10*sweep + 1},-2\n']
+    filename = tmp_path/'smart.csv'
+    filename.write_text(''.join(lines))
+    return SmartFileReader(str(filename))
+
+
+def test_series_keyed_by_temperature(tmp_path):
+    series = _reader(tmp_path, [100, 200, 300]).get_zdata_series()
+    assert list(series) == [100, 200, 300]
+    np.testing.assert_array_equal(series[200].z, [20 - 1j, 21 - 2j])
+
+
+def test_repeated_temperatures_keep_every_sweep(tmp_path, capsys):
+    series = _reader(tmp_path, [100, 200, 100]).get_zdata_series()
+    assert 'WARNING' in capsys.readouterr().out
+    assert list(series) == [(100, 1), (200, 2), (100, 3)]
+    np.testing.assert_array_equal(series[(100, 3)].z, [30 - 1j, 31 - 2j])
+
+
+def test_sweep_numbers_follow_the_file(tmp_path):
+    reader = _reader(tmp_path, [100, 200, 300], sweeps=[3, 4, 7])
+    collection = reader.get_zdata_collection()
+    assert list(collection.metadata['sweep']) == [3, 4, 7]
+    assert list(collection.metadata['temperature']) == [100, 200, 300]
+    np.testing.assert_array_equal(collection[2].z, [70 - 1j, 71 - 2j])
+    series = reader.get_zdata_series()
+    assert list(series) == [100, 200, 300]
+    np.testing.assert_array_equal(series[300].z, collection[2].z)
+
+
+def test_repeated_temperatures_match_collection_sweeps(tmp_path):
+    reader = _reader(tmp_path, [100, 100], sweeps=[2, 5])
+    assert list(reader.get_zdata_series()) == [(100, 2), (100, 5)]
+    sweeps = reader.get_zdata_collection().metadata['sweep']
+    assert list(sweeps) == [2, 5]
@@ -0,0 +1,117 @@
+# coding: utf-8
+
+"""
+Checks the round trip of spectra and fits through the experiment store.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from automaterials.experiment.eis.fitting import fit
+from automaterials.experiment.eis.parser import parse_circuit
+from automaterials.experiment.eis.properties import ZData, ZDataCollection
+from automaterials.experiment.eis.store import ExperimentStore
+
+__author__ = "Rodolpho Mouta"
+__maintainer__ = "Rodolpho Mouta"
+__email__ = "mouta.rodolpho@gmail.com"
+
+"""
+Constants
+"""
+F = np.logspace(-2, 6, 25)
+Z = (1 + np.arange(F.size)) - 1j*np.arange(F.size)[::-1]
+
+
+def _collection() -> ZDataCollection:
+    """
+    Returns spectra of samples A and B at 300, 400 and 500 K, on
+    consecutive days.
+    """
+    temperatures = [300.0, 400.0, 500.0]*2
+    return ZDataCollection.from_array(
+        F, [k*Z for k in range(1, 7)],
+        {'sample': ['A']*3 + ['B']*3, 'temperature': temperatures,
+         'sweep': [1, 1, 1, 2, 2, 2],
+         'timestamp': pd.date_range('2024-01-01', periods=6, freq='D'),
+         'source': ['a.txt']*3 + ['b.txt']*3})
+
+
+def test_store_round_trip(tmp_path):
+    filename = str(tmp_path/'store.db')
+    collection = _collection()
+    with ExperimentStore(filename) as store:
+        ids = store.add(collection)
+        assert ids == list(range(1, 7))
+    # the data persist after closing the database
+    with ExperimentStore(filename) as store:
+        read = store.query()
+    assert read.is_uniform and len(read) == 6
+    np.testing.assert_array_equal(read.f, F)
+    np.testing.assert_array_equal(read.z, collection.z)
+    metadata = read.metadata
+    assert metadata['measurement_id'].tolist() == ids
+    for column in ('sample', 'temperature', 'sweep', 'source'):
+        assert metadata[column].tolist() == \
+            collection.metadata[column].tolist()
+    assert (metadata['timestamp'] == collection.metadata['timestamp']).all()
+    assert metadata['dc_level'].isna().all()
+
+
+def test_store_ragged_round_trip():
+    spectra = [ZData(F, Z), ZData(F[:10], 2*Z[:10])]
+    with ExperimentStore() as store:
+        store.add(ZDataCollection(spectra, {'temperature': [300.0, 400.0]}),
+                  sample='C')
+        read = store.query(sample='C')
+    assert not read.is_uniform
+    for spectrum, expected in zip(read, spectra):
+        np.testing.assert_array_equal(spectrum.f, expected.f)
+        np.testing.assert_array_equal(spectrum.z, expected.z)
+
+
+def test_store_queries():
+    with ExperimentStore() as store:
+        store.add(_collection())
+        store.add(ZData(F, -Z), sample='A', temperature=350.0)
+        assert len(store.query(sample='A')) == 4
+        assert len(store.query(sample=['A', 'B'])) == 7
+        selected = store.query(sample='A', temperature=(350.0, None))
+        assert selected.metadata['temperature'].tolist() == [350.0, 400.0,
+                                                             500.0]
+        np.testing.assert_array_equal(selected[0].z, -Z)
+        assert len(store.query(temperature=[300.0, 500.0])) == 4
+        assert len(store.query(sweep=2)) == 3
+        recent = store.query(timestamp=('2024-01-03', '2024-01-05'))
+        assert recent.metadata['sample'].tolist() == ['A', 'B', 'B']
+        assert len(store.query(sample='D')) == 0
+        table = store.measurements(sample='B')
+        assert table.index.name == 'measurement_id'
+        assert (table['n_points'] == F.size).all()
+        with pytest.raises(ValueError, match='Unknown metadata'):
+            store.add(ZData(F, Z), operator='X')
+
+
+def test_store_fits():
+    true = {'R1': 10.0, 'R2': 100.0, 'Q1_T': 1e-5, 'Q1_p': 0.85}
+    zdata = ZData(F, parse_circuit('R-RQ', true).z(F))
+    result = fit(parse_circuit('R-RQ', dict(true, R2=80.0)), zdata)
+    with ExperimentStore() as store:
+        measurement_id, = store.add(zdata, sample='A', temperature=300.0)
+        store.add(ZData(F, Z), sample='B')
+        fit_id = store.add_fit(measurement_id, result)
+        table = store.fits()
+        assert table.index.tolist() == [fit_id]
+        row = table.loc[fit_id]
+        assert row['measurement_id'] == measurement_id
+        assert row['sample'] == 'A' and row['temperature'] == 300.0
+        assert row['circuit'] == result.circuit.topology
+        assert row['success']
+        for name, value in result.as_dict().items():
+            assert row[name] == pytest.approx(value)
+            assert row[f'{name}_stderr'] == pytest.approx(
+                result.stderr[name])
+        assert len(store.fits(circuit=result.circuit.topology)) == 1
+        assert store.fits(circuit='R-C').empty
+        assert store.fits(sample='B').empty
@@ -0,0 +1,116 @@
+# coding: utf-8
+
+"""
+Checks the parameter sweeps and the sensitivities of the impedance.
+"""
+
+import copy
+
+import numpy as np
+import pytest
+
+from automaterials.experiment.eis.parser import parse_circuit
+from automaterials.experiment.eis.sweep import sweep, sweep2d
+
+__author__ = "Rodolpho Mouta"
+__maintainer__ = "Rodolpho Mouta"
+__email__ = "mouta.rodolpho@gmail.com"
+
+"""
+Constants
+"""
+F = np.logspace(-2, 6, 33)
+PARAMS = {'R1': 10.0, 'R2': 100.0, 'Q1_T': 1e-5, 'Q1_p': 0.85}
+VALUES = np.array([50.0, 100.0, 200.0])
+
+
+def _circuit():
+    return parse_circuit('R-RQ', PARAMS)
+
+
+def _z_at(circuit, **params):
+    circuit = copy.deepcopy(circuit)
+    plan = circuit.compile()
+    values = plan.get_params().copy()
+    for name, value in params.items():
+        values[plan.param_index[name]] = value
+    plan.set_params(values)
+    return circuit.z(F)
+
+
+def test_sweep_matches_single_evaluations():
+    circuit = _circuit()
+    result = sweep(circuit, 'R2', VALUES, F)
+    assert result.z.shape == (VALUES.size, F.size)
+    assert result.swept == ['R2']
+    for idx, value in enumerate(VALUES):
+        np.testing.assert_allclose(result.z[idx], _z_at(circuit, R2=value),
+                                   rtol=1e-12)
+        assert result.params[idx, 1] == value
+    # the circuit keeps its parameters
+    assert circuit.compile().get_params()[1] == PARAMS['R2']
+    np.testing.assert_allclose(circuit.sweep('R2', VALUES, F).z, result.z)
+
+
+def test_sensitivities_match_finite_differences():
+    circuit = _circuit()
+    result = sweep(circuit, 'R2', VALUES, F)
+    step = 1e-6
+    for idx, value in enumerate(VALUES):
+        point = dict(PARAMS, R2=value)
+        for k, name in enumerate(result.param_names):
+            up = _z_at(circuit,
+                       **dict(point, **{name: point[name]*(1 + step)}))
+            down = _z_at(circuit,
+                         **dict(point, **{name: point[name]*(1 - step)}))
+            # d log(Z)/d log(theta) by central differences
+            expected = (np.log(up) - np.log(down))/(2*step)
+            np.testing.assert_allclose(result.sensitivities[idx, k],
+                                       expected.real, atol=1e-6)
+            np.testing.assert_allclose(result.phase_sensitivities[idx, k],
+                                       expected.imag, atol=1e-6)
+
+
+def test_resistor_sensitivity():
+    result = sweep(parse_circuit('R', {'R1': 5.0}), 'R1', VALUES, F)
+    np.testing.assert_allclose(result.sensitivities, 1.0)
+    np.testing.assert_allclose(result.phase_sensitivities, 0.0, atol=1e-15)
+
+
+def test_sweep2d():
+    circuit = _circuit()
+    values_y = np.array([0.7, 0.9])
+    result = sweep2d(circuit, 'R2', VALUES, 'Q1_p', values_y, F)
+    assert result.z.shape == (VALUES.size, values_y.size, F.size)
+    assert result.sensitivities.shape == (VALUES.size, values_y.size,
+                                          len(PARAMS), F.size)
+    np.testing.assert_allclose(result.z[2, 0],
+                               _z_at(circuit, R2=VALUES[2], Q1_p=0.7),
+                               rtol=1e-12)
+    table = result.as_dataframe()
+    assert len(table) == VALUES.size*values_y.size*F.size
+    assert list(table.columns) == ['R2', 'Q1_p', 'f', 'Z_re', 'Z_im']
+    np.testing.assert_allclose(table['Z_im'], result.z.imag.ravel())
+    with pytest.raises(ValueError):
+        sweep2d(circuit, 'R2', VALUES, 'R2', VALUES, F)
+
+
+def test_sweep_unknown_parameter():
+    with pytest.raises(ValueError, match='Unknown parameter'):
+        sweep(_circuit(), 'R9', VALUES, F)
+
+
+def test_identifiability_flags_redundant_parameters():
+    # two resistors in series cannot be told apart
+    redundant = sweep(parse_circuit('R-R-C'), 'C1', [1e-6, 1e-3], F)
+    assert (redundant.collinearity() > 1e6).all()
+    report = redundant.identifiability()
+    assert report.loc['R1', 'max_correlation'] == pytest.approx(1.0)
+    assert report.loc['R1', 'correlated_with'] == 'R2'
+    # an RQ is identifiable where its arc is inside the frequency range
+    result = sweep(_circuit(), 'R2', VALUES, F)
+    assert (result.collinearity() < 20).all()
+    report = result.identifiability()
+    assert list(report.index) == list(PARAMS)
+    assert (report['max_correlation'] < 0.999).all()
+    assert report.loc['R1', 'f_at_max'] == F[-1]
@@ -0,0 +1,77 @@
+# coding: utf-8
+
+"""
+Checks the enumeration of circuit topologies and the topology search.
+"""
+
+import numpy as np
+import pytest
+
+from automaterials.experiment.eis.parser import parse_circuit
+from automaterials.experiment.eis.properties import ZData
+from automaterials.experiment.eis.topology import (TopologySearch, _children,
+                                                   enumerate_topologies,
+                                                   search_topologies)
+
+__author__ = "Rodolpho Mouta"
+__maintainer__ = "Rodolpho Mouta"
+__email__ = "mouta.rodolpho@gmail.com"
+
+"""
+Constants
+"""
+F = np.logspace(-2, 6, 40)
+TRUE = {'R1': 10.0, 'R2': 100.0, 'C1': 1e-6}
+
+
+def _n_elements(cdc: str) -> int:
+    return len(parse_circuit(cdc).compile().elements)
+
+
+@pytest.mark.parametrize('symbols', [('R', 'C'), ('R', 'C', 'Q', 'L')])
+def test_enumerated_topologies_are_canonical_and_irreducible(symbols):
+    topologies = enumerate_topologies(3, symbols)
+    assert len(set(topologies)) == len(topologies)
+    sizes = [_n_elements(cdc) for cdc in topologies]
+    assert sizes == sorted(sizes) and max(sizes) == 3
+    for cdc in topologies:
+        circuit = parse_circuit(cdc)
+        assert circuit.topology == cdc
+        if _n_elements(cdc) > 1:
+            assert not circuit.simplify().reduces
+
+
+def test_enumerated_topologies_of_resistors_and_capacitors():
+    assert enumerate_topologies(2, ('R', 'C')) == ['R', 'C', 'C-R', 'C//R']
+
+
+def test_children_map_topologies_to_grown_circuits():
+    seen = set()
+    children = _children('C//R', ('R', 'C'), seen)
+    assert set(children) == {'(C//R)-R', '(C-R)//R', '(C//R)-C', '(C-R)//C'}
+    for topology, cdc in children.items():
+        assert parse_circuit(cdc).topology == topology
+    assert set(children) <= seen
+    # already seen topologies are not returned again
+    assert _children('C//R', ('R', 'C'), seen) == {}
+
+
+def test_search_finds_the_generating_circuit():
+    zdata = ZData(F, parse_circuit('R-RC', TRUE).z(F))
+    table = search_topologies(zdata, max_elements=3, symbols=('R', 'C'),
+                              processes=1)
+    best = table.iloc[0]
+    assert best['topology'] == '(C//R)-R'
+    assert best['n_elements'] == 3
+    assert best['chi2'] < 1e-12
+    assert table['aic'].is_monotonic_increasing
+
+
+def test_search_reuses_fits_of_the_same_spectrum():
+    zdata = ZData(F, parse_circuit('R-RC', TRUE).z(F))
+    search = TopologySearch(max_elements=2, symbols=('R', 'C'), processes=1)
+    first = search.run(zdata)
+    assert set(search.cache) == set(first['topology'])
+    second = search.run(zdata)
+    assert list(second['topology']) == list(first['topology'])
+    assert list(second['nfev']) == list(first['nfev'])
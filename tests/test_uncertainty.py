@@ -0,0 +1,102 @@
+# coding: utf-8
+
+"""
+Checks the bootstrap and Monte Carlo uncertainty of fitted parameters.
+"""
+
+import numpy as np
+import pytest
+
+from automaterials.experiment.eis.fitting import fit
+from automaterials.experiment.eis.parser import parse_circuit
+from automaterials.experiment.eis.properties import ZData
+from automaterials.experiment.eis.uncertainty import (
+    UncertaintyResult, bootstrap, derived_quantities)
+
+__author__ = "Rodolpho Mouta"
+__maintainer__ = "Rodolpho Mouta"
+__email__ = "mouta.rodolpho@gmail.com"
+
+"""
+Constants
+"""
+F = np.logspace(-2, 6, 50)
+CDC = 'R-RC-RQ'
+TRUE = {'R1': 10.0, 'R2': 100.0, 'C1': 1e-6, 'R3': 1000.0,
+        'Q1_T': 1e-4, 'Q1_p': 0.8}
+NOISE = 0.005
+
+
+def _fitted():
+    """
+    Returns a noisy spectrum of CDC with TRUE and the fit to it.
+    """
+    rng = np.random.default_rng(0)
+    z = parse_circuit(CDC, TRUE).z(F)
+    z = z + NOISE*np.abs(z)*(rng.normal(size=F.size) +
+                             1j*rng.normal(size=F.size))
+    zdata = ZData(F, z)
+    return fit(parse_circuit(CDC, TRUE), zdata), zdata
+
+
+@pytest.mark.parametrize('method', ['residuals', 'noise'])
+def test_bootstrap_spread_matches_fit_errors(method):
+    result, zdata = _fitted()
+    uncertainty = bootstrap(result, zdata, n_samples=60, method=method,
+                            processes=1, seed=1)
+    assert uncertainty.n_samples == 60
+    assert uncertainty.n_failed == 0
+    summary = uncertainty.percentiles()
+    for name, value in TRUE.items():
+        std = summary.loc[name, 'std']
+        assert 0.3 < std/result.stderr[name] < 3
+        assert summary.loc[name, 'value'] == result.as_dict()[name]
+        low, high = summary.loc[name, '2.5%'], summary.loc[name, '97.5%']
+        assert low - 3*std < value < high + 3*std
+
+
+def test_bootstrap_does_not_depend_on_processes():
+    result, zdata = _fitted()
+    serial = bootstrap(result, zdata, n_samples=8, processes=1, seed=3)
+    pooled = bootstrap(result, zdata, n_samples=8, processes=2, seed=3)
+    np.testing.assert_array_equal(serial.samples, pooled.samples)
+    other = bootstrap(result, zdata, n_samples=8, processes=1, seed=4)
+    assert not np.array_equal(serial.samples, other.samples)
+
+
+def test_bootstrap_unsupported_method(capsys):
+    result, zdata = _fitted()
+    uncertainty = bootstrap(result, zdata, n_samples=4, method='jackknife',
+                            processes=1, seed=1)
+    assert 'WARNING' in capsys.readouterr().out
+    reference = bootstrap(result, zdata, n_samples=4, processes=1, seed=1)
+    np.testing.assert_array_equal(uncertainty.samples, reference.samples)
+
+
+def test_derived_quantities():
+    circuit = parse_circuit(CDC, TRUE)
+    params = circuit.compile().get_params()
+    derived = derived_quantities(circuit, np.array([params, 2*params]))
+    rc, rq = circuit.pieces[1], circuit.pieces[2]
+    assert set(derived) == {'R2//C1_relax_freq', 'R3//Q1_C',
+                            'R3//Q1_relax_freq'}
+    assert derived['R2//C1_relax_freq'][0] == pytest.approx(rc.relax_freq)
+    assert derived['R3//Q1_C'][0] == pytest.approx(rq.C)
+    assert derived['R3//Q1_relax_freq'][0] == pytest.approx(rq.relax_freq)
+    # doubling R and C divides the relaxation frequency by 4
+    assert derived['R2//C1_relax_freq'][1] == pytest.approx(
+        rc.relax_freq/4)
+
+
+def test_uncertainty_skips_failed_samples():
+    samples = np.array([[1.0, 2.0], [np.nan, np.nan], [3.0, 4.0]])
+    uncertainty = UncertaintyResult(['R1', 'R2'], samples,
+                                    {'R1_x': samples[:, 0]*10},
+                                    {'R1': 2.0, 'R2': 3.0})
+    assert uncertainty.n_samples == 3 and uncertainty.n_failed == 1
+    table = uncertainty.as_dataframe()
+    assert list(table.columns) == ['R1', 'R2', 'R1_x']
+    np.testing.assert_array_equal(table['R1_x'], [10.0, 30.0])
+    summary = uncertainty.percentiles(q=(50.0,))
+    assert summary.loc['R2', '50%'] == 3.0
+    assert summary.loc['R1', 'value'] == 2.0